@@ -1,20 +1,126 @@
 """The generator CLI utility; can be extended."""
-from dbsg.lib.configuration import Setup
+from logging import getLogger
+from signal import SIGTERM, signal
+
+from dbsg.lib import artifact
+from dbsg.lib.configuration import Configuration, Setup
+from dbsg.lib.diff import track
 from dbsg.lib.introspection import Inspect
 from dbsg.lib.intermediate_representation import Abstract
 from dbsg.lib.plugin import Handler
+from dbsg.lib.watch import Watch
+
+LOG = getLogger(__name__)
+
+
+def introspect(configuration: Configuration):
+    """Introspect the DBs into the introspection artifact."""
+    try:
+        introspection = Inspect(configuration).introspection()
+        artifact.save(
+            artifact.artifact(configuration.artifact_path, 'introspection'),
+            'introspection',
+            artifact.materialize(introspection),
+        )
+    finally:
+        configuration.disconnect()
+
+
+def build_ir(configuration: Configuration):
+    """Build the IR artifact of the introspection artifact."""
+    introspection = artifact.load(
+        artifact.artifact(configuration.artifact_path, 'introspection'),
+        'introspection',
+    )
+    ir = Abstract(
+        introspection,
+        configuration.ir_workers,
+        configuration.share_types,
+    ).intermediate_representation()
+    artifact.save(
+        artifact.artifact(configuration.artifact_path, 'ir'),
+        'ir',
+        ir,
+    )
+
+
+def emit(configuration: Configuration) -> int:
+    """Run the plugins over the artifacts; there is no DB access."""
+    ir = artifact.load(
+        artifact.artifact(configuration.artifact_path, 'ir'),
+        'ir',
+    )
+    # The introspection is needed by some plugins (e.g. raw-introspection)
+    introspection_path = artifact.artifact(
+        configuration.artifact_path,
+        'introspection',
+    )
+    introspection = []
+    if introspection_path.is_file():
+        introspection = artifact.load(introspection_path, 'introspection')
+
+    handler = Handler(configuration, introspection, ir)
+    handler.save()
+    track(configuration, ir)
+    return 1 if handler.failed else 0
+
+
+# The commands that run a single phase
+PHASES = {
+    'introspect': introspect,
+    'build-ir': build_ir,
+    'emit': emit,
+}
 
 
 def main():
     """Call default generator implementation."""
     configuration = Setup().configuration()
-    introspection = Inspect(configuration).introspection()
-    ir = Abstract(introspection).intermediate_representation()
 
-    for plugin in Handler(configuration, introspection, ir):
-        plugin.save()
+    if configuration.command == 'watch':
+        watch = Watch(configuration)
+        signal(SIGTERM, lambda *_: watch.stop.set())
+        try:
+            watch.run()
+        except KeyboardInterrupt:
+            watch.stop.set()
+        return 0
+
+    if configuration.command in PHASES:
+        try:
+            return PHASES[configuration.command](configuration) or 0
+        except artifact.ArtifactError as error:
+            LOG.error(error)
+            return 1
+
+    try:
+        if configuration.compare_strategies:
+            for comparison in Inspect(configuration).compare_strategies():
+                print(comparison)  # noqa: T001
+            return 0
+
+        introspection = Inspect(configuration).introspection()
+        abstract = Abstract(
+            introspection,
+            configuration.ir_workers,
+            configuration.share_types,
+        )
+
+        if configuration.streaming:
+            # The plugins consume the IR while the rows are being fetched
+            handler = Handler(configuration, introspection, [])
+            ir = handler.stream(abstract.stream())
+        else:
+            ir = abstract.intermediate_representation()
+            handler = Handler(configuration, introspection, ir)
+            handler.save()
+
+        track(configuration, ir)
+    finally:
+        # The streaming introspection needs the pools until the end
+        configuration.disconnect()
 
-    return 0
+    return 1 if handler.failed else 0
 
 
 if __name__ == '__main__':
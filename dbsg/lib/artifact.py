@@ -0,0 +1,111 @@
+"""
+Persisted Introspection and IR artifacts, so the phases can run separately.
+
+.. code-block:: bash
+
+    dbsg introspect  # the DBs -> .dbsg/introspection.dbsg
+    dbsg build-ir  # .dbsg/introspection.dbsg -> .dbsg/ir.dbsg
+    dbsg emit --plugins json python3.7  # .dbsg/ir.dbsg -> the stubs
+
+So a host with the DB access may introspect once, and the build agents may
+emit the plugins' outputs without the DB access ("artifact_path" or
+"--artifact-path" is the directory of the artifacts).
+
+An artifact is a gzipped stream of two pickles: a header (the format, its
+version and the kind of the payload), and the payload. The header is checked
+before the payload is unpickled, and ARTIFACT_VERSION is bumped whenever
+the pickled types are changed. Pickles may execute code while loading, so
+load the artifacts of the trusted hosts only.
+"""
+from dataclasses import replace
+from gzip import GzipFile
+from logging import getLogger
+from pathlib import Path
+import pickle  # noqa: S403
+from typing import Any, Mapping
+
+from dbsg.lib.introspection import Introspection
+
+LOG = getLogger(__name__)
+
+ARTIFACT_FORMAT = 'dbsg-artifact'
+ARTIFACT_VERSION = 2
+# 4 is the highest protocol of Python 3.7
+ARTIFACT_PROTOCOL = 4
+ARTIFACT_COMPRESSLEVEL = 6
+ARTIFACT_FILES: Mapping[str, str] = {
+    'introspection': 'introspection.dbsg',
+    'ir': 'ir.dbsg',
+}
+
+
+class ArtifactError(ValueError):
+    """The artifact is missing, broken, of another kind or version."""
+
+
+def artifact(directory: Path, kind: str) -> Path:
+    """Make the path of the kind ("introspection" or "ir") of artifact."""
+    return directory / ARTIFACT_FILES[kind]
+
+
+def materialize(introspection: Introspection) -> Introspection:
+    """Fetch the streamed rows (see RowStream), so they can be pickled."""
+    return [
+        replace(db, schemes=[
+            replace(schema, rows=list(schema.rows)) for schema in db.schemes
+        ])
+        for db in introspection
+    ]
+
+
+def save(path: Path, kind: str, payload: Any):
+    """Persist the payload (Introspection or IR) as the kind of artifact."""
+    header = {
+        'format': ARTIFACT_FORMAT,
+        'version': ARTIFACT_VERSION,
+        'kind': kind,
+    }
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # mtime=0, so the same payload makes the same artifact
+    with path.open('wb') as raw, GzipFile(
+        fileobj=raw,
+        mode='wb',
+        compresslevel=ARTIFACT_COMPRESSLEVEL,
+        mtime=0,
+    ) as fh:
+        pickle.dump(header, fh, protocol=ARTIFACT_PROTOCOL)
+        pickle.dump(payload, fh, protocol=ARTIFACT_PROTOCOL)
+    LOG.info(f'The {kind} artifact has been saved into {path}.')
+
+
+def load(path: Path, kind: str) -> Any:
+    """Load the kind of artifact, checking its header."""
+    if not path.is_file():
+        raise ArtifactError(f'There is no {kind} artifact: {path}.')
+
+    # Every pickle has its own memo, so they are loaded by their own unpicklers
+    with GzipFile(path, mode='rb') as fh:
+        header = unpickle(path, fh)
+
+        if not isinstance(header, dict) or (
+            header.get('format') != ARTIFACT_FORMAT
+        ):
+            raise ArtifactError(f'The {path} is not an artifact.')
+        if header.get('version') != ARTIFACT_VERSION:
+            raise ArtifactError(
+                f'The artifact {path} has version {header.get("version")}, '
+                + f'but {ARTIFACT_VERSION} is expected. Make it again.',
+            )
+        if header.get('kind') != kind:
+            raise ArtifactError(
+                f'The artifact {path} is {header.get("kind")}, not {kind}.',
+            )
+        return unpickle(path, fh)
+
+
+def unpickle(path: Path, fh: GzipFile) -> Any:
+    """Load the next pickle of the artifact; it's broken if it fails."""
+    try:
+        return pickle.load(fh)  # noqa: S301
+    except Exception as error:  # noqa: B902
+        raise ArtifactError(f'The artifact {path} is broken.') from error
@@ -0,0 +1,595 @@
+"""
+Synthetic catalogs and the generator benchmark.
+
+The benchmark makes offline catalogs (see dbsg.lib.catalog) of the given
+shape, and runs the generator stages against them one by one, measuring
+their elapsed time, throughput, peak and retained memory:
+
+.. code-block:: bash
+
+    python -m dbsg.lib.benchmark --packages 1000 --routines 100 --depth 2
+
+The peak memory is the peak of the memory allocated during a stage, and the
+retained memory is the memory still allocated after it, i.e. the footprint
+of its result, e.g. the IR (see tracemalloc). The footprint of the IR is
+compared with the baseline's one too: the same IR, but unslotted and
+uninterned (see baseline_ir). Tracing slows the stages down, so use
+--no-memory for the timings. The report can be saved with
+--report, and compared with a previous one with --baseline: any stage that
+is slower than the baseline by more than the tolerance is a regression (and
+the exit code is 1).
+"""
+from __future__ import annotations
+
+from argparse import ArgumentParser
+from copy import deepcopy
+from dataclasses import (
+    asdict,
+    dataclass,
+    field,
+    fields,
+    is_dataclass,
+    make_dataclass,
+)
+from functools import partial
+from json import dumps, load
+from pathlib import Path
+from random import Random
+from tempfile import mkdtemp
+from time import perf_counter
+from tracemalloc import get_traced_memory
+from tracemalloc import start as start_tracing
+from tracemalloc import stop as stop_tracing
+from typing import (
+    Any,
+    Callable,
+    Iterator,
+    List,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+)
+
+from yaml import safe_dump
+
+from dbsg.lib.catalog import Catalog
+from dbsg.lib.configuration import FQDN, Setup
+from dbsg.lib.intermediate_representation import (
+    IR,
+    Abstract,
+    ComplexArgument,
+    Database,
+    Package,
+    Routine,
+    Schema,
+    SimpleArgument,
+)
+from dbsg.lib.introspection import Inspect
+from dbsg.lib.plugin import Handler
+
+SIMPLE_TYPES = ('VARCHAR2', 'NUMBER', 'DATE')
+
+# The rates of functions (among routines) and defaulted (among arguments)
+FUNCTION_RATE = 0.5
+DEFAULTED_RATE = 0.2
+
+# The first object_id of every DB
+FIRST_OBJECT_ID = 100000
+
+MIB = 1024 * 1024
+
+# The IR types of the baseline (see baseline_ir)
+IR_TYPES = (
+    Database,
+    Schema,
+    Package,
+    Routine,
+    FQDN,
+    SimpleArgument,
+    ComplexArgument,
+)
+
+# The Name, Data Type, Custom Type (owner, name, subname) and Children
+Node = Tuple[
+    Optional[str],
+    str,
+    Tuple[Optional[str], Optional[str], Optional[str]],
+    Sequence[Any],
+]
+
+
+# **************************Synthetic Catalog Types**************************
+@dataclass
+class SyntheticCatalog:
+    """
+    Shape of a synthetic catalog.
+
+    Every DB has the same Schemes; every Schema has the same packages and
+    standalone routines; every routine has the same number of top level
+    arguments. Complex arguments are OBJECTs nested up to the depth (function
+    results are TABLEs of such OBJECTs); zero depth means simple arguments
+    only. The same seed makes the same catalog.
+    """
+
+    databases: int = field(default=1)
+    schemes: int = field(default=1)
+    packages: int = field(default=10)
+    # Per package
+    routines: int = field(default=10)
+    # Per Schema
+    standalone: int = field(default=1)
+    # Per routine
+    arguments: int = field(default=5)
+    overload_rate: float = field(default=0.1)
+    complex_rate: float = field(default=0.2)
+    depth: int = field(default=1)
+    seed: int = field(default=0)
+
+    @property
+    def database_names(self) -> List[str]:
+        """Make the DB names."""
+        return [f'DB_{i}' for i in range(self.databases)]
+
+    @property
+    def schema_names(self) -> List[str]:
+        """Make the Schema names."""
+        return [f'SCHEMA_{i}' for i in range(self.schemes)]
+
+    @property
+    def routine_count(self) -> int:
+        """Count the routines (not subprograms) of the whole catalog."""
+        per_schema = self.packages * self.routines + self.standalone
+        return self.databases * self.schemes * per_schema
+
+    @staticmethod
+    def no_package_name(schema: str) -> str:
+        """Make the Schema's no_package_name."""
+        return f'{schema}_NO_PKG'
+
+    def rows(self, database: int) -> Iterator[list]:
+        """Make raw introspection rows (see IntrospectionRow) of the DB."""
+        rng = Random(f'{self.seed}.{database}')
+        object_id = FIRST_OBJECT_ID
+        for schema in self.schema_names:
+            for package_index in range(self.packages):
+                package = f'PKG_{package_index}'
+                subprogram_id = 0
+                for routine_index in range(self.routines):
+                    overloads: Sequence[Optional[int]] = [None]
+                    if rng.random() < self.overload_rate:
+                        overloads = [1, 2]
+                    for overload in overloads:
+                        subprogram_id += 1
+                        yield from self._routine(
+                            rng,
+                            (schema, package, 1, f'ROUTINE_{routine_index}'),
+                            (object_id, overload, subprogram_id),
+                        )
+                object_id += 1
+            for standalone_index in range(self.standalone):
+                yield from self._routine(
+                    rng,
+                    (
+                        schema,
+                        self.no_package_name(schema),
+                        0,
+                        f'STANDALONE_{standalone_index}',
+                    ),
+                    (object_id, None, 1),
+                )
+                object_id += 1
+
+    def populate(self, catalog: Catalog, database: int):
+        """Load the DB's rows into the catalog."""
+        catalog.load(self.rows(database))
+
+    def _routine(self, rng: Random, names: tuple, ids: tuple) -> Iterator:
+        """Make the rows of a single subprogram."""
+        schema, package, is_package, routine = names
+        object_id, overload, subprogram_id = ids
+        is_function = rng.random() < FUNCTION_RATE
+
+        nodes: MutableSequence[Node] = []
+        if is_function:
+            nodes.append(self._argument(rng, schema, None))
+        for index in range(self.arguments):
+            nodes.append(self._argument(rng, schema, f'IN_ARG_{index}'))
+
+        in_out = 'IN'
+        sequence = 0
+        for node, level, position, defaulted in self._flatten(rng, nodes):
+            sequence += 1
+            argument, data_type, custom_type, _ = node
+            if level == 0:
+                in_out = 'OUT' if position == 0 else 'IN'
+            if argument is None and level == 0:
+                argument = '_DBSG_RESULT'
+            yield [
+                schema,
+                package,
+                is_package,
+                routine,
+                'FUNCTION' if is_function else 'PROCEDURE',
+                object_id,
+                overload,
+                subprogram_id,
+                argument,
+                position,
+                sequence,
+                level,
+                data_type,
+                *custom_type,
+                'Y' if defaulted else 'N',
+                None,
+                in_out,
+            ]
+
+    def _argument(
+        self,
+        rng: Random,
+        schema: str,
+        name: Optional[str],
+    ) -> Node:
+        """Make a top level argument (a function result if name is None)."""
+        if self.depth and rng.random() < self.complex_rate:
+            if name is None:
+                return (
+                    name,
+                    'TABLE',
+                    (schema, f'TABLE_L{self.depth}_T', None),
+                    [self._object(schema, None, self.depth)],
+                )
+            return self._object(schema, name, self.depth)
+        return (name, rng.choice(SIMPLE_TYPES), (None, None, None), [])
+
+    def _object(self, schema: str, name: Optional[str], depth: int) -> Node:
+        """Make an OBJECT argument, nested up to the depth."""
+        fields: MutableSequence[Node] = [
+            ('ID', 'NUMBER', (None, None, None), []),
+            ('NAME', 'VARCHAR2', (None, None, None), []),
+        ]
+        if depth > 1:
+            fields.append(self._object(schema, 'CHILD', depth - 1))
+        return (name, 'OBJECT', (schema, f'OBJECT_L{depth}_T', None), fields)
+
+    @staticmethod
+    def _flatten(
+        rng: Random,
+        nodes: Sequence[Node],
+        level: int = 0,
+    ) -> Iterator[Tuple[Node, int, int, bool]]:
+        """Flatten the nodes: (node, data_level, position, defaulted)."""
+        # A function result has zero position
+        start = 0 if level == 0 and nodes and nodes[0][0] is None else 1
+        for position, node in enumerate(nodes, start=start):
+            defaulted = (
+                level == 0 and position > 1 and rng.random() < DEFAULTED_RATE
+            )
+            yield node, level, position, defaulted
+            yield from SyntheticCatalog._flatten(rng, node[3], level + 1)
+# **************************Synthetic Catalog Types**************************
+
+
+# ******************************Benchmark Types*******************************
+@dataclass
+class Stage:
+    """Elapsed time, throughput and memory of a generator stage."""
+
+    name: str
+    elapsed: float
+    routines: int
+    # None if the memory isn't traced
+    peak: Optional[int] = field(default=None)
+    retained: Optional[int] = field(default=None)
+
+    @property
+    def throughput(self) -> float:
+        """Count routines per second."""
+        return self.routines / self.elapsed if self.elapsed else 0
+
+    def __str__(self):
+        """Make a report line."""
+        peak, retained = (
+            'n/a' if memory is None else f'{memory / MIB:.1f} MiB'
+            for memory in (self.peak, self.retained)
+        )
+        return (
+            f'{self.name:<38} {self.elapsed:>9.3f}s '
+            + f'{self.throughput:>12.1f} routines/s {peak:>12} {retained:>12}'
+        )
+
+
+class BenchmarkSetup(Setup):
+    """Setup of a benchmark config; the CLI arguments are ignored."""
+
+    def __init__(self, path: Path):  # pylint: disable=W0231
+        """Initialize the config without CLI."""
+        self.cli: MutableMapping = {}
+        self.path = str(path)
+
+
+class Benchmark:
+    """
+    The generator benchmark against a synthetic catalog.
+
+    Use .prepare() to make the catalogs and the config, and .run() to run
+    the stages.
+    """
+
+    def __init__(
+        self,
+        synthetic: SyntheticCatalog,
+        path: Path,
+        plugins: Sequence[str] = ('json',),
+        memory: bool = True,
+        options: Optional[MutableMapping] = None,
+    ):
+        """
+        Initialize the benchmark in the working directory.
+
+        The options are the generator's config options (e.g. ir_workers).
+        """
+        self.synthetic = synthetic
+        self.path = path
+        self.plugins = list(plugins)
+        self.memory = memory
+        self.options = options or {}
+
+    @property
+    def config_path(self) -> Path:
+        """Make the benchmark config path."""
+        return self.path / 'dbsg_config.yml'
+
+    def prepare(self) -> Path:
+        """Make the synthetic catalogs and their config."""
+        self.path.mkdir(parents=True, exist_ok=True)
+        databases = []
+        for index, name in enumerate(self.synthetic.database_names):
+            catalog_path = self.path / f'{name.lower()}.sqlite'
+            if catalog_path.exists():
+                catalog_path.unlink()
+            catalog = Catalog(catalog_path)
+            self.synthetic.populate(catalog, index)
+            catalog.close()
+            databases.append({
+                'name': name,
+                'catalog': str(catalog_path),
+                'pool': {
+                    'user': 'benchmark',
+                    'password': 'benchmark',
+                    'dsn': {'host': 'localhost', 'port': 1521},
+                    'min': 4,
+                    'max': 4,
+                },
+                'schemes': [
+                    {
+                        'name': schema,
+                        'no_package_name': self.synthetic.no_package_name(
+                            schema,
+                        ),
+                    }
+                    for schema in self.synthetic.schema_names
+                ],
+            })
+
+        config = {
+            'path': str(self.path / 'stubs'),
+            'snapshot_path': str(self.path / '.dbsg'),
+            'full': True,
+            'plugins': self.plugins,
+            'databases': databases,
+            'logging': {
+                'version': 1,
+                'disable_existing_loggers': False,
+                'root': {'handlers': [], 'level': 'WARNING'},
+                'loggers': {},
+            },
+        }
+        config.update(self.options)
+        with self.config_path.open('w', encoding='utf8') as fh:
+            safe_dump(config, fh)
+        return self.config_path
+
+    def run(self) -> MutableSequence[Stage]:
+        """Run the generator stages one by one."""
+        stages: MutableSequence[Stage] = []
+        configuration = self.measure(
+            stages,
+            'Setup.configuration',
+            BenchmarkSetup(self.config_path).configuration,
+        )
+        try:
+            introspection = self.measure(
+                stages,
+                'Inspect.introspection',
+                Inspect(configuration).introspection,
+            )
+            ir = self.measure(
+                stages,
+                'Abstract.intermediate_representation',
+                Abstract(
+                    introspection,
+                    configuration.ir_workers,
+                    configuration.share_types,
+                ).intermediate_representation,
+            )
+            if self.memory:
+                self.compare_memory(stages, ir)
+            for plugin in Handler(configuration, introspection, ir):
+                self.measure(stages, f'{plugin.name()}.save', plugin.save)
+        finally:
+            configuration.disconnect()
+        return stages
+
+    def compare_memory(self, stages: MutableSequence[Stage], ir: IR):
+        """Measure the footprints of the IR and of the baseline's one."""
+        classes: MutableMapping[type, type] = {
+            cls: unslotted(cls) for cls in IR_TYPES
+        }
+        self.measure(stages, 'IR.footprint', partial(deepcopy, ir))
+        self.measure(
+            stages,
+            'IR.footprint (unslotted, uninterned)',
+            partial(baseline_ir, ir, classes),
+        )
+
+    def measure(
+        self,
+        stages: MutableSequence[Stage],
+        name: str,
+        target: Callable,
+    ) -> Any:
+        """Run the stage, append its measurements and return its result."""
+        if self.memory:
+            start_tracing()
+        started = perf_counter()
+        try:
+            result = target()
+            elapsed = perf_counter() - started
+            retained, peak = None, None
+            if self.memory:
+                retained, peak = get_traced_memory()
+        finally:
+            if self.memory:
+                stop_tracing()
+        stages.append(Stage(
+            name=name,
+            elapsed=elapsed,
+            routines=self.synthetic.routine_count,
+            peak=peak,
+            retained=retained,
+        ))
+        return result
+
+
+def unslotted(cls: type) -> type:
+    """Make a plain (unslotted) dataclass of the same fields."""
+    return make_dataclass(
+        cls.__name__,
+        [(f.name, f.type) for f in fields(cls)],
+    )
+
+
+def baseline_ir(value: Any, classes: MutableMapping[type, type]) -> Any:
+    """Copy the IR as if it were unslotted and uninterned (the baseline)."""
+    if is_dataclass(value):
+        cls = type(value)
+        if cls not in classes:
+            classes[cls] = unslotted(cls)
+        return classes[cls](**{
+            f.name: baseline_ir(getattr(value, f.name), classes)
+            for f in fields(value)
+        })
+    if isinstance(value, list):
+        return [baseline_ir(item, classes) for item in value]
+    if isinstance(value, str):
+        # Every fetched row has its own strings, unless they are interned
+        return value.encode('utf8').decode('utf8')
+    return value
+
+
+def regressions(
+    stages: Sequence[Stage],
+    baseline: Sequence[MutableMapping],
+    tolerance: float = 0.2,
+) -> List[str]:
+    """Find the stages that are slower than the baseline ones."""
+    previous = {s['name']: s for s in baseline}
+    found = []
+    for stage in stages:
+        if stage.name not in previous:
+            continue
+        limit = previous[stage.name]['elapsed'] * (1 + tolerance)
+        if stage.elapsed > limit:
+            found.append(
+                f'{stage.name} is slower: {stage.elapsed:.3f}s '
+                + f'(the baseline is {previous[stage.name]["elapsed"]:.3f}s)',
+            )
+    return found
+# ******************************Benchmark Types*******************************
+
+
+# *******************************Benchmark CLI********************************
+BenchmarkInterface = ArgumentParser(
+    prog='python -m dbsg.lib.benchmark',
+    description='Benchmark the generator against a synthetic catalog.',
+)
+BenchmarkInterface.add_argument('--databases', type=int, default=1)
+BenchmarkInterface.add_argument('--schemes', type=int, default=1)
+BenchmarkInterface.add_argument('--packages', type=int, default=10)
+BenchmarkInterface.add_argument('--routines', type=int, default=10)
+BenchmarkInterface.add_argument('--standalone', type=int, default=1)
+BenchmarkInterface.add_argument('--arguments', type=int, default=5)
+BenchmarkInterface.add_argument('--overload-rate', type=float, default=0.1)
+BenchmarkInterface.add_argument('--complex-rate', type=float, default=0.2)
+BenchmarkInterface.add_argument('--depth', type=int, default=1)
+BenchmarkInterface.add_argument('--seed', type=int, default=0)
+BenchmarkInterface.add_argument('--plugins', nargs='*', default=['json'])
+BenchmarkInterface.add_argument(
+    '--path',
+    type=Path,
+    default=None,
+    help='The working directory (a temporary one by default).',
+)
+BenchmarkInterface.add_argument(
+    '--no-memory',
+    action='store_false',
+    dest='memory',
+    help='Do not trace the memory (it slows the stages down).',
+)
+BenchmarkInterface.add_argument('--ir-workers', type=int, default=1)
+BenchmarkInterface.add_argument('--share-types', action='store_true')
+BenchmarkInterface.add_argument('--report', type=Path, default=None)
+BenchmarkInterface.add_argument('--baseline', type=Path, default=None)
+BenchmarkInterface.add_argument('--tolerance', type=float, default=0.2)
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    """Run the benchmark and print the report."""
+    args = BenchmarkInterface.parse_args(argv)
+    synthetic = SyntheticCatalog(
+        databases=args.databases,
+        schemes=args.schemes,
+        packages=args.packages,
+        routines=args.routines,
+        standalone=args.standalone,
+        arguments=args.arguments,
+        overload_rate=args.overload_rate,
+        complex_rate=args.complex_rate,
+        depth=args.depth,
+        seed=args.seed,
+    )
+    path = args.path or Path(mkdtemp(prefix='dbsg-benchmark-'))
+    benchmark = Benchmark(
+        synthetic,
+        path,
+        args.plugins,
+        args.memory,
+        {'ir_workers': args.ir_workers, 'share_types': args.share_types},
+    )
+    benchmark.prepare()
+    stages = benchmark.run()
+
+    # The report is the CLI output
+    print(f'{synthetic} in {path}')  # noqa: T001
+    for stage in stages:
+        print(stage)  # noqa: T001
+
+    if args.report is not None:
+        args.report.write_text(dumps([asdict(s) for s in stages], indent=4))
+
+    if args.baseline is not None:
+        with args.baseline.open('r', encoding='utf8') as fh:
+            found = regressions(stages, load(fh), args.tolerance)
+        for regression in found:
+            print(regression)  # noqa: T001
+        return 1 if found else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
+# *******************************Benchmark CLI********************************
@@ -0,0 +1,365 @@
+"""
+Offline catalog: an SQLite stand-in for the Oracle data dictionary.
+
+The catalog emulates sys.all_objects, sys.all_procedures, sys.all_arguments
+(and their dba_* twins), and executes the real introspection SQL, adapted to
+the SQLite dialect. So the introspection (filters, sharding, strategies) can
+be tested and benchmarked without Oracle, against a catalog of any size.
+
+Use it with the "catalog" DB option (a path to an SQLite file):
+
+.. code-block:: yaml
+
+    databases:
+      - name: db_name
+        catalog: catalog.sqlite
+        pool: ...
+
+The SQLite dialect is close enough: it has row values, window functions,
+substr() and instr(). The rest is adapted:
+
+- ``table(:collection)`` is ``json_each(:collection)``, and the collections
+  are bound as JSON arrays
+- ``nvl()`` is a user-defined function
+- ``rownum`` is a constant, so probes select everything
+- ``sys`` is the attached catalog database
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from functools import lru_cache
+from json import dumps
+from pathlib import Path
+from re import compile as re_compile
+from sqlite3 import Connection as SQLiteConnection
+from sqlite3 import Cursor as SQLiteCursor
+from sqlite3 import connect
+from sys import version_info
+from threading import Lock
+from typing import (
+    Iterable,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+)
+from uuid import uuid4
+
+# **************************Offline Catalog Constants**************************
+CATALOG_COLUMNS: Mapping[str, Sequence[str]] = {
+    'all_objects': (
+        'owner',
+        'object_name',
+        'object_type',
+        'object_id',
+        'last_ddl_time',
+    ),
+    'all_procedures': (
+        'owner',
+        'object_name',
+        'procedure_name',
+        'object_id',
+        'subprogram_id',
+        'overload',
+    ),
+    'all_arguments': (
+        'owner',
+        'object_name',
+        'package_name',
+        'object_id',
+        'subprogram_id',
+        'overload',
+        'argument_name',
+        'position',
+        'sequence',
+        'data_level',
+        'data_type',
+        'type_owner',
+        'type_name',
+        'type_subname',
+        'defaulted',
+        'default_value',
+        'in_out',
+    ),
+}
+
+# The indexes are similar to the ones of the dictionary's base tables
+CATALOG_INDEXES: Mapping[str, str] = {
+    'ao_owner': 'all_objects (owner, object_type)',
+    'ap_object': 'all_procedures (owner, object_name)',
+    'aa_subprogram': 'all_arguments (object_id, subprogram_id)',
+    'aa_owner': 'all_arguments (owner, package_name)',
+}
+
+# (pattern, replacement) pairs, applied in order
+CATALOG_DIALECT = (
+    (
+        re_compile(r'\btable\(:(\w+)\)'),
+        r'(select value column_value from json_each(:\1))',
+    ),
+    (re_compile(r'\brownum\b'), '1'),
+)
+
+CATALOG_LAST_DDL_TIME = '2020-04-01 00:00:00'
+
+# Internal name of the function result, see INTROSPECTION_*_SQL
+CATALOG_RESULT = '_DBSG_RESULT'
+# **************************Offline Catalog Constants**************************
+
+
+# ****************************Offline Catalog Types****************************
+@lru_cache(maxsize=128)
+def adapt(sql: str) -> str:
+    """Adapt Oracle introspection SQL to the SQLite dialect."""
+    for pattern, replacement in CATALOG_DIALECT:
+        sql = pattern.sub(replacement, sql)
+    return sql
+
+
+def nvl(value, default):
+    """Make Oracle nvl() function."""
+    return default if value is None else value
+
+
+class CatalogCollection(list):  # noqa: WPS600
+    """A collection bind (e.g. SYS.ODCIVARCHAR2LIST); bound as JSON array."""
+
+
+@dataclass
+class CatalogObjectType:
+    """A collection type, see CatalogConnection.gettype."""
+
+    name: str
+
+    def newobject(self) -> CatalogCollection:
+        """Make an empty collection."""
+        return CatalogCollection()
+
+
+class CatalogCursor:
+    """A cx_Oracle-like cursor over the catalog."""
+
+    def __init__(self, cursor: SQLiteCursor):
+        """Wrap an SQLite cursor."""
+        self.cursor = cursor
+        self.arraysize = 100
+
+    def __enter__(self) -> CatalogCursor:
+        """Use the cursor as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the cursor."""
+        self.close()
+
+    def execute(self, statement: str, binds: Optional[Mapping] = None):
+        """Execute an adapted statement with the adapted binds."""
+        binds = {
+            name: dumps(value) if isinstance(value, list) else value
+            for name, value in (binds or {}).items()
+        }
+        self.cursor.execute(adapt(statement), binds)
+
+    def fetchall(self) -> MutableSequence[tuple]:
+        """Fetch the remaining rows."""
+        return self.cursor.fetchall()
+
+    def fetchmany(self, size: Optional[int] = None) -> MutableSequence[tuple]:
+        """Fetch the next batch of rows (arraysize by default)."""
+        return self.cursor.fetchmany(size or self.arraysize)
+
+    def close(self):
+        """Close the cursor."""
+        self.cursor.close()
+
+
+class CatalogConnection:
+    """A cx_Oracle-like connection to the catalog."""
+
+    def __init__(self, connection: SQLiteConnection):
+        """Wrap an SQLite connection."""
+        self.connection = connection
+
+    def cursor(self) -> CatalogCursor:
+        """Make a cursor."""
+        return CatalogCursor(self.connection.cursor())
+
+    @staticmethod
+    def gettype(name: str) -> CatalogObjectType:
+        """Get a collection type by its name."""
+        return CatalogObjectType(name)
+
+    def close(self):
+        """Close the connection."""
+        self.connection.close()
+
+
+@dataclass
+class CatalogSessionPool:
+    """
+    A cx_Oracle-like session pool of catalog connections.
+
+    The released connections are reused; the pool isn't bounded, since
+    the introspection is bounded by its max anyway.
+    """
+
+    catalog: Catalog
+    min: int = field(default=1)  # noqa: WPS125
+    max: int = field(default=1)  # noqa: WPS125
+    idle: MutableSequence[CatalogConnection] = field(
+        default_factory=list,
+        repr=False,
+    )
+    lock: Lock = field(default_factory=Lock, repr=False)
+
+    def acquire(self) -> CatalogConnection:
+        """Acquire an idle connection or make a new one."""
+        with self.lock:
+            if self.idle:
+                return self.idle.pop()
+        return CatalogConnection(self.catalog.connect())
+
+    def release(self, connection: CatalogConnection):
+        """Return the connection into the pool."""
+        with self.lock:
+            self.idle.append(connection)
+
+    def close(self):
+        """Close all the idle connections."""
+        with self.lock:
+            while self.idle:
+                self.idle.pop().close()
+
+
+class Catalog:
+    """
+    SQLite database with the emulated dictionary views.
+
+    If the path is None, the catalog is in memory, and it lives as long as
+    the Catalog instance.
+    """
+
+    def __init__(self, path: Optional[Path] = None):
+        """Initialize the catalog; the views are created if missing."""
+        if path is None:
+            self.uri = (
+                f'file:dbsg-catalog-{uuid4().hex}?mode=memory&cache=shared'
+            )
+        else:
+            self.uri = Path(path).absolute().as_uri()
+        # Keep the (in memory) catalog alive
+        self.keeper = self.connect()
+        self.create()
+
+    def connect(self) -> SQLiteConnection:
+        """Make a connection with the catalog attached as "sys"."""
+        connection = connect(
+            'file::memory:',
+            uri=True,
+            check_same_thread=False,
+        )
+        # Python < 3.8 has no deterministic (for the indexes and the planner)
+        if version_info >= (3, 8):
+            connection.create_function('nvl', 2, nvl, deterministic=True)
+        else:
+            connection.create_function('nvl', 2, nvl)
+        connection.execute('attach database ? as sys', (self.uri,))
+        return connection
+
+    def session_pool(self, **kwargs) -> CatalogSessionPool:
+        """Make a session pool (min and max are accepted)."""
+        return CatalogSessionPool(catalog=self, **kwargs)
+
+    def create(self):
+        """Create the views (as tables), their indexes and dba_* twins."""
+        with self.keeper:
+            for table, columns in CATALOG_COLUMNS.items():
+                self.keeper.execute(
+                    f'create table if not exists sys.{table} '
+                    + f'({", ".join(columns)})',
+                )
+                self.keeper.execute(
+                    f'create view if not exists sys.dba_{table[4:]} '
+                    + f'as select * from {table}',
+                )
+            for index, columns in CATALOG_INDEXES.items():
+                self.keeper.execute(
+                    f'create index if not exists sys.{index} on {columns}',
+                )
+
+    def insert(self, table: str, rows: Iterable[Sequence]):
+        """Insert the rows into the table (see CATALOG_COLUMNS)."""
+        columns = CATALOG_COLUMNS[table]
+        placeholders = ', '.join('?' for _ in columns)
+        with self.keeper:
+            self.keeper.executemany(
+                f'insert into sys.{table} ({", ".join(columns)}) '
+                + f'values ({placeholders})',
+                rows,
+            )
+
+    def load(
+        self,
+        rows: Iterable[Sequence],
+        last_ddl_time: str = CATALOG_LAST_DDL_TIME,
+    ):
+        """
+        Load raw introspection rows (see IntrospectionRow) into the views.
+
+        It's a reverse of the introspection: the rows made by introspection of
+        the loaded catalog are equal to the loaded ones.
+        """
+        objects: MutableMapping[int, tuple] = {}
+        procedures: MutableMapping[tuple, tuple] = {}
+        arguments = []
+        for row in rows:
+            (
+                schema,
+                package,
+                is_package,
+                routine,
+                routine_type,
+                object_id,
+                overload,
+                subprogram_id,
+                argument,
+                *rest,
+            ) = row
+            if is_package:
+                objects[object_id] = (
+                    schema, package, 'PACKAGE', object_id, last_ddl_time,
+                )
+                procedure = (
+                    schema, package, routine, object_id, subprogram_id,
+                    overload,
+                )
+            else:
+                package = None
+                objects[object_id] = (
+                    schema, routine, routine_type, object_id, last_ddl_time,
+                )
+                procedure = (
+                    schema, routine, None, object_id, subprogram_id, overload,
+                )
+            procedures[object_id, subprogram_id] = procedure
+            argument = None if argument == CATALOG_RESULT else argument
+            arguments.append((
+                schema,
+                routine,
+                package,
+                object_id,
+                subprogram_id,
+                overload,
+                argument,
+                *rest,
+            ))
+
+        self.insert('all_objects', objects.values())
+        self.insert('all_procedures', procedures.values())
+        self.insert('all_arguments', arguments)
+
+    def close(self):
+        """Close the catalog (an in memory one is gone)."""
+        self.keeper.close()
+# ****************************Offline Catalog Types****************************
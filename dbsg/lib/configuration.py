@@ -1,10 +1,11 @@
 """Generator configuration utilities."""
+import sys
 from argparse import ArgumentParser
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from logging import Filter, getLogger
 from logging.config import dictConfig
 from os import environ, getenv
-from sys import exit as sys_exit
 from pathlib import Path
 from re import compile as re_compile
 from typing import (
@@ -17,14 +18,37 @@ from typing import (
     Union,
 )
 
-from cx_Oracle import SessionPool, makedsn  # pylint: disable=E0611
+from cx_Oracle import (  # pylint: disable=E0611
+    SPOOL_ATTRVAL_FORCEGET,
+    SPOOL_ATTRVAL_NOWAIT,
+    SPOOL_ATTRVAL_TIMEDWAIT,
+    SPOOL_ATTRVAL_WAIT,
+    SessionPool,
+    makedsn,
+)
 from marshmallow import Schema as MarshmallowSchema, fields, post_load
+from marshmallow.validate import OneOf
 from pkg_resources import get_distribution
 from yaml import SafeLoader, dump, load
 
+from dbsg.lib.catalog import Catalog
+
 LOG = getLogger(__name__)
 VERSION = get_distribution('db-stubs-generator').version
 
+# The first CLI argument may be a command; "generate" is the default one
+COMMANDS = ('generate', 'watch', 'introspect', 'build-ir', 'emit')
+
+# The names of dbsg.lib.introspection.STRATEGIES
+INTROSPECTION_STRATEGIES = ('join', 'arguments', 'dba')
+
+POOL_GETMODES = {
+    'wait': SPOOL_ATTRVAL_WAIT,
+    'nowait': SPOOL_ATTRVAL_NOWAIT,
+    'forceget': SPOOL_ATTRVAL_FORCEGET,
+    'timedwait': SPOOL_ATTRVAL_TIMEDWAIT,
+}
+
 # Method could be a function (no-self-use) [@staticmethod brakes marshmallow]
 # pylint: disable=R0201
 
@@ -71,15 +95,19 @@ class IntrospectionAppendix:
 
 @dataclass
 class FQDN:
-    """Make DB object (FQDN) type."""
+    """Make DB object (FQDN) type; slotted, since every IR Routine has one."""
+
+    __slots__ = ('schema', 'package', 'routine')
 
     schema: str
     package: str  # maybe blank
     routine: str
 
     def __init__(self, *args):
-        """Uppercase all the members."""
-        self.schema, self.package, self.routine = (a.upper() for a in args)
+        """Uppercase (and intern) all the members."""
+        self.schema, self.package, self.routine = (
+            sys.intern(a.upper()) for a in args
+        )
 
     def __str__(self):
         """Make string representation, skipping missing members."""
@@ -106,12 +134,20 @@ class Schema:
     exclude_routines: MutableSequence[FQDN] = field(default_factory=list)
     include_routines: MutableSequence[FQDN] = field(default_factory=list)
 
-    included_packages: str = field(init=False)
-    excluded_packages: str = field(init=False)
-    included_routines: str = field(init=False)
-    excluded_routines: str = field(init=False)
-    included_routines_no_pkg: str = field(init=False)
-    excluded_routines_no_pkg: str = field(init=False)
+    # Package-level sharding: explicit package lists and/or the number of
+    # packages per shard (the rest are split in object_id order)
+    shards: MutableSequence[MutableSequence[str]] = field(default_factory=list)
+    shard_size: Optional[int] = field(default=None)
+
+    # Sorted names for introspection SQL binding (as collections)
+    included_packages: MutableSequence[str] = field(init=False)
+    excluded_packages: MutableSequence[str] = field(init=False)
+    # "PACKAGE.ROUTINE"
+    included_routines: MutableSequence[str] = field(init=False)
+    excluded_routines: MutableSequence[str] = field(init=False)
+    # "ROUTINE"
+    included_routines_no_pkg: MutableSequence[str] = field(init=False)
+    excluded_routines_no_pkg: MutableSequence[str] = field(init=False)
 
     def __post_init__(self):
         """Post-process Schema type."""
@@ -120,6 +156,9 @@ class Schema:
         no_pkg = self.no_package_name or f'{self.name}_no_pkg'
         self.no_package_name = no_pkg.upper()
 
+        # Matched with the DB names as is or uppercased, see Inspect.shards
+        self.shards = [list(s) for s in self.shards or []]
+
         # FIXME
         # The original data will be in conformance with type annotations after
         # __post_init__
@@ -127,13 +166,13 @@ class Schema:
         exclude_routines = []
         include_routines = []
 
-        # Already prepared strings for introspection SQL "binding"
+        # Already prepared names for introspection SQL binding
         included_packages = set()
         excluded_packages = set()
-        included_routines = []
-        excluded_routines = []
-        included_routines_no_pkg = []
-        excluded_routines_no_pkg = []
+        included_routines = set()
+        excluded_routines = set()
+        included_routines_no_pkg = set()
+        excluded_routines_no_pkg = set()
 
         # If there's include_routines, ONLY this routines will be introspected
         # noinspection PyTypeChecker
@@ -142,10 +181,10 @@ class Schema:
             fqdn = FQDN(*routine)  # noqa: WPS441
             include_routines.append(fqdn)
             if fqdn.package:
-                included_routines.append(repr(fqdn))
-                included_packages.add(repr(fqdn.package))
+                included_routines.add(f'{fqdn.package}.{fqdn.routine}')
+                included_packages.add(fqdn.package)
             else:
-                included_routines_no_pkg.append(repr(fqdn.routine))
+                included_routines_no_pkg.add(fqdn.routine)
 
         # noinspection PyTypeChecker
         for package in self.exclude_packages:
@@ -155,7 +194,7 @@ class Schema:
             # It doesn't make sense to exclude anything, if we've included
             # ONLY concrete routines
             if not include_routines:
-                excluded_packages.add(repr(package))
+                excluded_packages.add(package)
 
         # noinspection PyTypeChecker
         for routine in self.normalize(self.name, self.exclude_routines):
@@ -167,21 +206,21 @@ class Schema:
             if include_routines:
                 continue
             if fqdn.package:
-                excluded_routines.append(repr(fqdn))
+                excluded_routines.add(f'{fqdn.package}.{fqdn.routine}')
             else:
-                excluded_routines_no_pkg.append(repr(fqdn))
+                excluded_routines_no_pkg.add(fqdn.routine)
 
         self.exclude_packages = exclude_packages
         self.exclude_routines = exclude_routines
         self.include_routines = include_routines
 
-        self.included_packages = ', '.join(included_packages)
-        self.excluded_packages = ', '.join(excluded_packages)
+        self.included_packages = sorted(included_packages)
+        self.excluded_packages = sorted(excluded_packages)
 
-        self.included_routines = ', '.join(included_routines)
-        self.included_routines_no_pkg = ', '.join(included_routines_no_pkg)
-        self.excluded_routines = ', '.join(excluded_routines)
-        self.excluded_routines_no_pkg = ', '.join(excluded_routines_no_pkg)
+        self.included_routines = sorted(included_routines)
+        self.included_routines_no_pkg = sorted(included_routines_no_pkg)
+        self.excluded_routines = sorted(excluded_routines)
+        self.excluded_routines_no_pkg = sorted(excluded_routines_no_pkg)
 
     @staticmethod
     def normalize(name: str, objects: List[str]) -> List[List[str]]:
@@ -235,6 +274,12 @@ class Pool:
     homogeneous: bool = field(default=True)
     min: int = field(default=8)
     max: int = field(default=8)
+    increment: int = field(default=1)
+    # wait, nowait, forceget or timedwait (see POOL_GETMODES)
+    getmode: str = field(default='wait')
+    # Seconds before an idle session is closed (None is the driver's default)
+    timeout: Optional[int] = field(default=None)
+    stmtcachesize: Optional[int] = field(default=None)
     encoding: Optional[str] = field(default=None)
 
     def __post_init__(self):
@@ -246,6 +291,11 @@ class Pool:
             service_name=self._dsn.service_name,
         )
 
+    @property
+    def cx_getmode(self) -> int:
+        """Make an actual cx_Oracle.SPOOL_ATTRVAL_* getmode."""
+        return POOL_GETMODES[self.getmode]
+
 
 @dataclass
 class Database:
@@ -254,17 +304,35 @@ class Database:
     name: str
     pool: Pool
     schemes: MutableSequence[Schema]
-
-    # Will be available after connection
-    session_pool: SessionPool = field(init=False, repr=False)
+    # Introspection query strategy (see dbsg.lib.introspection.STRATEGIES)
+    strategy: str = field(default='join')
+    # Offline SQLite catalog instead of Oracle (see dbsg.lib.catalog)
+    catalog: Optional[Path] = field(default=None)
+
+    # Will be available after connection (and None after disconnection)
+    session_pool: Optional[SessionPool] = field(
+        init=False,
+        repr=False,
+        default=None,
+    )
 
     def __post_init__(self):
         """Make DB post-processing."""
         self.name = self.name.upper()
 
     def connect(self) -> SessionPool:
-        """Make connection pool."""
-        self.session_pool = SessionPool(
+        """Make connection pool; the existing one is reused."""
+        if self.session_pool is not None:
+            return self.session_pool
+
+        if self.catalog is not None:
+            self.session_pool = Catalog(self.catalog).session_pool(
+                min=self.pool.min,
+                max=self.pool.max,
+            )
+            return self.session_pool
+
+        session_pool = SessionPool(
             user=self.pool.user,
             password=self.pool.password,
             dsn=self.pool.dsn,
@@ -272,12 +340,29 @@ class Database:
             homogeneous=self.pool.homogeneous,
             min=self.pool.min,
             max=self.pool.max,
+            increment=self.pool.increment,
+            getmode=self.pool.cx_getmode,
             encoding=self.pool.encoding,
         )
+        # Not in the constructor in some cx_Oracle versions
+        if self.pool.timeout is not None:
+            session_pool.timeout = self.pool.timeout
+        if self.pool.stmtcachesize is not None:
+            session_pool.stmtcachesize = self.pool.stmtcachesize
+
+        self.session_pool = session_pool
         return self.session_pool
 
-    def disconnect(self):  # TODO
-        """Close connection pool."""
+    def disconnect(self):
+        """Close connection pool (if any); all the sessions are released."""
+        if self.session_pool is None:
+            return
+        session_pool, self.session_pool = self.session_pool, None
+        # cx_Oracle < 7 has no SessionPool.close; the pool is closed on GC
+        close = getattr(session_pool, 'close', None)
+        if close is not None:
+            close()
+        LOG.info(f'{self.name} connection pool has been closed.')
 
 
 @dataclass
@@ -290,6 +375,29 @@ class Configuration:
     abbreviations: Pattern[str]
     outcomes: MutableMapping[str, str]
     path: Path = field(default=Path('stubs'))
+    # The plugins' options by their names (see the plugins)
+    plugin_options: MutableMapping[str, MutableMapping] = field(
+        default_factory=dict,
+    )
+    snapshot_path: Path = field(default=Path('.dbsg'))
+    # The directory of the introspection and IR artifacts (see artifact.py)
+    artifact_path: Path = field(default=Path('.dbsg'))
+    full: bool = field(default=False)
+    streaming: bool = field(default=False)
+    compare_strategies: bool = field(default=False)
+    command: str = field(default='generate')
+    # Seconds between the polls of "dbsg watch"
+    watch_interval: float = field(default=10)
+    # Processes building the IR (by Schemes); 1 means "in this process"
+    ir_workers: int = field(default=1)
+    # Share the nested arguments of the same types (see Abstract)
+    share_types: bool = field(default=False)
+    # Plugins saved concurrently; 1 means "one by one"
+    plugin_workers: int = field(default=1)
+    # Fork the plugins' processes instead of the threads
+    plugin_fork: bool = field(default=False)
+    arraysize: int = field(default=500)
+    prefetchrows: Optional[int] = field(default=None)
     oracle_home: Optional[str] = field(default=None)
     nls_lang: Optional[str] = field(default='American_America.AL32UTF8')
 
@@ -300,6 +408,27 @@ class Configuration:
             environ['ORACLE_HOME'] = self.oracle_home
         if self.nls_lang:
             environ['NLS_LANG'] = self.nls_lang
+
+    def connect(self) -> MutableMapping[str, SessionPool]:
+        """Make connection pools of all the DBs concurrently."""
+        if not self.databases:
+            return {}
+        with ThreadPoolExecutor(
+            max_workers=len(self.databases),
+            thread_name_prefix='dbsg-connect',
+        ) as executor:
+            session_pools = list(
+                executor.map(lambda db: db.connect(), self.databases),
+            )
+        return {
+            db.name: session_pool
+            for db, session_pool in zip(self.databases, session_pools)
+        }
+
+    def disconnect(self):
+        """Close connection pools of all the DBs."""
+        for db in self.databases:
+            db.disconnect()
 # *****************************Configuration Types*****************************
 
 
@@ -335,6 +464,10 @@ class PoolSchema(MarshmallowSchema):
     homogeneous = fields.Boolean(required=False)
     min = fields.Integer(required=False)
     max = fields.Integer(required=False)
+    increment = fields.Integer(required=False)
+    getmode = fields.String(required=False, validate=OneOf(POOL_GETMODES))
+    timeout = fields.Integer(required=False, allow_none=True)
+    stmtcachesize = fields.Integer(required=False, allow_none=True)
     encoding = fields.String(required=False, allow_none=True)
 
     @post_load
@@ -369,6 +502,12 @@ class SchemesSchema(MarshmallowSchema):
         required=False,
         allow_none=True,
     )
+    shards = fields.List(
+        fields.List(fields.String()),
+        required=False,
+        allow_none=True,
+    )
+    shard_size = fields.Integer(required=False, allow_none=True)
 
     @post_load
     def _post_load(self, data):
@@ -389,9 +528,16 @@ class DatabaseSchema(MarshmallowSchema):
     name = fields.String(required=True)
     pool = fields.Nested(PoolSchema, required=True)
     schemes = fields.Nested(SchemesSchema, required=True, many=True)
+    strategy = fields.String(
+        required=False,
+        validate=OneOf(INTROSPECTION_STRATEGIES),
+    )
+    catalog = fields.String(required=False, allow_none=True)
 
     @post_load
     def _post_load(self, data):
+        if data.get('catalog') is not None:
+            data['catalog'] = Path(data['catalog'])
         data['pool'] = Pool(**data['pool'])
         data['schemes'] = [Schema(**s) for s in data['schemes']]
         return data
@@ -401,7 +547,21 @@ class ConfigSchema(MarshmallowSchema):
     """Serialize generator's config."""
 
     path = fields.String(required=False)
+    snapshot_path = fields.String(required=False)
+    artifact_path = fields.String(required=False)
+    full = fields.Boolean(required=False)
+    streaming = fields.Boolean(required=False)
+    compare_strategies = fields.Boolean(required=False)
+    command = fields.String(required=False, validate=OneOf(COMMANDS))
+    watch_interval = fields.Float(required=False)
+    ir_workers = fields.Integer(required=False)
+    share_types = fields.Boolean(required=False)
+    plugin_workers = fields.Integer(required=False)
+    plugin_fork = fields.Boolean(required=False)
+    arraysize = fields.Integer(required=False)
+    prefetchrows = fields.Integer(required=False, allow_none=True)
     plugins = fields.List(fields.String(), required=True)
+    plugin_options = fields.Dict(required=False)
     abbreviation_files = fields.List(fields.String(), required=False)
 
     oracle_home = fields.String(required=False, allow_none=True)
@@ -444,13 +604,32 @@ class ConfigSchema(MarshmallowSchema):
         data['outcomes'] = outcomes
         data['databases'] = [Database(**db) for db in data['databases']]
         data['path'] = Path(data['path'])
+        for path in ('snapshot_path', 'artifact_path'):
+            if path in data:
+                data[path] = Path(data[path])
         data['config'] = Configuration(**data)
         return data
 # **************************Configuration Serializers**************************
 
 
 # ******************************Configuration CLI******************************
-CommandLineInterface = ArgumentParser()
+class CommandLineParser(ArgumentParser):
+    """
+    Parse "dbsg [command] [options] [path]".
+
+    The command is optional, so "dbsg ./stubs" still means "generate".
+    """
+
+    def parse_known_args(self, args=None, namespace=None):
+        """Pop the command (if any) before parsing the rest."""
+        args = list(sys.argv[1:] if args is None else args)
+        command = args.pop(0) if args and args[0] in COMMANDS else None
+        namespace, extras = super().parse_known_args(args, namespace)
+        namespace.command = command
+        return namespace, extras
+
+
+CommandLineInterface = CommandLineParser()
 CommandLineInterface.add_argument(
     '--config',
     dest='config',
@@ -473,6 +652,64 @@ CommandLineInterface.add_argument(
     dest='abbreviation_files',
     default=['default_abbreviations.txt'],
 )
+CommandLineInterface.add_argument(
+    '--snapshot-path',
+    dest='snapshot_path',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--artifact-path',
+    dest='artifact_path',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--full',
+    action='store_true',
+    dest='full',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--streaming',
+    action='store_true',
+    dest='streaming',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--compare-strategies',
+    action='store_true',
+    dest='compare_strategies',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--interval',
+    type=float,
+    dest='watch_interval',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--ir-workers',
+    type=int,
+    dest='ir_workers',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--share-types',
+    action='store_true',
+    dest='share_types',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--plugin-workers',
+    type=int,
+    dest='plugin_workers',
+    default=None,
+)
+CommandLineInterface.add_argument(
+    '--plugin-fork',
+    action='store_true',
+    dest='plugin_fork',
+    default=None,
+)
 # ******************************Configuration CLI******************************
 
 
@@ -517,7 +754,7 @@ class Setup:
                 f'After merging with CLI arguments, your config was: {data}',
                 sep='\n',
             )
-            sys_exit(1)
+            sys.exit(1)
         return valid['config']
 
     def configuration(self) -> Configuration:
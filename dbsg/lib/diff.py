@@ -0,0 +1,291 @@
+"""
+Structural IR hashing and diffing.
+
+Every Argument, Routine, Package, Schema and Database of the IR has a digest
+of its own fields and of the digests of its children (a Merkle tree), so two
+IR trees are equal if their root digests are, and the changes are found by
+descending only into the subtrees with different digests.
+
+The generator keeps the digests of the previous run in the snapshot_path
+(see track), and logs the changes:
+
+.. code-block:: python
+
+    diff(Tree.load(previous_path), Tree.of(ir))
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field, fields
+from hashlib import sha1
+from json import dumps, load
+from logging import getLogger
+from pathlib import Path
+from typing import Any, Mapping, MutableMapping, MutableSequence, Optional
+
+from dbsg.lib.configuration import Configuration
+from dbsg.lib.intermediate_representation import (
+    IR,
+    Argument,
+    ComplexArgument,
+    Database,
+    Package,
+    Routine,
+    Schema,
+)
+
+LOG = getLogger(__name__)
+
+# The children (hashed as digests) and the fields that aren't hashed
+DIGEST_SKIPPED = frozenset((
+    'arguments',
+    'routines',
+    'packages',
+    'schemes',
+))
+
+# The depths of the Tree nodes
+DATABASE, SCHEMA, PACKAGE, ROUTINE = 1, 2, 3, 4
+
+
+# ********************************Digest Types*********************************
+class Hasher:
+    """
+    Make the digests of the IR nodes.
+
+    The digests of the Complex Arguments are memoized (by their identity),
+    since their nested arguments may be shared by many routines; so a Hasher
+    shouldn't outlive the hashed IR.
+    """
+
+    def __init__(self):
+        """Initialize an empty memo."""
+        self.memo: MutableMapping[int, str] = {}
+
+    @staticmethod
+    def own(node: Any) -> tuple:
+        """Make the hashed values of the node's own fields."""
+        return (type(node).__name__, *(
+            str(getattr(node, f.name))
+            for f in fields(node)
+            if f.name not in DIGEST_SKIPPED
+        ))
+
+    @staticmethod
+    def combine(own: tuple, children: Any) -> str:
+        """Make a digest of the own values and the children's digests."""
+        return sha1(repr((own, tuple(children))).encode('utf8')).hexdigest()
+
+    def argument(self, argument: Argument) -> str:
+        """Make the Argument's digest."""
+        if not isinstance(argument, ComplexArgument):
+            return self.combine(self.own(argument), ())
+        if id(argument) not in self.memo:
+            self.memo[id(argument)] = self.combine(
+                self.own(argument),
+                map(self.argument, argument.arguments),
+            )
+        return self.memo[id(argument)]
+
+    def routine(self, routine: Routine) -> str:
+        """Make the Routine's digest."""
+        return self.combine(
+            self.own(routine),
+            map(self.argument, routine.arguments),
+        )
+
+
+@dataclass
+class Tree:
+    """A Merkle tree of the IR digests: the root, DBs, ..., routines."""
+
+    digest: str
+    children: MutableMapping[str, Tree] = field(default_factory=dict)
+
+    VERSION = 1
+
+    @classmethod
+    def of(cls, ir: IR) -> Tree:
+        """Hash the IR."""
+        hasher = Hasher()
+        return cls.node(('ir',), {
+            db.name: cls.database(hasher, db) for db in ir
+        })
+
+    @classmethod
+    def node(cls, own: tuple, children: MutableMapping[str, Tree]) -> Tree:
+        """Make a node of its own values and its (ordered) children."""
+        return cls(
+            digest=Hasher.combine(own, (
+                (name, child.digest) for name, child in children.items()
+            )),
+            children=children,
+        )
+
+    @classmethod
+    def database(cls, hasher: Hasher, database: Database) -> Tree:
+        """Hash the Database."""
+        return cls.node(Hasher.own(database), {
+            schema.name: cls.schema(hasher, schema)
+            for schema in database.schemes
+        })
+
+    @classmethod
+    def schema(cls, hasher: Hasher, schema: Schema) -> Tree:
+        """Hash the Schema."""
+        return cls.node(Hasher.own(schema), {
+            package.name: cls.package(hasher, package)
+            for package in schema.packages
+        })
+
+    @classmethod
+    def package(cls, hasher: Hasher, package: Package) -> Tree:
+        """Hash the Package; the routines are keyed by name and overload."""
+        return cls.node(Hasher.own(package), {
+            routine_key(routine): cls(digest=hasher.routine(routine))
+            for routine in package.routines
+        })
+
+    def asdict(self) -> MutableMapping[str, Any]:
+        """Make a JSON-serializable dict."""
+        return {
+            'digest': self.digest,
+            'children': {
+                name: child.asdict() for name, child in self.children.items()
+            },
+        }
+
+    @classmethod
+    def fromdict(cls, data: Mapping[str, Any]) -> Tree:
+        """Make a Tree of its asdict."""
+        return cls(
+            digest=data['digest'],
+            children={
+                name: cls.fromdict(child)
+                for name, child in data['children'].items()
+            },
+        )
+
+    @classmethod
+    def load(cls, path: Path) -> Optional[Tree]:
+        """Load the Tree; it's None if missing, outdated or broken."""
+        if not path.is_file():
+            return None
+        try:
+            with path.open('r', encoding='utf8') as fh:
+                data = load(fh)
+        except ValueError:
+            LOG.warning(f'The IR digests {path} are broken. Ignoring them.')
+            return None
+        if data.get('version') != cls.VERSION:
+            LOG.info(f'The IR digests {path} are outdated. Ignoring them.')
+            return None
+        return cls.fromdict(data['tree'])
+
+    def save(self, path: Path):
+        """Persist the Tree."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open('w', encoding='utf8') as fh:
+            fh.write(dumps({'version': self.VERSION, 'tree': self.asdict()}))
+
+
+@dataclass
+class Changes:
+    """Added, removed and changed names (dotted paths)."""
+
+    added: MutableSequence[str] = field(default_factory=list)
+    removed: MutableSequence[str] = field(default_factory=list)
+    changed: MutableSequence[str] = field(default_factory=list)
+
+    def __bool__(self):
+        """Check for any changes."""
+        return bool(self.added or self.removed or self.changed)
+
+    def __str__(self):
+        """Make a summary."""
+        return (
+            f'+{len(self.added)} -{len(self.removed)} ~{len(self.changed)}'
+        )
+
+
+@dataclass
+class Diff:
+    """The changes of the packages and the routines between two IR trees."""
+
+    packages: Changes = field(default_factory=Changes)
+    routines: Changes = field(default_factory=Changes)
+
+    def __bool__(self):
+        """Check for any changes."""
+        return bool(self.packages or self.routines)
+
+    def __str__(self):
+        """Make a summary."""
+        return f'packages {self.packages}, routines {self.routines}'
+# ********************************Digest Types*********************************
+
+
+def routine_key(routine: Routine) -> str:
+    """Make the Routine's key in the Package (overloads have a suffix)."""
+    if routine.overload:
+        return f'{routine.name}#{routine.overload}'
+    return routine.name
+
+
+def diff(old: Optional[Tree], new: Tree) -> Diff:
+    """Compare the trees; everything is added if there's no old one."""
+    found = Diff()
+    _compare(old or Tree(digest=''), new, found, (), 0)
+    return found
+
+
+def _compare(old: Tree, new: Tree, found: Diff, path: tuple, depth: int):
+    if old.digest == new.digest:
+        return
+
+    if depth == PACKAGE:
+        found.packages.changed.append('.'.join(path))
+    elif depth == ROUTINE:
+        found.routines.changed.append('.'.join(path))
+        return
+
+    for name, child in new.children.items():
+        child_path = (*path, name)
+        if name in old.children:
+            _compare(old.children[name], child, found, child_path, depth + 1)
+        else:
+            added = found.packages.added, found.routines.added
+            _collect(child, *added, child_path, depth + 1)
+
+    for name, child in old.children.items():  # noqa: WPS440
+        if name not in new.children:
+            removed = found.packages.removed, found.routines.removed
+            _collect(child, *removed, (*path, name), depth + 1)
+
+
+def _collect(
+    tree: Tree,
+    packages: MutableSequence[str],
+    routines: MutableSequence[str],
+    path: tuple,
+    depth: int,
+):
+    if depth == PACKAGE:
+        packages.append('.'.join(path))
+    elif depth == ROUTINE:
+        routines.append('.'.join(path))
+        return
+    for name, child in tree.children.items():
+        _collect(child, packages, routines, (*path, name), depth + 1)
+
+
+def track(configuration: Configuration, ir: IR) -> Diff:
+    """Compare the IR with the previous run's one, and persist its digests."""
+    path = configuration.snapshot_path / 'ir.json'
+    tree = Tree.of(ir)
+    found = diff(Tree.load(path), tree)
+    if found:
+        LOG.info(f'The IR has changed: {found}.')
+    else:
+        LOG.info('The IR has not changed.')
+    tree.save(path)
+    return found
@@ -1,7 +1,21 @@
 """Intermediate Representation types and utilities."""
 from __future__ import annotations
-from dataclasses import dataclass, field
-from typing import MutableSequence, Union, Optional
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from dataclasses import dataclass, field, fields
+from sys import intern
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+    overload,
+)
 
 from dbsg.lib.configuration import FQDN
 from dbsg.lib.introspection import (
@@ -13,8 +27,55 @@ from dbsg.lib.introspection import (
 # **********************INTERMEDIATE REPRESENTATION TYPES**********************
 Argument = Union['SimpleArgument', 'ComplexArgument']
 # TODO: make generic arguments helper mixin
+# (custom_type_fqdn, data_level, in_out): the nested arguments of a type have
+# the data level and the in_out of its usage, so they are a part of the key
+TypeKey = Tuple[str, int, str]
+# The nested arguments of the resolved types (see Database.types)
+TypeRegistry = MutableMapping[TypeKey, MutableSequence[Argument]]
+
+
+def slotted(*extra: str) -> Callable[[type], type]:
+    """
+    Make a slotted dataclass, as dataclass(slots=True) of Python 3.10+ does.
+
+    There may be millions of the IR objects, so they have no __dict__. The
+    extra slots aren't fields (e.g. the caches of the derived values).
+    """
+    def decorator(cls: type) -> type:
+        inherited = {
+            slot
+            for base in cls.__mro__[1:]
+            for slot in getattr(base, '__slots__', ())
+        }
+        slots = tuple(
+            name
+            for name in (*(f.name for f in fields(cls)), *extra)
+            if name not in inherited
+        )
+        namespace = dict(cls.__dict__)
+        for name in (*slots, '__dict__', '__weakref__'):
+            namespace.pop(name, None)
+        namespace['__slots__'] = slots
+        return type(cls)(cls.__name__, cls.__bases__, namespace)
+    return decorator
+
+
+@overload
+def interned(value: str) -> str:
+    """Intern a string."""
+
+
+@overload
+def interned(value: None) -> None:
+    """Pass None through."""
+
 
+def interned(value: Optional[str]) -> Optional[str]:
+    """Intern a repeated string (e.g. a data type), so it's stored once."""
+    return value if value is None else intern(value)
 
+
+@slotted()
 @dataclass
 class SimpleArgument:  # Flat
     """IR Argument superclass."""
@@ -35,17 +96,17 @@ class SimpleArgument:  # Flat
     def from_row(cls, row: IntrospectionRow):
         """Make IR argument type from an Introspection Row."""
         return cls(
-            name=row.argument,
+            name=interned(row.argument),
             position=row.position,
             sequence=row.sequence,
             data_level=row.data_level,
-            data_type=row.data_type,
-            custom_type_schema=row.custom_type_schema,
-            custom_type_package=row.custom_type_package,
-            custom_type=row.custom_type,
+            data_type=interned(row.data_type),
+            custom_type_schema=interned(row.custom_type_schema),
+            custom_type_package=interned(row.custom_type_package),
+            custom_type=interned(row.custom_type),
             defaulted=row.defaulted,
             default_value=row.default_value,
-            in_out=row.in_out,
+            in_out=interned(row.in_out),
         )
 
     @property
@@ -61,12 +122,21 @@ class SimpleArgument:  # Flat
         )
 
 
+@slotted()
 @dataclass
 class ComplexArgument(SimpleArgument):  # with Nested Arguments
     """IR Complex argument extension."""
 
     arguments: MutableSequence[Argument] = field(default_factory=list)
 
+    @property
+    def type_key(self) -> Optional[TypeKey]:
+        """Make TypeRegistry key (anonymous types have none)."""
+        # The schema-level types have no custom_type (TYPE_SUBNAME)
+        if not self.custom_type_fqdn:
+            return None
+        return self.custom_type_fqdn, self.data_level, self.in_out
+
     @property
     def direct_child_data_level(self):
         """If ComplexArgument has lvl == 2, its arguments have lvl == 3."""
@@ -91,20 +161,8 @@ class ComplexArgument(SimpleArgument):  # with Nested Arguments
         """Last argument shortcut."""
         return self.arguments[-1]
 
-    def dispatch_argument(self, argument: Argument):
-        """Dispatch an argument into appropriate data level."""
-        # NOTE: Data Level == 0 is handled at the Routine level
-        # NOTE: Data Level < direct_child_data_level is handled by Parents
-
-        # Child that should be lifted into desired Data Level
-        if argument.data_level > self.direct_child_data_level:
-            # In this context, last_argument is always a ComplexArgument
-            self.complex_child.dispatch_argument(argument)
-        # Direct Child that should be placed at the Top
-        else:
-            self.arguments.append(argument)
-
 
+@slotted()
 @dataclass
 class Routine:
     """IR routine type."""
@@ -121,8 +179,8 @@ class Routine:
     def from_row(cls, row: IntrospectionRow) -> Routine:
         """Make IR routine type from IntrospectionRow factory."""
         routine = cls(
-            name=row.routine,
-            type=row.routine_type,
+            name=interned(row.routine),
+            type=interned(row.routine_type),
             object_id=row.object_id,
             overload=row.overload,
             subprogram_id=row.subprogram_id,
@@ -153,16 +211,6 @@ class Routine:
         """Last argument shortcut."""
         return self.arguments[-1]
 
-    def dispatch_argument(self, argument: Argument):
-        """Dispatch an argument into appropriate data level."""
-        # Data Level == 0 should be placed at the Top
-        if argument.data_level == 0:
-            self.arguments.append(argument)
-        # Data Level > 0 is a guarantee that the Arg should be nested
-        else:
-            # In this context, last_argument is always a ComplexArgument
-            self.complex_child.dispatch_argument(argument)
-
     @property
     def sorted_arguments(self) -> MutableSequence[Argument]:
         """Sort argument, placing default one to the end."""
@@ -174,6 +222,7 @@ class Routine:
         return any(a for a in self.arguments if a.in_out != 'out')
 
 
+@slotted()
 @dataclass
 class Package:
     """IR package type."""
@@ -183,6 +232,7 @@ class Package:
     routines: MutableSequence[Routine] = field(default_factory=list)
 
 
+@slotted()
 @dataclass
 class Schema:
     """IR Schema type."""
@@ -191,9 +241,79 @@ class Schema:
     packages: MutableSequence[Package] = field(default_factory=list)
 
 
+@slotted()
+@dataclass
+class Usage:
+    """A custom type usage: the Routine and its (maybe nested) Argument."""
+
+    routine: Routine
+    argument: Argument
+
+
+@slotted()
+@dataclass
+class Indexes:
+    """
+    The lookup indexes of a Database (see Database.indexes).
+
+    The Database keeps a single Indexes, which is built and cleared in
+    place.
+    """
+
+    fqdn: MutableMapping[str, MutableSequence[Routine]] = field(
+        default_factory=dict,
+    )
+    subprograms: MutableMapping[Tuple[int, int], Routine] = field(
+        default_factory=dict,
+    )
+    usages: MutableMapping[str, MutableSequence[Usage]] = field(
+        default_factory=dict,
+    )
+    built: bool = field(default=False)
+
+    def build(self, routines: Iterable[Routine]):
+        """Index the routines."""
+        for routine in routines:
+            self.fqdn.setdefault(str(routine.fqdn), []).append(routine)
+            self.subprograms[routine.object_id, routine.subprogram_id] = (
+                routine
+            )
+            stack = list(reversed(routine.arguments))
+            while stack:
+                argument = stack.pop()
+                if argument.custom_type_fqdn:
+                    self.usages.setdefault(
+                        argument.custom_type_fqdn,
+                        [],
+                    ).append(Usage(routine, argument))
+                if isinstance(argument, ComplexArgument):
+                    stack.extend(reversed(argument.arguments))
+        self.built = True
+
+    def clear(self):
+        """Drop the indexes."""
+        self.fqdn.clear()
+        self.subprograms.clear()
+        self.usages.clear()
+        self.built = False
+
+
+@slotted('types', '_indexes')
 @dataclass
 class Database:
-    """IR DB type."""
+    """
+    IR DB type.
+
+    If the types are shared (see Abstract), the Complex Arguments of the same
+    type share their nested arguments, which are resolved once and kept in
+    the types registry (it isn't a field, so it's neither compared nor
+    serialized). Otherwise, the registry is empty.
+
+    The routines may be looked up by their FQDN (find_routines), by their
+    (object_id, subprogram_id) (find_subprogram), and by the custom types
+    of their arguments (find_usages). The indexes are built lazily, on the
+    first lookup; use reindex() after the IR is changed.
+    """
 
     name: str
     schemes: MutableSequence[Schema] = field(default_factory=list)
@@ -201,68 +321,278 @@ class Database:
     def __post_init__(self):
         """Lowercase the name for consistency."""
         self.name = self.name.lower()
+        self.types: TypeRegistry = {}
+        self._indexes = Indexes()
 
-    def dispatch_routine(self, row: IntrospectionRow, routine: Routine):
-        """Dispatch the Routine into appropriate <schema.package>."""
-        if self.schemes and row.schema == self.schemes[-1].name:
-            schema = self.schemes[-1]
-        else:
-            schema = Schema(name=row.schema)
-            self.schemes.append(schema)
+    def routines(self) -> Iterator[Routine]:
+        """Iterate over all the routines."""
+        for schema in self.schemes:
+            for package in schema.packages:
+                yield from package.routines
 
-        if schema.packages and row.package == schema.packages[-1].name:
-            package = schema.packages[-1]
-        else:
-            package = Package(name=row.package, is_package=row.is_package)
-            schema.packages.append(package)
+    @property
+    def indexes(self) -> Indexes:
+        """Build the indexes, if they aren't built."""
+        if not self._indexes.built:
+            self._indexes.build(self.routines())
+        return self._indexes
 
-        package.routines.append(routine)
+    def reindex(self):
+        """Drop the indexes; they are built again on the next lookup."""
+        self._indexes.clear()
+
+    def find_routines(self, fqdn: Union[str, FQDN]) -> Sequence[Routine]:
+        """Find the routines (all the overloads) by FQDN."""
+        return self.indexes.fqdn.get(str(fqdn).upper(), [])
+
+    def find_subprogram(
+        self,
+        object_id: int,
+        subprogram_id: int,
+    ) -> Optional[Routine]:
+        """Find the routine by its object_id and subprogram_id."""
+        return self.indexes.subprograms.get((object_id, subprogram_id))
+
+    def find_usages(self, custom_type: str) -> Sequence[Usage]:
+        """Find the usages of a custom type by its FQDN (custom_type_fqdn)."""
+        return self.indexes.usages.get(custom_type.lower(), [])
 
 
 IR = MutableSequence[Database]
+
+
+@dataclass
+class StreamedPackage:
+    """
+    A complete IR Package of the IR stream, with its DB and Schema.
+
+    A Schema without Packages is streamed without a Package, so the
+    consumers make the same Schemes as the IR has.
+    """
+
+    database: str
+    schema: str
+    package: Optional[Package] = None
 # **********************INTERMEDIATE REPRESENTATION TYPES**********************
 
 
 class Abstract:
-    """Intermediate Representation Factory."""
-
-    def __init__(self, introspection: Introspection):
+    """
+    Intermediate Representation Factory.
+
+    The Schemas are independent, so they may be built in a process pool (if
+    workers > 1); the results are merged in the introspection order anyway.
+    The streaming introspection is always built in the current process.
+
+    The rows and the IR are pickled between the processes, and that may cost
+    more than the building itself; so the pool is opt-in, and it's worth
+    measuring with the benchmark (--ir-workers) for the actual Schemes.
+
+    The sharing of the types (see Database) is opt-in too: the shared nested
+    arguments have the sequences and the positions of the first usage of
+    their type, not of their own routine.
+    """
+
+    def __init__(
+        self,
+        introspection: Introspection,
+        workers: int = 1,
+        share_types: bool = False,
+    ):
         """Initialize IR with Introspection."""
         self.introspection = introspection
+        self.workers = workers
+        self.share_types = share_types
+
+    def types(self) -> Optional[TypeRegistry]:
+        """Make a new types registry, if the types are shared."""
+        return {} if self.share_types else None
 
     def intermediate_representation(self) -> IR:
         """Parse introspection and make intermediate representation."""
-        intermediate_representation = []
+        introspected_schemes = [
+            schema
+            for introspected in self.introspection
+            for schema in introspected.schemes
+        ]
+
+        parallel = (
+            self.workers > 1
+            and len(introspected_schemes) > 1
+            and all(isinstance(s.rows, list) for s in introspected_schemes)
+        )
+        if parallel:
+            with ProcessPoolExecutor(
+                max_workers=min(self.workers, len(introspected_schemes)),
+            ) as executor:
+                # Every Schema has its own registry; they are merged below
+                built = iter(executor.map(
+                    partial(build_schemes, types=self.types()),
+                    [s.rows for s in introspected_schemes],
+                ))
+        else:
+            built = iter([])
 
+        intermediate_representation = []
         for introspected in self.introspection:
             database = Database(name=introspected.name)
-            routine: Optional[Routine] = None  # None before first iteration
-            oid = None
-            sid = None
-
-            # Can be multi-threaded/processed later
             for schema in introspected.schemes:
-
-                for row in schema.rows:
-                    if row.data_type not in COMPLEX_TYPES:
-                        argument = SimpleArgument.from_row(row)
-                    else:
-                        argument = ComplexArgument.from_row(row)
-
-                    # The Sentinels:
-                    # subprogram_id is unique for non-package routines
-                    # object_id is unique for package routines
-                    if oid != row.object_id or sid != row.subprogram_id:
-                        routine = Routine.from_row(row)
-                        database.dispatch_routine(row, routine)
-
-                    # An excessive check for mypy validation
-                    if routine is not None:
-                        routine.dispatch_argument(argument)
-
-                    oid = row.object_id
-                    sid = row.subprogram_id
-
+                if parallel:
+                    schemes = next(built)
+                    if self.share_types:
+                        share_types(schemes, database.types)
+                else:
+                    schemes = build_schemes(
+                        schema.rows,
+                        database.types if self.share_types else None,
+                    )
+                # The Schema is kept, even if it has no Packages (anymore)
+                database.schemes.extend(
+                    schemes or [Schema(name=schema.name.lower())],
+                )
             intermediate_representation.append(database)
 
         return intermediate_representation
+
+    def stream(self) -> Iterator[StreamedPackage]:
+        """
+        Stream the complete IR Packages in the introspection order.
+
+        Nothing is built ahead: the Packages are built while the rows are
+        consumed, so with the streaming introspection the plugins may start
+        while the DB is still fetching the rest.
+        """
+        for introspected in self.introspection:
+            # Lowercased, as the Database name
+            database = introspected.name.lower()
+            types = self.types()
+            for introspected_schema in introspected.schemes:
+                empty = True
+                for schema, package in stream_packages(
+                    introspected_schema.rows,
+                    types,
+                ):
+                    empty = False
+                    yield StreamedPackage(database, schema, package)
+                if empty:
+                    yield StreamedPackage(
+                        database,
+                        introspected_schema.name.lower(),
+                    )
+
+
+def build_schemes(
+    rows: Iterable[IntrospectionRow],
+    types: Optional[TypeRegistry] = None,
+) -> MutableSequence[Schema]:
+    """Build IR Schemes of introspection rows (see stream_packages)."""
+    schemes: MutableSequence[Schema] = []
+    for schema_name, package in stream_packages(rows, types):
+        if not schemes or schemes[-1].name != schema_name:
+            schemes.append(Schema(name=schema_name))
+        schemes[-1].packages.append(package)
+    return schemes
+
+
+def stream_packages(
+    rows: Iterable[IntrospectionRow],
+    types: Optional[TypeRegistry] = None,
+) -> Iterator[Tuple[str, Package]]:
+    """
+    Build IR Packages of introspection rows, yielding (schema, Package).
+
+    The rows are ordered by the packages, so a Package is complete (and
+    yielded) as soon as a row of another one (or the end) is consumed.
+
+    The complex arguments of the current routine are kept in a stack (by
+    their data levels), so every row is placed in O(1), instead of
+    descending from the routine for every nested argument.
+
+    If there is a types registry, the nested arguments of the registered
+    types aren't built again: the rows are skipped, and the registered
+    ones are shared.
+    """
+    key = None  # (schema, package) of the current package
+    package: Optional[Package] = None
+    routine: Optional[Routine] = None  # None before first iteration
+    parents: MutableSequence[ComplexArgument] = []
+    oid = None
+    sid = None
+    skipped = None  # data level of a shared type, its nested rows are skipped
+
+    for row in rows:
+        if skipped is not None and row.data_level > skipped:
+            continue
+        skipped = None
+
+        argument: Argument
+        if row.data_type not in COMPLEX_TYPES:
+            argument = SimpleArgument.from_row(row)
+        else:
+            argument = ComplexArgument.from_row(row)
+
+        # The Sentinels:
+        # subprogram_id is unique for non-package routines
+        # object_id is unique for package routines
+        if oid != row.object_id or sid != row.subprogram_id:
+            if key != (row.schema, row.package):
+                if package is not None:
+                    yield key[0], package  # type: ignore
+                key = interned(row.schema), row.package
+                package = Package(name=row.package, is_package=row.is_package)
+            routine = Routine.from_row(row)
+            package.routines.append(routine)  # type: ignore
+            oid = row.object_id
+            sid = row.subprogram_id
+
+        # The parents of the deeper levels are done
+        level = row.data_level
+        del parents[level:]  # noqa: WPS420
+        if level == 0 and routine is not None:
+            routine.arguments.append(argument)
+        elif len(parents) == level:
+            parents[-1].arguments.append(argument)
+        else:
+            raise TypeError('There is no complex children.')
+
+        if isinstance(argument, ComplexArgument):
+            type_key = None if types is None else argument.type_key
+            if type_key is None:
+                parents.append(argument)
+            elif type_key in types:  # type: ignore
+                argument.arguments = types[type_key]  # type: ignore
+                skipped = level
+            else:
+                types[type_key] = argument.arguments  # type: ignore
+                parents.append(argument)
+
+    if package is not None:
+        yield key[0], package  # type: ignore
+
+
+def share_types(schemes: Iterable[Schema], types: TypeRegistry):
+    """
+    Share the nested arguments of the registered types; register the others.
+
+    It's for the Schemes that are built with other registries (e.g. in other
+    processes).
+    """
+    stack: MutableSequence[Argument] = [
+        argument
+        for schema in reversed(list(schemes))
+        for package in reversed(schema.packages)
+        for routine in reversed(package.routines)
+        for argument in reversed(routine.arguments)
+    ]
+    # Preorder, as the rows are
+    while stack:
+        argument = stack.pop()
+        if not isinstance(argument, ComplexArgument):
+            continue
+        type_key = argument.type_key
+        if type_key in types:
+            argument.arguments = types[type_key]  # type: ignore
+            continue
+        if type_key is not None:
+            types[type_key] = argument.arguments
+        stack.extend(reversed(argument.arguments))
@@ -61,19 +61,48 @@ Introspection types and utilities.
     the typename by hand, using dbsg config.
 
 """
-from dataclasses import dataclass, field
-from typing import MutableSequence, Optional
-from threading import Lock, Thread
+from __future__ import annotations
+from dataclasses import astuple, dataclass, field
+from hashlib import sha1
+from itertools import chain
+from json import dumps, load
+from pathlib import Path
+from queue import Full, Queue
+from threading import Event, Thread
+from time import perf_counter
+from typing import (
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    Mapping,
+    MutableMapping,
+    MutableSequence,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
 from logging import getLogger
 
-from cx_Oracle import Connection, SessionPool  # pylint: disable=E0611
+from cx_Oracle import (  # pylint: disable=E0611
+    Connection,
+    DatabaseError,
+    SessionPool,
+)
 
-from dbsg.lib.configuration import Configuration, Schema, IntrospectionAppendix
+from dbsg.lib.configuration import (
+    Configuration,
+    Database,
+    IntrospectionAppendix,
+    IntrospectionAppendixKey,
+    Schema,
+)
+from dbsg.lib.scheduler import Scheduler, Unit
 
 LOG = getLogger(__name__)
 
-INTROSPECTION_DB_ADD_NEW_SCHEMA_LOCK = Lock()
-
 COMPLEX_TYPES = (
     'ref cursor',
     'object',
@@ -181,15 +210,214 @@ where
     -- Filter:
 """.strip()
 
+# noinspection SqlNoDataSourceInspection,SqlResolve
+ARGUMENTS_WITH_PACKAGE_SQL = """
+select
+    aa.owner schema,
+    aa.package_name package,
+    1 is_package,
+    aa.object_name routine,
+    case when max(
+        case when aa.argument_name is null and aa.in_out = 'OUT'
+            then 1 else 0
+        end
+    ) over (partition by aa.object_id, aa.subprogram_id) = 1
+        then 'FUNCTION' else 'PROCEDURE'
+    end routine_type,
+    aa.object_id object_id,
+    aa.overload overload,
+    aa.subprogram_id subprogram_id,
+    case when (
+        aa.argument_name is null
+        and aa.in_out = 'OUT'
+        and aa.data_level = 0
+    ) then '_DBSG_RESULT' else aa.argument_name
+    end argument,
+    aa.position position,
+    aa.sequence sequence,
+    aa.data_level data_level,
+    aa.data_type data_type,
+    aa.type_owner custom_type_schema,
+    aa.type_name custom_type_package,
+    aa.type_subname custom_type,
+    aa.defaulted defaulted,
+    aa.default_value default_value,
+    aa.in_out in_out
+from
+    sys.all_arguments aa
+where
+    aa.owner = :schema
+    and aa.package_name is not null
+    -- Not an object type's method
+    and aa.object_id in (
+        select object_id from sys.all_objects
+        where owner = :schema and object_type = 'PACKAGE'
+    )
+    -- Filter:
+""".strip()
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+ARGUMENTS_WITHOUT_PACKAGE_SQL = """
+select
+    aa.owner schema,
+    :no_package_name package,
+    0 is_package,
+    aa.object_name routine,
+    case when max(
+        case when aa.argument_name is null and aa.in_out = 'OUT'
+            then 1 else 0
+        end
+    ) over (partition by aa.object_id, aa.subprogram_id) = 1
+        then 'FUNCTION' else 'PROCEDURE'
+    end routine_type,
+    aa.object_id object_id,
+    aa.overload overload,
+    aa.subprogram_id subprogram_id,
+    case when aa.argument_name is null and aa.in_out = 'OUT'
+        then '_DBSG_RESULT'
+        else aa.argument_name
+    end argument,
+    aa.position position,
+    aa.sequence sequence,
+    aa.data_level data_level,
+    aa.data_type data_type,
+    aa.type_owner custom_type_schema,
+    aa.type_name custom_type_package,
+    aa.type_subname custom_type,
+    aa.defaulted defaulted,
+    aa.default_value default_value,
+    aa.in_out in_out
+from
+    sys.all_arguments aa
+where
+    aa.owner = :schema
+    and aa.package_name is null
+    -- Filter:
+""".strip()
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+DBA_PROBE_SQL = 'select null from sys.dba_objects where rownum = 1'
+
 INTROSPECTION_ORDER_CLAUSE = (
     'order by package, object_id, subprogram_id, sequence, position'
 )
 
+# Every filter is bound as a collection of names, so the SQL text depends on
+# the used filters only (not on their values), and it's cacheable. The columns
+# are provided by an IntrospectionStrategy
+INTROSPECTION_COLLECTION_TYPE = 'SYS.ODCIVARCHAR2LIST'
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+INTROSPECTION_WITH_PACKAGE_FILTERS = {
+    # "PACKAGE.ROUTINE"
+    'included_routines': """
+    and ({package}, {routine}) in (
+        select
+            substr(column_value, 1, instr(column_value, '.') - 1),
+            substr(column_value, instr(column_value, '.') + 1)
+        from table(:included_routines)
+    )""".strip('\n'),
+    'excluded_packages': """
+    and {package} not in (
+        select column_value from table(:excluded_packages)
+    )""".strip('\n'),
+    # "PACKAGE.ROUTINE"
+    'excluded_routines': """
+    and ({package}, {routine}) not in (
+        select
+            substr(column_value, 1, instr(column_value, '.') - 1),
+            substr(column_value, instr(column_value, '.') + 1)
+        from table(:excluded_routines)
+    )""".strip('\n'),
+    # Incremental or sharded introspection
+    'packages': """
+    and {package} in (
+        select column_value from table(:packages)
+    )""".strip('\n'),
+}
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+INTROSPECTION_WITHOUT_PACKAGE_FILTERS = {
+    'included_routines_no_pkg': """
+    and {standalone} in (
+        select column_value from table(:included_routines_no_pkg)
+    )""".strip('\n'),
+    'excluded_routines_no_pkg': """
+    and {standalone} not in (
+        select column_value from table(:excluded_routines_no_pkg)
+    )""".strip('\n'),
+    # Incremental or sharded introspection
+    'routines': """
+    and {standalone} in (
+        select column_value from table(:routines)
+    )""".strip('\n'),
+}
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+INTROSPECTION_OBJECTS_SQL = """
+select
+    ao.object_name object_name,
+    ao.object_type object_type,
+    ao.last_ddl_time last_ddl_time,
+    ao.object_id object_id
+from
+    sys.all_objects ao
+where
+    ao.owner = :schema
+    and ao.object_type in ('PACKAGE', 'FUNCTION', 'PROCEDURE')
+order by
+    case when ao.object_type = 'PACKAGE'
+        then ao.object_name
+        else :no_package_name
+    end,
+    ao.object_id
+""".strip()
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+INTROSPECTION_ESTIMATE_SQL = """
+select
+    nvl(aa.package_name, aa.object_name) object_name,
+    count(*) estimate
+from
+    sys.all_arguments aa
+where
+    aa.owner = :schema
+group by
+    nvl(aa.package_name, aa.object_name)
+""".strip()
+
 
 # *****************************INTROSPECTION TYPES*****************************
 @dataclass
 class IntrospectionRow:
-    """Flat Introspection result."""
+    """
+    Flat Introspection result.
+
+    The rows are slotted (there may be millions of them), and they are
+    made from the raw DB rows by batches, see IntrospectionRow.normalize.
+    """
+
+    __slots__ = (
+        'schema',
+        'package',
+        'is_package',
+        'routine',
+        'routine_type',
+        'object_id',
+        'overload',
+        'subprogram_id',
+        'argument',
+        'position',
+        'sequence',
+        'data_level',
+        'data_type',
+        'custom_type_schema',
+        'custom_type_package',
+        'custom_type',
+        'defaulted',
+        'default_value',
+        'in_out',
+    )
 
     schema: str
     package: str
@@ -211,24 +439,101 @@ class IntrospectionRow:
     default_value: None  # Currently isn't supported in Oracle; always NULL
     in_out: str
 
-    def __post_init__(self):
-        """Introspection Appendix post-processing."""
-        self.defaulted = self.defaulted == 'Y'
-        self.is_package = bool(self.is_package)
-        self.overload = int(self.overload or 0)
-        # Lowercase every string, so we won't think about it anymore
-        # noinspection PyUnresolvedReferences
-        # pylint: disable=E1101
-        for attribute_name in self.__dataclass_fields__:
-            attribute_value = getattr(self, attribute_name, None)
-            if isinstance(attribute_value, str):
-                setattr(self, attribute_name, attribute_value.lower())
+    @classmethod
+    def normalize(cls, batch: Iterable[Sequence]) -> List[IntrospectionRow]:
+        """
+        Make IntrospectionRows from a batch of raw DB rows.
+
+        The batch is post-processed column by column: every string is
+        lowercased, so we won't think about it anymore; the flags are cast to
+        bool; the missing overloads are cast to 0.
+        """
+        columns: MutableSequence[Sequence] = list(zip(*batch))
+        if not columns:
+            return []
+
+        for position, normalizer in enumerate(ROW_NORMALIZERS):
+            if normalizer is not None:
+                columns[position] = normalizer(columns[position])
+
+        return list(map(cls, *columns))
+
+    @classmethod
+    def restore(cls, values: Iterable) -> IntrospectionRow:
+        """Make IntrospectionRow from already post-processed values."""
+        return cls(*values)
+
+    def __reduce__(self):
+        """Pickle the values only (e.g. for the IR process pool)."""
+        return self.__class__, tuple(getattr(self, s) for s in self.__slots__)
+
+    @property
+    def object_name(self) -> str:
+        """Name of the DB object (package or standalone routine)."""
+        return self.package if self.is_package else self.routine
 
     def override(self, data: IntrospectionAppendix):
         """Override IntrospectionRow from DB with an IntrospectionAppendix."""
         for attr, value in data.new.items():
             setattr(self, attr, value)
 
+    def apply(
+        self,
+        appendix: Mapping[IntrospectionAppendixKey, IntrospectionAppendix],
+    ):
+        """Override data from the Schema's IntrospectionAppendix, if any."""
+        # Firstly, try to override for the whole subroutine
+        if (self.object_id, self.subprogram_id) in appendix:
+            self.override(appendix[(self.object_id, self.subprogram_id)])
+
+        # Secondly, try to override the concrete argument
+        key = (self.object_id, self.subprogram_id, self.position)
+        if key in appendix:
+            self.override(appendix[key])
+
+
+def _lowercase(column: Sequence) -> Sequence:
+    try:
+        return list(map(str.lower, column))
+    except TypeError:  # Nullable column
+        return [v.lower() if isinstance(v, str) else v for v in column]
+
+
+def _overload(column: Sequence) -> Sequence:
+    return [int(overload or 0) for overload in column]
+
+
+def _defaulted(column: Sequence) -> Sequence:
+    return [defaulted == 'Y' for defaulted in column]
+
+
+def _is_package(column: Sequence) -> Sequence:
+    return list(map(bool, column))
+
+
+# Column post-processing of the raw DB rows, in the order of IntrospectionRow
+ROW_NORMALIZERS: Sequence[Optional[Callable[[Sequence], Sequence]]] = (
+    _lowercase,  # schema
+    _lowercase,  # package
+    _is_package,  # is_package
+    _lowercase,  # routine
+    _lowercase,  # routine_type
+    None,  # object_id
+    _overload,  # overload
+    None,  # subprogram_id
+    _lowercase,  # argument
+    None,  # position
+    None,  # sequence
+    None,  # data_level
+    _lowercase,  # data_type
+    _lowercase,  # custom_type_schema
+    _lowercase,  # custom_type_package
+    _lowercase,  # custom_type
+    _defaulted,  # defaulted
+    None,  # default_value
+    _lowercase,  # in_out
+)
+
 
 @dataclass
 class IntrospectionSchema:
@@ -236,7 +541,8 @@ class IntrospectionSchema:
 
     name: str
     no_package_name: str
-    rows: MutableSequence[IntrospectionRow] = field(default_factory=list)
+    # A RowStream in the streaming mode
+    rows: Iterable[IntrospectionRow] = field(default_factory=list)
 
 
 @dataclass
@@ -248,9 +554,300 @@ class IntrospectionDatabase:
 
 
 Introspection = MutableSequence[IntrospectionDatabase]
+
+
+class IntrospectionObject(NamedTuple):
+    """A DB object (package or standalone routine) from all_objects."""
+
+    object_type: str
+    last_ddl_time: str
+    object_id: int = 0
+    # The name as is in the DB (a quoted one may be mixed-case); it's bound
+    # by the incremental and sharded introspection
+    object_name: str = ''
+
+    @property
+    def is_package(self) -> bool:
+        """Check whether the object is a package."""
+        return self.object_type == 'package'
+
+
+# Object name -> IntrospectionObject
+IntrospectionObjects = Mapping[str, IntrospectionObject]
+
+
+@dataclass
+class IntrospectionStatement:
+    """Introspection SQL, its binds, and its cost estimate."""
+
+    sql: str
+    binds: MutableMapping
+    cost: int = field(default=0)
+
+
+@dataclass
+class IntrospectionPlan:
+    """Introspection plan of one DB Schema."""
+
+    schema: Schema
+    snapshot: Snapshot
+    objects: IntrospectionObjects
+    # The objects that should be introspected; None means "everything"
+    outdated: Optional[Set[str]]
+    statements: MutableSequence[IntrospectionStatement]
 # *****************************INTROSPECTION TYPES*****************************
 
 
+# ****************************INTROSPECTION SNAPSHOT****************************
+@dataclass
+class SnapshotObject:
+    """A DB object (package or standalone routine) and its introspection."""
+
+    object_type: str
+    last_ddl_time: str
+    rows: MutableSequence[IntrospectionRow] = field(default_factory=list)
+
+
+@dataclass
+class Snapshot:
+    """
+    Persisted introspection of a DB Schema.
+
+    The rows are keyed by (owner, object_name, last_ddl_time), so only
+    the objects which were changed, created or dropped since the previous
+    run should be introspected again.
+    """
+
+    VERSION = 1
+
+    path: Path
+    signature: str
+    objects: MutableMapping[str, SnapshotObject] = field(default_factory=dict)
+    # Whether the objects were merged since the load (see merge)
+    changed: bool = field(default=False)
+
+    @staticmethod
+    def sign(schema: Schema) -> str:
+        """Make a signature of the Schema settings that affect the rows."""
+        settings = (
+            schema.no_package_name,
+            schema.included_packages,
+            schema.included_routines,
+            schema.included_routines_no_pkg,
+            schema.excluded_packages,
+            schema.excluded_routines,
+            schema.excluded_routines_no_pkg,
+        )
+        return sha1(repr(settings).encode('utf8')).hexdigest()
+
+    @classmethod
+    def load(cls, path: Path, schema: Schema) -> Snapshot:
+        """Load the Snapshot; it's empty if missing, outdated or broken."""
+        snapshot = cls(path=path, signature=cls.sign(schema))
+        if not path.is_file():
+            return snapshot
+
+        try:
+            with path.open('r', encoding='utf8') as fh:
+                data = load(fh)
+        except ValueError:
+            LOG.warning(f'The snapshot {path} is broken. Ignoring it.')
+            return snapshot
+
+        if (
+            data.get('version') != cls.VERSION
+            or data.get('signature') != snapshot.signature
+        ):
+            LOG.info(f'The snapshot {path} is outdated. Ignoring it.')
+            return snapshot
+
+        for name, obj in data['objects'].items():
+            snapshot.objects[name] = SnapshotObject(
+                object_type=obj['object_type'],
+                last_ddl_time=obj['last_ddl_time'],
+                rows=[IntrospectionRow.restore(r) for r in obj['rows']],
+            )
+
+        return snapshot
+
+    def save(self):
+        """Persist the Snapshot."""
+        objects = {}
+        for name, obj in self.objects.items():
+            objects[name] = {
+                'object_type': obj.object_type,
+                'last_ddl_time': obj.last_ddl_time,
+                'rows': [astuple(r) for r in obj.rows],
+            }
+        data = {
+            'version': self.VERSION,
+            'signature': self.signature,
+            'objects': objects,
+        }
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open('w', encoding='utf8') as fh:
+            fh.write(dumps(data, ensure_ascii=False))
+
+    def outdated(
+        self,
+        objects: IntrospectionObjects,
+    ) -> Tuple[Optional[Set[str]], Optional[Set[str]]]:
+        """
+        Make (packages, standalone routines) that should be introspected.
+
+        None means "everything", because there's nothing to rely on.
+        """
+        if not self.objects:
+            return None, None
+
+        packages = set()
+        routines = set()
+        for name, obj in objects.items():
+            cached = self.objects.get(name)
+            if cached and cached.last_ddl_time == obj.last_ddl_time:
+                continue
+            if obj.object_type == 'package':
+                packages.add(name)
+            else:
+                routines.add(name)
+
+        return packages, routines
+
+    def merge(
+        self,
+        objects: IntrospectionObjects,
+        rows: Iterable[IntrospectionRow],
+        outdated: Optional[Set[str]] = None,
+    ) -> MutableSequence[IntrospectionRow]:
+        """
+        Merge the introspected rows and make the final ordered rows.
+
+        The objects are in the DB order (see INTROSPECTION_OBJECTS_SQL), so
+        the rows of every object are placed by its name, in the same order as
+        INTROSPECTION_ORDER_CLAUSE would place them.
+        """
+        fresh: MutableMapping[str, MutableSequence[IntrospectionRow]] = {}
+        for row in rows:
+            fresh.setdefault(row.object_name, []).append(row)
+
+        # Dropped objects
+        if set(self.objects) - set(objects):
+            self.changed = True
+
+        merged: MutableMapping[str, SnapshotObject] = {}
+        for name, obj in objects.items():
+            # Created or changed objects (even if they have no rows)
+            if outdated is None or name in outdated or name in fresh:
+                self.changed = True
+                merged[name] = SnapshotObject(
+                    object_type=obj.object_type,
+                    last_ddl_time=obj.last_ddl_time,
+                    rows=fresh.get(name, []),
+                )
+            elif name in self.objects:
+                merged[name] = self.objects[name]
+        self.objects = merged
+
+        return list(chain.from_iterable(o.rows for o in merged.values()))
+# ****************************INTROSPECTION SNAPSHOT****************************
+
+
+# ***************************INTROSPECTION STRATEGIES***************************
+@dataclass(frozen=True)
+class IntrospectionStrategy:
+    """
+    Introspection query strategy.
+
+    The strategies should make the same rows, but with different query plans.
+    The fastest one may depend on DB version, statistics and privileges.
+    """
+
+    name: str
+    with_package_sql: str
+    without_package_sql: str
+    # The columns for INTROSPECTION_*_FILTERS
+    package_column: str = field(default='ao.object_name')
+    routine_column: str = field(default='ap.procedure_name')
+    standalone_column: str = field(default='ao.object_name')
+    # A query that checks privileges; None means "always available"
+    probe_sql: Optional[str] = field(default=None)
+
+    def filter(self, template: str) -> str:
+        """Make an introspection filter for the strategy's columns."""
+        return template.format(
+            package=self.package_column,
+            routine=self.routine_column,
+            standalone=self.standalone_column,
+        )
+
+    def available(self, connection: Connection) -> bool:
+        """Check whether the strategy can be used (privileges, etc)."""
+        if self.probe_sql is None:
+            return True
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(self.probe_sql)
+                cursor.fetchall()
+        except DatabaseError as error:
+            LOG.info(f'The "{self.name}" strategy is unavailable: {error}')
+            return False
+        return True
+
+
+STRATEGIES: Mapping[str, IntrospectionStrategy] = {
+    # all_objects x all_procedures x all_arguments, with a correlated EXISTS
+    # for routine_type
+    'join': IntrospectionStrategy(
+        name='join',
+        with_package_sql=INTROSPECTION_WITH_PACKAGE_SQL,
+        without_package_sql=INTROSPECTION_WITHOUT_PACKAGE_SQL,
+    ),
+    # all_arguments only, with an analytic function for routine_type
+    'arguments': IntrospectionStrategy(
+        name='arguments',
+        with_package_sql=ARGUMENTS_WITH_PACKAGE_SQL,
+        without_package_sql=ARGUMENTS_WITHOUT_PACKAGE_SQL,
+        package_column='aa.package_name',
+        routine_column='aa.object_name',
+        standalone_column='aa.object_name',
+    ),
+    # The same as "join", but dba_* views (if privileges allow)
+    'dba': IntrospectionStrategy(
+        name='dba',
+        with_package_sql=INTROSPECTION_WITH_PACKAGE_SQL.replace(
+            'all_', 'dba_',
+        ),
+        without_package_sql=INTROSPECTION_WITHOUT_PACKAGE_SQL.replace(
+            'all_', 'dba_',
+        ),
+        probe_sql=DBA_PROBE_SQL,
+    ),
+}
+
+
+@dataclass
+class StrategyComparison:
+    """Elapsed time and row count of a strategy for a DB Schema."""
+
+    database: str
+    schema: str
+    strategy: str
+    elapsed: float
+    rows: int
+    # Whether the rows are the same as the first strategy's ones
+    equal: bool
+
+    def __str__(self):
+        """Make a report line."""
+        equal = 'equal' if self.equal else 'DIFFERENT'
+        return (
+            f'{self.database}.{self.schema} [{self.strategy}]: '
+            + f'{self.elapsed:.3f}s, {self.rows} rows ({equal})'
+        )
+# ***************************INTROSPECTION STRATEGIES***************************
+
+
 # **************************Introspection Entry Point**************************
 class Inspect:
     """Introspection Entry Point."""
@@ -261,139 +858,541 @@ class Inspect:
         self.result: Introspection = []
 
     def introspection(self) -> Introspection:
-        """Introspect DB Schemas, in parallel."""
+        """
+        Introspect DB Schemas, in parallel.
+
+        The concurrency is bounded by the session pool's max of each DB. The
+        Schemas are planned and estimated (by their argument counts)
+        beforehand, so the most expensive statements are executed first.
+        """
+        if self.conf.streaming:
+            return self.streaming_introspection()
+
+        session_pools = self.conf.connect()
+        schemes = [(db, s) for db in self.conf.databases for s in db.schemes]
+
+        scheduler = Scheduler()
+        for db, schema in schemes:
+            scheduler.add(db.name, db.pool.max, Unit(
+                target=self.plan,
+                args=(session_pools[db.name], schema, db),
+            ))
+        plans = scheduler.run()
+
+        scheduler = Scheduler()
+        for (db, _), plan in zip(schemes, plans):
+            for statement in plan.statements:
+                scheduler.add(db.name, db.pool.max, Unit(
+                    target=self.fetch,
+                    args=(session_pools[db.name], statement),
+                    cost=statement.cost,
+                ))
+        fetched = iter(scheduler.run())
+
+        # The DBs and their Schemas are placed in the configuration's order
+        introspected = iter([
+            self.finish(plan, [next(fetched) for _ in plan.statements])
+            for plan in plans
+        ])
+        introspection = []
+        for db in self.conf.databases:  # noqa: WPS440
+            introspection.append(IntrospectionDatabase(
+                name=db.name,
+                schemes=[next(introspected) for _ in db.schemes],
+            ))
+
+        self.result = introspection
+
+        return introspection
+
+    def streaming_introspection(self) -> Introspection:
+        """
+        Introspect DB Schemas lazily.
+
+        The rows of every Schema are a RowStream, which is fetched while it's
+        consumed (e.g. by the IR builder). The snapshots and the sharding
+        aren't used in this mode.
+        """
         introspection = []
-        # Fork and process each schema in a separate thread
-        threads = []
+        session_pools = self.conf.connect()
         for db in self.conf.databases:
+            session_pool = session_pools[db.name]
+            strategy = self.strategy(db)
             introspection_db = IntrospectionDatabase(name=db.name)
-            introspection.append(introspection_db)
-
-            session_pool = db.connect()
             for schema in db.schemes:
-                thread = Thread(
-                    target=self._introspect_one_schema,
-                    args=(session_pool, schema, introspection_db),
-                    daemon=True,
-                )
-                threads.append(thread)
-                thread.start()
-
-        # Block and Join
-        for thread in threads:  # noqa: WPS440
-            thread.join()
+                sql, binds = self.statement(schema, strategy=strategy)
+                introspection_db.schemes.append(IntrospectionSchema(
+                    name=schema.name,
+                    no_package_name=schema.no_package_name,
+                    rows=RowStream(
+                        session_pool=session_pool,
+                        statement=IntrospectionStatement(sql or '', binds),
+                        schema=schema,
+                        conf=self.conf,
+                    ),
+                ))
+            introspection.append(introspection_db)
 
         self.result = introspection
 
         return introspection
 
+    def compare_strategies(self) -> MutableSequence[StrategyComparison]:
+        """
+        Introspect every DB Schema with every available strategy.
+
+        The strategies are run one by one, so the timings are comparable.
+        Neither snapshots nor sharding are used.
+        """
+        comparisons = []
+        session_pools = self.conf.connect()
+        for db in self.conf.databases:
+            session_pool = session_pools[db.name]
+            connection: Connection = session_pool.acquire()
+            try:
+                strategies = [
+                    s for s in STRATEGIES.values() if s.available(connection)
+                ]
+            finally:
+                session_pool.release(connection)
+
+            for schema in db.schemes:
+                baseline = None
+                for strategy in strategies:
+                    sql, binds = self.statement(schema, strategy=strategy)
+                    if sql is None:
+                        continue
+                    started = perf_counter()
+                    rows = self.fetch(
+                        session_pool,
+                        IntrospectionStatement(sql, binds),
+                    )
+                    elapsed = perf_counter() - started
+                    fetched = sorted(map(astuple, rows), key=repr)
+                    baseline = fetched if baseline is None else baseline
+                    comparison = StrategyComparison(
+                        database=db.name,
+                        schema=schema.name,
+                        strategy=strategy.name,
+                        elapsed=elapsed,
+                        rows=len(fetched),
+                        equal=fetched == baseline,
+                    )
+                    LOG.info(str(comparison))
+                    comparisons.append(comparison)
+
+        return comparisons
+
     @staticmethod
-    def _introspect_one_schema(
+    def strategy(db: Database) -> IntrospectionStrategy:
+        """Get the DB's introspection strategy."""
+        if db.strategy not in STRATEGIES:
+            raise ValueError(
+                f'The "{db.strategy}" strategy of {db.name} is unknown. '
+                + f'Available strategies: {", ".join(STRATEGIES)}.',
+            )
+        return STRATEGIES[db.strategy]
+
+    def plan(
+        self,
         session_pool: SessionPool,
         schema: Schema,
-        introspection_db: IntrospectionDatabase,
-    ):
-        """Introspect one DB Schema."""
-        sql_statements = []
-        binds = {'schema': schema.name}
-        included_routines_from_packages = (
-            '    and ao.owner '
-            + "|| '.' "
-            + '|| ao.object_name '
-            + "|| '.' "
-            + f'|| ap.procedure_name in ({schema.included_routines})'
-        )
-        included_routines_without_packages = (
-            f'  and aa.object_name in ({schema.included_routines_no_pkg})'
-        )
-        excluded_packages = (
-            f'  and ao.object_name not in ({schema.excluded_packages})'
-        )
-        excluded_routines_from_packages = (
-            '  and ao.owner '
-            + "|| '.' "
-            + '|| ao.object_name '
-            + "|| '.' "
-            + f'|| ap.procedure_name not in ({schema.excluded_routines})'
+        db: Database,
+    ) -> IntrospectionPlan:
+        """Make introspection plan and estimates of one DB Schema."""
+        binds: MutableMapping = {'schema': schema.name}
+        snapshot = self.snapshot(db.name, schema)
+        strategy = self.strategy(db)
+        connection: Connection = session_pool.acquire()
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(INTROSPECTION_OBJECTS_SQL, {
+                    'no_package_name': schema.no_package_name,
+                    **binds,
+                })
+                objects = {
+                    name.lower(): IntrospectionObject(
+                        object_type=object_type.lower(),
+                        last_ddl_time=str(last_ddl_time),
+                        object_id=object_id,
+                        object_name=name,
+                    )
+                    for name, object_type, last_ddl_time, object_id
+                    in cursor.fetchall()
+                }
+                packages, routines = snapshot.outdated(objects)
+                planned = []
+                shards = self.shards(schema, objects, packages, routines)
+                for shard in shards:
+                    shard_sql, shard_binds = self.statement(
+                        schema,
+                        self.db_names(objects, shard[0]),
+                        self.db_names(objects, shard[1]),
+                        strategy=strategy,
+                    )
+                    if shard_sql is not None:
+                        planned.append((shard, shard_sql, shard_binds))
+
+                # The estimates are a pass over all_arguments, so they are
+                # made only if there is anything to introspect
+                estimates: MutableMapping[str, int] = {}
+                if planned:
+                    cursor.execute(INTROSPECTION_ESTIMATE_SQL, binds)
+                    estimates = {n.lower(): e for n, e in cursor.fetchall()}
+        finally:
+            session_pool.release(connection)
+
+        outdated = None
+        if packages is not None and routines is not None:
+            outdated = packages | routines
+
+        every_package = {n for n, o in objects.items() if o.is_package}
+        every_routine = set(objects) - every_package
+
+        statements = []
+        for (shard_packages, shard_routines), sql, statement_binds in planned:
+            names = chain(
+                every_package if shard_packages is None else shard_packages,
+                every_routine if shard_routines is None else shard_routines,
+            )
+            cost = sum(estimates.get(n, 0) for n in names)
+            statements.append(
+                IntrospectionStatement(sql, statement_binds, cost),
+            )
+
+        if not statements:
+            LOG.info(f'Schema {schema.name} has no changes.')
+
+        return IntrospectionPlan(
+            schema=schema,
+            snapshot=snapshot,
+            objects=objects,
+            outdated=outdated,
+            statements=statements,
         )
-        excluded_routines_without_packages = (
-            '  and ao.owner '
-            + "|| '.' "
-            + '|| ap.object_name '
-            + f'not in ({schema.excluded_routines_no_pkg})'
+
+    @staticmethod
+    def db_names(
+        objects: IntrospectionObjects,
+        names: Optional[Set[str]],
+    ) -> Optional[Set[str]]:
+        """Map the (lowercased) object names to the names as is in the DB."""
+        if names is None:
+            return None
+        return {objects[n].object_name for n in names}
+
+    @staticmethod
+    def shards(
+        schema: Schema,
+        objects: IntrospectionObjects,
+        packages: Optional[Set[str]],
+        routines: Optional[Set[str]],
+    ) -> MutableSequence[Tuple[Optional[Set[str]], Optional[Set[str]]]]:
+        """
+        Split introspection into (packages, standalone routines) shards.
+
+        Without sharding, there is a single shard of everything. Otherwise,
+        the explicitly listed packages make their own shards; the rest are
+        split by shard_size packages (in object_id order); the standalone
+        routines make the last shard. None means "everything".
+        """
+        if not schema.shards and not schema.shard_size:
+            return [(packages, routines)]
+
+        if packages is None:
+            packages = {n for n, o in objects.items() if o.is_package}
+
+        shards: MutableSequence[
+            Tuple[Optional[Set[str]], Optional[Set[str]]]
+        ] = []
+        rest = set(packages)
+        # A listed name is matched as is (a quoted one), else as unquoted
+        by_db_name = {objects[p].object_name: p for p in rest}
+        for listed in schema.shards:
+            names = chain(listed, (p.upper() for p in listed))
+            shard = {by_db_name[n] for n in names if n in by_db_name} & rest
+            rest -= shard
+            if shard:
+                shards.append((shard, set()))
+
+        ordered = sorted(rest, key=lambda p: objects[p].object_id)
+        size = schema.shard_size or len(ordered) or 1
+        for i in range(0, len(ordered), size):
+            shards.append((set(ordered[i:i + size]), set()))
+
+        if routines is None or routines:
+            shards.append((set(), routines))
+
+        return shards
+
+    def fetch(
+        self,
+        session_pool: SessionPool,
+        statement: IntrospectionStatement,
+    ) -> MutableSequence[IntrospectionRow]:
+        """Execute an introspection statement and fetch all the rows."""
+        msg = (
+            '-- Use print() to format the msg\n'
+            + f'-- {statement.binds}\n{statement.sql};'
         )
+        LOG.info(repr(msg))
 
-        # If there are ANY Includes, then fetch only specified concrete objects
-        if schema.include_routines:
-            if schema.included_packages and not schema.included_routines_no_pkg:
-                sql_statements.append(INTROSPECTION_WITH_PACKAGE_SQL)
-                sql_statements.append(included_routines_from_packages)
+        connection: Connection = session_pool.acquire()
+        try:
+            with connection.cursor() as cursor:
+                tune(cursor, self.conf)
+                binds = bind(connection, statement.binds)
+                cursor.execute(statement.sql, binds)
+                rows = IntrospectionRow.normalize(cursor.fetchall())
+        finally:
+            session_pool.release(connection)
 
-            if schema.included_packages and schema.included_routines_no_pkg:
-                sql_statements.append(INTROSPECTION_WITH_PACKAGE_SQL)
-                sql_statements.append(included_routines_from_packages)
-                sql_statements.append('union all')
-                sql_statements.append(INTROSPECTION_WITHOUT_PACKAGE_SQL)
-                sql_statements.append(included_routines_without_packages)
+        return rows
 
-                binds['no_package_name'] = schema.no_package_name
+    @staticmethod
+    def finish(
+        plan: IntrospectionPlan,
+        shards: Iterable[Iterable[IntrospectionRow]],
+    ) -> IntrospectionSchema:
+        """Merge the shards and the snapshot, and apply the appendix."""
+        snapshot = plan.snapshot
+        rows = snapshot.merge(plan.objects, chain(*shards), plan.outdated)
+        if snapshot.changed:
+            snapshot.save()
 
-            if not schema.included_packages and schema.included_routines_no_pkg:
-                sql_statements.append(INTROSPECTION_WITHOUT_PACKAGE_SQL)
-                sql_statements.append(included_routines_without_packages)
+        appendix = plan.schema.introspection_appendix
+        for row in rows:
+            row.apply(appendix)
 
-                binds['no_package_name'] = schema.no_package_name
+        return IntrospectionSchema(
+            name=plan.schema.name,
+            no_package_name=plan.schema.no_package_name,
+            rows=rows,
+        )
 
-        # Else, fetch everything excluding "exclude"
-        else:
-            sql_statements.append(INTROSPECTION_WITH_PACKAGE_SQL)
+    def snapshot(self, db_name: str, schema: Schema) -> Snapshot:
+        """Load the Schema Snapshot, or make an empty one if --full."""
+        path = self.conf.snapshot_path / f'{db_name}.{schema.name}.json'
+        if self.conf.full:
+            return Snapshot(path=path, signature=Snapshot.sign(schema))
+        return Snapshot.load(path, schema)
 
-            if schema.exclude_packages:
-                sql_statements.append(excluded_packages)
+    @staticmethod
+    def statement(
+        schema: Schema,
+        packages: Optional[Set[str]] = None,
+        routines: Optional[Set[str]] = None,
+        strategy: Optional[IntrospectionStrategy] = None,
+    ) -> Tuple[Optional[str], MutableMapping]:
+        """
+        Make introspection SQL and its binds for one DB Schema.
 
-            if schema.exclude_routines:
-                sql_statements.append(excluded_routines_from_packages)
+        If packages or routines are provided (named as is in the DB), fetch
+        only the matching objects. If there's nothing to fetch, SQL is None.
+        """
+        strategy = strategy or STRATEGIES['join']
 
-            sql_statements.append('union all')
-            sql_statements.append(INTROSPECTION_WITHOUT_PACKAGE_SQL)
+        # Filters (binds) of each union part and whether to fetch the part
+        with_package: MutableMapping[str, Sequence[str]] = {}
+        without_package: MutableMapping[str, Sequence[str]] = {}
+        fetch_with_package = True
+        fetch_without_package = True
 
+        # If there are ANY Includes, then fetch only specified concrete objects
+        if schema.include_routines:
+            fetch_with_package = bool(schema.included_routines)
+            fetch_without_package = bool(schema.included_routines_no_pkg)
+            if fetch_with_package:
+                with_package['included_routines'] = schema.included_routines
+            if fetch_without_package:
+                without_package['included_routines_no_pkg'] = (
+                    schema.included_routines_no_pkg
+                )
+
+        # Else, fetch everything excluding "exclude"
+        else:
+            if schema.excluded_packages:
+                with_package['excluded_packages'] = schema.excluded_packages
+            if schema.excluded_routines:
+                with_package['excluded_routines'] = schema.excluded_routines
             if schema.excluded_routines_no_pkg:
-                sql_statements.append(excluded_routines_without_packages)
+                without_package['excluded_routines_no_pkg'] = (
+                    schema.excluded_routines_no_pkg
+                )
+
+        # Incremental or sharded introspection: only the concrete objects
+        if packages is not None and fetch_with_package:
+            with_package['packages'] = sorted(packages)
+            fetch_with_package = bool(packages)
+        if routines is not None and fetch_without_package:
+            without_package['routines'] = sorted(routines)
+            fetch_without_package = bool(routines)
 
+        binds: MutableMapping = {'schema': schema.name}
+        sql_statements = []
+        if fetch_with_package:
+            sql_statements.append(strategy.with_package_sql)
+            for name in with_package:
+                sql_statements.append(strategy.filter(
+                    INTROSPECTION_WITH_PACKAGE_FILTERS[name],
+                ))
+            binds.update(with_package)
+        if fetch_with_package and fetch_without_package:
+            sql_statements.append('union all')
+        if fetch_without_package:
+            sql_statements.append(strategy.without_package_sql)
+            for name in without_package:  # noqa: WPS440
+                sql_statements.append(strategy.filter(
+                    INTROSPECTION_WITHOUT_PACKAGE_FILTERS[name],
+                ))
+            binds.update(without_package)
             binds['no_package_name'] = schema.no_package_name
 
+        if not sql_statements:
+            return None, binds
+
         sql_statements.append(INTROSPECTION_ORDER_CLAUSE)
 
-        sql = '\n'.join(sql_statements)
-        LOG.info(repr(f'-- Use print() to format the msg\n-- {binds}\n{sql};'))
+        return '\n'.join(sql_statements), binds
 
-        # Fetch all the rows at once
-        connection: Connection = session_pool.acquire()
-        with connection.cursor() as cursor:
-            cursor.execute(sql, binds)
-            cursor.rowfactory = IntrospectionRow
-            rows: MutableSequence[IntrospectionRow] = cursor.fetchall()
 
-        # Override data from IntrospectionAppendix, if any
-        appendix = schema.introspection_appendix
-        for row in rows:
-            # Firstly, try to override for the whole subroutine
-            if (row.object_id, row.subprogram_id) in appendix:
-                a = appendix[(row.object_id, row.subprogram_id)]
-                row.override(a)
-
-            # Secondly, try to override the concrete argument
-            if (row.object_id, row.subprogram_id, row.position) in appendix:
-                a = appendix[(row.object_id, row.subprogram_id, row.position)]
-                row.override(a)
-
-        introspection_schema = IntrospectionSchema(
-            name=schema.name,
-            no_package_name=schema.no_package_name,
-            rows=rows,
+class RowStream:
+    """
+    Introspection rows of a DB Schema, fetched while they are consumed.
+
+    The rows are fetched by batches of arraysize in a producer thread, while
+    the consumer processes the previous batches; so the peak memory is
+    bounded by a few batches. Every iteration executes the statement again,
+    unless the rows are buffered (see buffer).
+    """
+
+    # Max of the fetched, but not yet consumed batches
+    DEPTH = 2
+    # Seconds to wait for the consumer before checking for the stop
+    PATIENCE = 0.1
+
+    def __init__(
+        self,
+        session_pool: SessionPool,
+        statement: IntrospectionStatement,
+        schema: Schema,
+        conf: Configuration,
+    ):
+        """Initialize the RowStream; nothing is fetched until iteration."""
+        self.session_pool = session_pool
+        self.statement = statement
+        self.schema = schema
+        self.conf = conf
+        # The rows of the last iteration, if they are buffered
+        self.buffered: Optional[MutableSequence[IntrospectionRow]] = None
+        self.complete = False
+
+    def buffer(self):
+        """
+        Keep the rows of the next complete iteration for the later ones.
+
+        So the rows are fetched once for all the consumers (e.g. the plugins
+        of the same run), but they are all kept in memory.
+        """
+        if self.buffered is None:
+            self.buffered = []
+
+    def __iter__(self) -> Iterator[IntrospectionRow]:
+        """Fetch and yield the rows, applying the introspection appendix."""
+        if self.complete and self.buffered is not None:
+            yield from self.buffered
+            return
+        if self.buffered is not None:
+            self.buffered.clear()
+        if not self.statement.sql:
+            self.complete = self.buffered is not None
+            return
+
+        batches: Queue = Queue(maxsize=self.DEPTH)
+        stop = Event()
+        producer = Thread(
+            target=self._produce,
+            args=(batches, stop),
+            daemon=True,
+        )
+        producer.start()
+
+        appendix = self.schema.introspection_appendix
+        try:
+            while True:
+                batch = batches.get()
+                if batch is None:
+                    break
+                if isinstance(batch, Exception):
+                    raise batch
+                for row in batch:
+                    row.apply(appendix)
+                    if self.buffered is not None:
+                        self.buffered.append(row)
+                    yield row
+            self.complete = self.buffered is not None
+        finally:
+            # The consumer may stop early; the producer should stop as well
+            stop.set()
+            producer.join()
+
+    def _produce(self, batches: Queue, stop: Event):
+        """Fetch the batches into the queue, until exhausted or stopped."""
+        msg = (
+            '-- Use print() to format the msg\n'
+            + f'-- {self.statement.binds}\n{self.statement.sql};'
         )
+        LOG.info(repr(msg))
+
+        # The acquire may fail too (e.g. the "nowait" getmode)
+        connection: Optional[Connection] = None
+        try:
+            connection = self.session_pool.acquire()
+            with connection.cursor() as cursor:
+                tune(cursor, self.conf)
+                binds = bind(connection, self.statement.binds)
+                cursor.execute(self.statement.sql, binds)
+                batch = IntrospectionRow.normalize(cursor.fetchmany())
+                while batch and self._put(batches, stop, batch):
+                    batch = IntrospectionRow.normalize(cursor.fetchmany())
+            self._put(batches, stop, None)
+        except Exception as error:  # noqa: B902
+            self._put(batches, stop, error)
+        finally:
+            if connection is not None:
+                self.session_pool.release(connection)
+
+    def _put(self, batches: Queue, stop: Event, batch) -> bool:
+        """Put the batch into the queue, unless the consumer has stopped."""
+        while not stop.is_set():
+            try:
+                batches.put(batch, timeout=self.PATIENCE)
+            except Full:
+                continue
+            return True
+        return False
 
-        # A guarantee that DB's schemas will be placed in series
-        with INTROSPECTION_DB_ADD_NEW_SCHEMA_LOCK:
-            introspection_db.schemes.append(introspection_schema)
+
+def tune(cursor, conf: Configuration):
+    """Apply the configured fetch settings to the cursor."""
+    cursor.arraysize = conf.arraysize
+    # cx_Oracle < 8 has no prefetchrows
+    if conf.prefetchrows is not None and hasattr(cursor, 'prefetchrows'):
+        cursor.prefetchrows = conf.prefetchrows
+
+
+def bind(connection: Connection, binds: Mapping) -> MutableMapping:
+    """Bind the lists of names as SQL collections."""
+    bound = dict(binds)
+    collection_type = None
+    for name, value in binds.items():
+        if isinstance(value, list):
+            if collection_type is None:
+                collection_type = connection.gettype(
+                    INTROSPECTION_COLLECTION_TYPE,
+                )
+            collection = collection_type.newobject()
+            collection.extend(value)
+            bound[name] = collection
+    return bound
 # **************************Introspection Entry Point**************************
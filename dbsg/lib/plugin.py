@@ -1,13 +1,33 @@
 """Plugin utilities."""
 from __future__ import annotations
 from abc import ABCMeta, abstractmethod
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
 from logging import getLogger
 from importlib import import_module
-from typing import Iterator, MutableMapping
+from multiprocessing import get_all_start_methods, get_context
+from threading import active_count
+from time import perf_counter
+from typing import (
+    Any,
+    Callable,
+    Iterable,
+    Iterator,
+    List,
+    MutableMapping,
+    Optional,
+    Sequence,
+)
 
 from dbsg.lib.configuration import Configuration
-from dbsg.lib.introspection import Introspection
-from dbsg.lib.intermediate_representation import IR
+from dbsg.lib.introspection import Introspection, RowStream
+from dbsg.lib.intermediate_representation import (
+    IR,
+    Database,
+    Schema,
+    StreamedPackage,
+)
 
 LOG = getLogger(__name__)
 
@@ -43,7 +63,15 @@ class PluginMetaABC(ABCMeta):
 
 
 class PluginABC(metaclass=PluginMetaABC):
-    """Plugin Interface."""
+    """
+    Plugin Interface.
+
+    A STREAMING plugin consumes the IR Packages as they are built (see
+    Handler.stream), and finishes after the last one. The others are saved
+    after the whole IR is built.
+    """
+
+    STREAMING = False
 
     configuration: Configuration = NotImplemented
     introspection: Introspection = NotImplemented
@@ -53,14 +81,78 @@ class PluginABC(metaclass=PluginMetaABC):
     def save(self, **kwargs):
         """Implement Plugin's logic."""
 
+    def consume(self, streamed: StreamedPackage):
+        """Consume a complete IR Package (STREAMING plugins only)."""
+        raise NotImplementedError(f'{self.name()} is not streaming.')
+
+    def finish(self):
+        """Finish after the last consumed IR Package."""
+
     @classmethod
     @abstractmethod
     def name(cls):
         """Return verbose name."""
 
 
+@dataclass
+class PluginRun:
+    """Wall time and error (if any) of a plugin's save."""
+
+    name: str
+    elapsed: float
+    error: Optional[BaseException] = field(default=None)
+
+    def __str__(self):
+        """Make a report line."""
+        if self.error is None:
+            return f'{self.name} has been saved in {self.elapsed:.3f}s.'
+        return (
+            f'{self.name} has failed in {self.elapsed:.3f}s: {self.error!r}'
+        )
+
+
+def run(
+    name: str,
+    target: Callable[[], Any],
+    started: Optional[float] = None,
+) -> PluginRun:
+    """Run the plugin's target, measuring its wall time and its error."""
+    started = perf_counter() if started is None else started
+    try:
+        target()
+    except Exception as error:  # noqa: B902
+        return PluginRun(name, perf_counter() - started, error)
+    return PluginRun(name, perf_counter() - started)
+
+
+def report(runs: Iterable[PluginRun]):
+    """Log the plugin runs, the failed ones as errors."""
+    for plugin_run in runs:
+        if plugin_run.error is None:
+            LOG.info(plugin_run)
+        else:
+            LOG.error(plugin_run)
+
+
+def save_plugin(plugin: PluginABC) -> PluginRun:
+    """Save the plugin (see run)."""
+    return run(plugin.name(), plugin.save)
+
+
+def _save_forked(index: int) -> PluginRun:
+    return save_plugin(Handler.forked[index])
+
+
 class Handler:
-    """Default Plugin Handler."""
+    """
+    Default Plugin Handler.
+
+    The plugins only read the introspection and the IR, so they may be saved
+    concurrently (see save).
+    """
+
+    # The plugins of the forked workers; they are inherited, not pickled
+    forked: Sequence[PluginABC] = ()
 
     def __init__(
         self,
@@ -75,10 +167,12 @@ class Handler:
         self.configuration = configuration
         self.introspection = introspection
         self.ir = ir
+        # The runs of the last save
+        self.runs: List[PluginRun] = []
 
     def __iter__(self) -> Iterator[PluginABC]:
         """
-        Iterate over all the registered plugins.
+        Iterate over all the registered plugins, with their plugin_options.
 
         Log all the unregistered ones.
         """
@@ -91,10 +185,152 @@ class Handler:
                 )
                 continue
 
+            # The options are copied, since the plugins may pop them
+            options = self.configuration.plugin_options.get(name) or {}
             plugin: PluginABC = REGISTRY[name](
                 self.configuration,
                 self.introspection,
                 self.ir,
+                **dict(options),
             )
 
             yield plugin
+
+    def stream(self, packages: Iterable[StreamedPackage]) -> IR:
+        """
+        Feed the streamed IR Packages to the plugins as they arrive.
+
+        The STREAMING plugins consume every Package at once; the IR is
+        assembled meanwhile, and the other plugins are saved with it at the
+        end. So the code generation overlaps the introspection. The other
+        plugins may iterate the rows too, so the streamed rows are buffered
+        for them instead of being fetched again.
+
+        A STREAMING plugin that fails isn't fed (nor finished) anymore, and
+        the others are fed anyway; all the runs are collected, as in save.
+        """
+        started = perf_counter()
+        self.ir = []
+        plugins = list(self)
+        failures: MutableMapping[PluginABC, PluginRun] = {}
+        streaming = [plugin for plugin in plugins if plugin.STREAMING]
+        rest = [plugin for plugin in plugins if not plugin.STREAMING]
+        if rest:
+            for introspected in self.introspection:
+                for schema in introspected.schemes:
+                    if isinstance(schema.rows, RowStream):
+                        schema.rows.buffer()
+
+        for streamed in packages:
+            if not self.ir or self.ir[-1].name != streamed.database:
+                self.ir.append(Database(name=streamed.database))
+            database = self.ir[-1]
+            if not database.schemes or (
+                database.schemes[-1].name != streamed.schema
+            ):
+                database.schemes.append(Schema(name=streamed.schema))
+            if streamed.package is not None:
+                database.schemes[-1].packages.append(streamed.package)
+
+            for plugin in streaming:
+                if plugin in failures:
+                    continue
+                consumed = run(
+                    plugin.name(),
+                    partial(plugin.consume, streamed),
+                    started,
+                )
+                if consumed.error is not None:
+                    failures[plugin] = consumed
+
+        runs = {
+            plugin: failures.get(plugin) or run(
+                plugin.name(),
+                plugin.finish,
+                started,
+            )
+            for plugin in streaming
+        }
+        report(runs.values())
+        runs.update(zip(rest, self.save(rest)))
+        self.runs = [runs[plugin] for plugin in plugins]
+
+        return self.ir
+
+    def save(
+        self,
+        plugins: Optional[Sequence[PluginABC]] = None,
+    ) -> List[PluginRun]:
+        """
+        Save the plugins (all by default), collecting their runs.
+
+        With plugin_workers > 1, the plugins are saved concurrently: in
+        threads, or in forked processes (plugin_fork), which inherit the
+        introspection and the IR copy-on-write instead of pickling them. The
+        streamed rows are fetched with the sessions of this process, so they
+        are never forked, nor is a multithreaded process (the threads are
+        used instead). Every failed plugin is logged, and the others are
+        saved anyway.
+        """
+        plugins = list(self) if plugins is None else list(plugins)
+        workers = min(self.configuration.plugin_workers, len(plugins))
+        if workers <= 1:
+            self.runs = [save_plugin(plugin) for plugin in plugins]
+        elif self.configuration.plugin_fork and self.forkable():
+            self.runs = self.fork(plugins, workers)
+        else:
+            with ThreadPoolExecutor(
+                max_workers=workers,
+                thread_name_prefix='dbsg-plugin',
+            ) as executor:
+                self.runs = list(executor.map(save_plugin, plugins))
+
+        report(self.runs)
+        return self.runs
+
+    @property
+    def failed(self) -> bool:
+        """Check the runs of the last save for errors."""
+        return any(r.error is not None for r in self.runs)
+
+    def forkable(self) -> bool:
+        """
+        Check that the processes may be forked, with no streamed rows.
+
+        Forking a multithreaded process may deadlock on the locks of the
+        other threads, so it's forked only if it has none.
+        """
+        return (
+            'fork' in get_all_start_methods()
+            and active_count() == 1
+            and all(
+                isinstance(schema.rows, list)
+                for db in self.introspection
+                for schema in db.schemes
+            )
+        )
+
+    @staticmethod
+    def fork(plugins: Sequence[PluginABC], workers: int) -> List[PluginRun]:
+        """Save the plugins in the forked processes."""
+        Handler.forked = tuple(plugins)
+        started = perf_counter()
+        runs = []
+        try:
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=get_context('fork'),
+            ) as executor:
+                futures = [
+                    executor.submit(_save_forked, index)
+                    for index in range(len(plugins))
+                ]
+                for plugin, future in zip(plugins, futures):
+                    # E.g. the plugin's error can't be pickled
+                    collected = run(plugin.name(), future.result, started)
+                    if collected.error is None:
+                        collected = future.result()
+                    runs.append(collected)
+        finally:
+            Handler.forked = ()
+        return runs
@@ -0,0 +1,82 @@
+"""Bounded, cost-aware scheduling utilities."""
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from logging import getLogger
+from typing import Any, Callable, MutableMapping, MutableSequence, Sequence
+
+LOG = getLogger(__name__)
+
+
+@dataclass
+class Unit:
+    """A unit of work with its cost estimate."""
+
+    target: Callable
+    args: Sequence = field(default_factory=tuple)
+    cost: int = field(default=0)
+
+
+@dataclass
+class Group:
+    """Units of work that share a concurrency limit (e.g. a session pool)."""
+
+    limit: int
+    units: MutableSequence[Unit] = field(default_factory=list)
+
+
+class Scheduler:
+    """
+    Run units of work in bounded thread pools, the most expensive first.
+
+    Every group (e.g. a DB) has its own concurrency limit (e.g. the max of
+    its session pool), so the groups don't starve each other. The most
+    expensive units are started first, so the total wall-clock time tends to
+    the most expensive unit, rather than to the sum of the queued ones.
+    """
+
+    def __init__(self):
+        """Initialize an empty Scheduler."""
+        self.groups: MutableMapping[str, Group] = {}
+        self.units: MutableSequence[Unit] = []
+
+    def add(self, group: str, limit: int, unit: Unit) -> Unit:
+        """Add a unit of work into the group (the first limit wins)."""
+        self.groups.setdefault(group, Group(limit=max(limit, 1)))
+        self.groups[group].units.append(unit)
+        self.units.append(unit)
+        return unit
+
+    def run(self) -> MutableSequence[Any]:
+        """
+        Run all the units and block until they are done.
+
+        The results are ordered as the units were added. If any unit fails,
+        all the errors are logged and the first one is raised.
+        """
+        futures: MutableMapping[int, Future] = {}
+        executors = []
+        for name, group in self.groups.items():
+            executor = ThreadPoolExecutor(
+                max_workers=group.limit,
+                thread_name_prefix=f'dbsg-{name}',
+            )
+            executors.append(executor)
+            # The sorting is stable: equal units keep the order of addition
+            for unit in sorted(group.units, key=lambda u: -u.cost):
+                futures[id(unit)] = executor.submit(unit.target, *unit.args)
+
+        # Block and Join
+        for executor in executors:  # noqa: WPS440
+            executor.shutdown(wait=True)
+
+        errors = [
+            failure
+            for failure in (f.exception() for f in futures.values())
+            if failure is not None
+        ]
+        for error in errors:
+            LOG.error(f'A unit of work has failed: {error!r}')
+        if errors:
+            raise errors[0]
+
+        return [futures[id(unit)].result() for unit in self.units]
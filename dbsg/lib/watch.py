@@ -0,0 +1,226 @@
+"""
+Watch mode: keep the pools open and regenerate on DDL changes.
+
+"dbsg watch" polls a cheap fingerprint (the max of all_objects.last_ddl_time
+and the object count) of every DB Schema, each --interval seconds. Only the
+changed Schemas are introspected again; and, since the introspection is
+incremental (see Snapshot), only their changed objects are fetched. Only
+their IR Schemes are built again too; the other Schemas (introspected and
+built) are reused from the previous iteration.
+
+The plugins are still run over the whole IR, as the outputs (and their
+orphans) are of the whole DBs: e.g. the python3.7 plugin rewrites only the
+changed modules (see its manifest), but the JSON one rewrites the whole
+shards of the default "database" shard.
+"""
+from dataclasses import replace
+from logging import getLogger
+from threading import Event
+from typing import (
+    Iterable,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Set,
+    Tuple,
+)
+
+from cx_Oracle import Connection  # pylint: disable=E0611
+
+from dbsg.lib.configuration import Configuration
+from dbsg.lib.diff import track
+from dbsg.lib.intermediate_representation import (
+    IR,
+    Abstract,
+    Database,
+    Schema,
+)
+from dbsg.lib.introspection import (
+    Inspect,
+    Introspection,
+    IntrospectionDatabase,
+    IntrospectionSchema,
+    bind,
+)
+from dbsg.lib.plugin import Handler
+
+LOG = getLogger(__name__)
+
+# (DB name, Schema name)
+WatchKey = Tuple[str, str]
+
+# noinspection SqlNoDataSourceInspection,SqlResolve
+WATCH_SQL = """
+select
+    ao.owner owner,
+    max(ao.last_ddl_time) last_ddl_time,
+    count(*) objects
+from
+    sys.all_objects ao
+where
+    ao.owner in (select column_value from table(:schemes))
+    and ao.object_type in ('PACKAGE', 'FUNCTION', 'PROCEDURE')
+group by
+    ao.owner
+""".strip()
+
+
+class Watch:
+    """
+    Watch the DBs and regenerate the stubs on changes.
+
+    Override SQL to poll something else (e.g. a DDL change table); it should
+    select (owner, fingerprint...) rows for :schemes binds.
+    """
+
+    SQL = WATCH_SQL
+
+    def __init__(
+        self,
+        configuration: Configuration,
+        interval: Optional[float] = None,
+    ):
+        """Initialize the Watch; nothing is polled until run."""
+        if configuration.streaming:
+            LOG.warning('The streaming introspection is off in watch mode.')
+            configuration.streaming = False
+        self.conf = configuration
+        self.interval = interval or configuration.watch_interval
+        self.fingerprints: MutableMapping[WatchKey, Optional[tuple]] = {}
+        self.schemes: MutableMapping[WatchKey, IntrospectionSchema] = {}
+        # The IR Schemes, by the lowercased (IR) names
+        self.ir: MutableMapping[WatchKey, MutableSequence[Schema]] = {}
+        self.stop = Event()
+
+    def run(self, iterations: Optional[int] = None):
+        """Poll and regenerate until stopped (or for some iterations)."""
+        LOG.info(f'Watching the DBs every {self.interval} seconds.')
+        iteration = 0
+        try:
+            while not self.stop.is_set():
+                self.iterate()
+                iteration += 1
+                if iterations is not None and iteration >= iterations:
+                    break
+                self.stop.wait(self.interval)
+        finally:
+            self.conf.disconnect()
+
+    def iterate(self) -> Set[WatchKey]:
+        """Poll and regenerate once; the failures are retried next time."""
+        changed: Set[WatchKey] = set()
+        try:
+            changed = self.poll()
+            if changed:
+                LOG.info(f'Changed Schemes: {sorted(changed)}.')
+                self.generate(changed)
+        except Exception:  # noqa: B902
+            LOG.exception('The watch iteration has failed.')
+            for key in changed:
+                self.fingerprints.pop(key, None)
+        return changed
+
+    def poll(self) -> Set[WatchKey]:
+        """Find the Schemes with changed fingerprints."""
+        session_pools = self.conf.connect()
+        changed = set()
+        for db in self.conf.databases:
+            session_pool = session_pools[db.name]
+            connection: Connection = session_pool.acquire()
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(self.SQL, bind(connection, {
+                        'schemes': [s.name for s in db.schemes],
+                    }))
+                    current = {
+                        owner: tuple(str(f) for f in fingerprint)
+                        for owner, *fingerprint in cursor.fetchall()
+                    }
+            finally:
+                session_pool.release(connection)
+
+            for schema in db.schemes:
+                key = db.name, schema.name
+                fingerprint = current.get(schema.name)
+                if key not in self.fingerprints:
+                    changed.add(key)
+                elif self.fingerprints[key] != fingerprint:
+                    changed.add(key)
+                self.fingerprints[key] = fingerprint
+        return changed
+
+    def generate(self, changed: Iterable[WatchKey]):
+        """Introspect and build the changed Schemes, and run the plugins."""
+        changed = set(changed)
+        introspection = self.introspection(changed)
+        ir = self.intermediate_representation(introspection, changed)
+        Handler(self.conf, introspection, ir).save()
+        track(self.conf, ir)
+
+    def intermediate_representation(
+        self,
+        introspection: Introspection,
+        changed: Set[WatchKey],
+    ) -> IR:
+        """
+        Build the IR of the changed Schemes; reuse the others.
+
+        If the types are shared, they are shared among the Schemes built
+        together only.
+        """
+        narrowed = [
+            IntrospectionDatabase(
+                name=db.name,
+                schemes=[
+                    s for s in db.schemes if (db.name, s.name) in changed
+                ],
+            )
+            for db in introspection
+        ]
+        built = Abstract(
+            narrowed,
+            self.conf.ir_workers,
+            self.conf.share_types,
+        ).intermediate_representation()
+        for db, database in zip(narrowed, built):
+            for introspected in db.schemes:
+                self.ir[db.name, introspected.name.lower()] = []
+            for schema in database.schemes:
+                self.ir.setdefault((db.name, schema.name), []).append(schema)
+
+        return [
+            Database(
+                name=db.name,
+                schemes=[
+                    schema
+                    for s in db.schemes
+                    for schema in self.ir.get((db.name, s.name.lower()), [])
+                ],
+            )
+            for db in self.conf.databases
+        ]
+
+    def introspection(self, changed: Set[WatchKey]) -> Introspection:
+        """Introspect the changed Schemes; reuse the others."""
+        databases = []
+        for db in self.conf.databases:
+            schemes = [s for s in db.schemes if (db.name, s.name) in changed]
+            if not schemes:
+                continue
+            narrowed = replace(db, schemes=schemes)
+            # Share the open pool
+            narrowed.session_pool = db.session_pool
+            databases.append(narrowed)
+
+        fresh = Inspect(replace(self.conf, databases=databases))
+        for introspected in fresh.introspection():
+            for schema in introspected.schemes:
+                self.schemes[introspected.name, schema.name] = schema
+
+        return [
+            IntrospectionDatabase(
+                name=db.name,
+                schemes=[self.schemes[db.name, s.name] for s in db.schemes],
+            )
+            for db in self.conf.databases
+        ]
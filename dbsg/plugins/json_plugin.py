@@ -1,41 +1,380 @@
-"""JSON plugin module."""
-from dataclasses import asdict
-from json import dumps
+"""
+JSON plugin module.
 
+The IR is encoded as dataclasses.asdict would make it, but lazily: the IR
+nodes are wrapped (see JSONObject and JSONArray), and the chunks of the
+encoder are written as soon as they are made, so the IR isn't copied.
+
+The output may be sharded with the "shard" option (see plugin_options):
+
+- database: <db>/<db>.json (the default)
+- schema: <db>/<schema>.json
+- package: <db>/<schema>/<package>.json; in the streaming mode, the packages
+  are written as soon as they are built
+- records: <db>/<db>.jsonl, a compact record (line) per package, and
+  <db>/<db>.index.json, which maps the FQDNs of the packages and their
+  routines to the (offset, length) of the records; the packages are written
+  as soon as they are built too
+
+The sharded output (any shard but "database") has <db>/manifest.json, which
+lists the shards; the shards of the previous run which aren't written
+anymore (e.g. of a dropped schema or package) are deleted. The records are
+read with JSONRecords, which decodes only the requested ones:
+
+.. code-block:: python
+
+    with JSONRecords(Path('stubs/db_name/db_name.jsonl')) as records:
+        records.routines('BILLS.BILL_UTILS_PKG.PAYROLL')
+"""
+from contextlib import suppress
+from dataclasses import fields, is_dataclass
+from json import JSONEncoder, dumps, loads
+from mmap import ACCESS_READ, mmap
+from pathlib import Path
+from typing import (
+    IO,
+    Any,
+    Iterator,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+from dbsg.lib.configuration import FQDN
+from dbsg.lib.intermediate_representation import Package, StreamedPackage
 from dbsg.lib.plugin import PluginABC
 
 REGISTRY_NAME = 'json'
 
+JSON_SHARDS = ('database', 'schema', 'package', 'records')
+# The shards which are written as soon as the packages are built
+JSON_STREAMING_SHARDS = ('package', 'records')
+JSON_MANIFEST = 'manifest.json'
+JSON_RECORDS_VERSION = 1
+
+
+# *********************************JSON Types**********************************
+def lazy(value: Any) -> Any:
+    """Wrap the dataclasses and the lists for the lazy encoding."""
+    if is_dataclass(value):
+        return JSONObject(value)
+    if isinstance(value, (list, tuple)):
+        return JSONArray(value)
+    if isinstance(value, dict) and not isinstance(value, JSONObject):
+        return {key: lazy(nested) for key, nested in value.items()}
+    return value
+
+
+class JSONObject(dict):  # noqa: WPS600
+    """
+    A lazy JSON object of a dataclass (e.g. an IR node).
+
+    It's a dict for the JSONEncoder, but its items are made while they are
+    encoded. The pure-Python encoder is used (see JSONEncoder.iterencode),
+    which relies on len() and items() only.
+    """
+
+    def __init__(self, node: Any):
+        """Wrap the node; nothing is copied."""
+        super().__init__()
+        self.node = node
+
+    def __len__(self):
+        """Count the fields."""
+        return len(fields(self.node))
+
+    def items(self) -> Iterator[Tuple[str, Any]]:  # type: ignore
+        """Make the items in the fields order."""
+        for attribute in fields(self.node):
+            yield attribute.name, lazy(getattr(self.node, attribute.name))
+
+
+class JSONArray(list):  # noqa: WPS600
+    """A lazy JSON array, see JSONObject."""
+
+    def __init__(self, values: Sequence):
+        """Wrap the values; nothing is copied."""
+        super().__init__()
+        self.values = values
+
+    def __len__(self):
+        """Count the values."""
+        return len(self.values)
+
+    def __iter__(self):
+        """Iterate over the wrapped values."""
+        return map(lazy, self.values)
+
+
+class JSONRecords:
+    """
+    Random access to the "records" output.
+
+    The records file is mapped into memory (mmap), and only the requested
+    records are decoded, so the lookups don't depend on the file size.
+    """
+
+    def __init__(self, path: Path):
+        """Load the index of the records (<db>.jsonl) file."""
+        with index_path(path).open('r', encoding='utf8') as fh:
+            index = loads(fh.read())
+        if index.get('version') != JSON_RECORDS_VERSION:
+            raise ValueError(f'The index of {path} has another version.')
+        self.index: MutableMapping[str, list] = index['records']
+        self.fh = path.open('rb')
+        self.mmap = mmap(self.fh.fileno(), 0, access=ACCESS_READ)
+
+    def __enter__(self) -> 'JSONRecords':
+        """Use the records as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Close the records."""
+        self.close()
+
+    def __contains__(self, fqdn: object) -> bool:
+        """Check the FQDN of a package or a routine."""
+        return str(fqdn).upper() in self.index
+
+    def record(self, fqdn: str) -> Optional[MutableMapping[str, Any]]:
+        """Decode the record ({schema, package}) of a package or routine."""
+        found = self.index.get(str(fqdn).upper())
+        if found is None:
+            return None
+        offset, length = found
+        return loads(self.mmap[offset:offset + length].decode('utf8'))
+
+    def routines(self, fqdn: str) -> MutableSequence[MutableMapping[str, Any]]:
+        """Decode the routines (all the overloads) by their FQDN."""
+        record = self.record(fqdn)
+        if record is None:
+            return []
+        return [
+            routine
+            for routine in record['package']['routines']
+            if str(FQDN(*routine['fqdn'].values())) == str(fqdn).upper()
+        ]
+
+    def close(self):
+        """Unmap and close the records file."""
+        self.mmap.close()
+        self.fh.close()
+
+
+def index_path(path: Path) -> Path:
+    """Make the path of the records' index."""
+    return path.with_suffix('.index.json')
+# *********************************JSON Types**********************************
+
 
 class Plugin(PluginABC):
     """JSON plugin."""
 
     def __init__(self, configuration, introspection, ir, **kwargs):
-        """Initialize JSON plugin."""
+        """Initialize JSON plugin; the options are resolved by configure."""
         self.configuration = configuration
         self.introspection = introspection
         self.ir = ir
-        self.kwargs = kwargs or {
-            'ensure_ascii': False,
-            'indent': 4,
-        }
+        self.configure(**kwargs)
+        # The shards of this run (by the DB names), see finish
+        self.manifests: MutableMapping[str, MutableSequence[dict]] = {}
+        # The open records files and their indexes, by the DB names
+        self.records: MutableMapping[str, IO[bytes]] = {}
+        self.indexes: MutableMapping[str, MutableMapping[str, list]] = {}
 
     @classmethod
     def name(cls):
         """Alias in REGISTRY."""
         return REGISTRY_NAME
 
+    def configure(self, **kwargs):
+        """
+        Resolve the options, the same for the save and the streaming.
+
+        The "shard" option is one of JSON_SHARDS; the others are passed to
+        the JSONEncoder.
+        """
+        shard = kwargs.pop('shard', 'database')
+        if shard not in JSON_SHARDS:
+            raise ValueError(
+                f'The "{shard}" JSON shard is unknown. '
+                + f'Use one of: {", ".join(JSON_SHARDS)}.',
+            )
+        self.shard = shard
+        self.kwargs = kwargs or {
+            'ensure_ascii': False,
+            'indent': 4,
+        }
+        self.STREAMING = self.shard in JSON_STREAMING_SHARDS
+
     def save(self, **kwargs):
-        """Save JSON representation into an appropriate file."""
-        kwargs = kwargs or self.kwargs
+        """
+        Save JSON representation into an appropriate file.
+
+        The options (if any) replace the plugin's ones, see configure.
+        """
+        if kwargs:
+            self.configure(**kwargs)
         path = self.configuration.path.absolute()
         path.mkdir(parents=True, exist_ok=True)
         for db in self.ir:
-            data = dumps({db.name: asdict(db)}, **kwargs)
             (path / db.name).mkdir(exist_ok=True)
-            file = path / db.name / f'{db.name}.json'
-            with file.open('w', encoding='utf8') as fh:
-                fh.write(str(data))
+            shards = self.manifests.setdefault(db.name, [])
+            if self.shard == 'database':
+                self.write(path / db.name / f'{db.name}.json', {
+                    db.name: db,
+                }, **self.kwargs)
+                shards.append({'path': f'{db.name}.json'})
+                continue
+
+            for schema in db.schemes:
+                if self.shard == 'schema':
+                    self.write(path / db.name / f'{schema.name}.json', {
+                        schema.name: schema,
+                    }, **self.kwargs)
+                    shards.append({
+                        'path': f'{schema.name}.json',
+                        'schema': schema.name,
+                    })
+                    continue
+
+                for package in schema.packages:
+                    self.consume(
+                        StreamedPackage(db.name, schema.name, package),
+                    )
+        self.finish()
+
+    def consume(self, streamed: StreamedPackage):
+        """Save the Package's shard (or record)."""
+        shards = self.manifests.setdefault(streamed.database, [])
+        package = streamed.package
+        if package is None:
+            return
+        if self.shard == 'records':
+            self.append(streamed.database, streamed.schema, package)
+            return
+
+        schema_path = (
+            self.configuration.path.absolute()
+            / streamed.database
+            / streamed.schema
+        )
+        schema_path.mkdir(parents=True, exist_ok=True)
+        self.write(schema_path / f'{package.name}.json', {
+            package.name: package,
+        }, **self.kwargs)
+        shards.append({
+            'path': f'{streamed.schema}/{package.name}.json',
+            'schema': streamed.schema,
+            'package': package.name,
+        })
+
+    def append(self, database: str, schema: str, package: Package):
+        """Append the Package's record, and index it."""
+        if database not in self.records:
+            path = self.configuration.path.absolute() / database
+            path.mkdir(parents=True, exist_ok=True)
+            self.records[database] = (path / f'{database}.jsonl').open('wb')
+            self.indexes[database] = {}
+
+        # A record is a line: the compact JSON has no new lines
+        encoder = JSONEncoder(**{
+            **self.kwargs,
+            'indent': None,
+            'separators': (',', ':'),
+        })
+        line = ''.join(encoder.iterencode(lazy({
+            'schema': schema,
+            'package': package,
+        }))).encode('utf8')
+
+        fh = self.records[database]
+        location = [fh.tell(), len(line)]
+        fh.write(line + b'\n')
+        for fqdn in record_keys(schema, package):
+            self.indexes[database][fqdn] = location
+
+    def finish(self):
+        """Save the indexes and the manifests, deleting the stale shards."""
+        path = self.configuration.path.absolute()
+        for database, fh in self.records.items():
+            fh.close()
+            index = {
+                'version': JSON_RECORDS_VERSION,
+                'records': self.indexes[database],
+            }
+            records_path = path / database / f'{database}.jsonl'
+            index_path(records_path).write_text(
+                dumps(index, separators=(',', ':')),
+                encoding='utf8',
+            )
+            self.manifests[database].extend([
+                {'path': records_path.name},
+                {'path': index_path(records_path).name},
+            ])
+        self.records.clear()
+        self.indexes.clear()
+
+        # The shards of the dropped DBs are stale, as their manifests are
+        for previous in path.glob(f'*/{JSON_MANIFEST}'):
+            if previous.parent.name not in self.manifests:
+                delete_stale(previous, set())
+
+        for database, shards in self.manifests.items():
+            manifest_path = path / database / JSON_MANIFEST
+            delete_stale(manifest_path, {shard['path'] for shard in shards})
+            if self.shard == 'database':
+                continue
+            manifest = {
+                'database': database,
+                'shard': self.shard,
+                'shards': shards,
+            }
+            with manifest_path.open('w', encoding='utf8') as fh:
+                fh.write(dumps(manifest, **self.kwargs))
+        self.manifests.clear()
+
+    @staticmethod
+    def write(file: Path, data: Any, **kwargs):
+        """Encode the data lazily, writing it by chunks."""
+        encoder = JSONEncoder(**kwargs)
+        with file.open('w', encoding='utf8') as fh:
+            for chunk in encoder.iterencode(lazy(data)):
+                fh.write(chunk)
+
+
+def delete_stale(manifest_path: Path, written: Set[str]):
+    """Delete the previous manifest and its shards that aren't written."""
+    try:
+        previous = loads(manifest_path.read_text(encoding='utf8'))
+    except (OSError, ValueError):
+        return
+    manifest_path.unlink()
+
+    directory = manifest_path.parent
+    for shard in previous.get('shards', []):
+        if shard['path'] in written:
+            continue
+        stale = directory / shard['path']
+        with suppress(FileNotFoundError):
+            stale.unlink()
+        # The Schema's directory (of the package shards), if it's empty
+        if stale.parent != directory:
+            with suppress(OSError):
+                stale.parent.rmdir()
+    with suppress(OSError):
+        directory.rmdir()
+
+
+def record_keys(schema: str, package: Package) -> Iterator[str]:
+    """Make the index keys of a package record: its FQDN and the routines'."""
+    if package.is_package:
+        yield f'{schema}.{package.name}'.upper()
+    for routine in package.routines:
+        yield str(routine.fqdn)
 
 
 JSONPlugin = Plugin  # for direct imports
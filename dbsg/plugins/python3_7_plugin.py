@@ -1,15 +1,70 @@
-"""Python Representation Plugin."""
+"""
+Python Representation Plugin.
+
+The modules may be rendered in a process pool with the "workers" option
+(see plugin_options), by batches of "batch" packages; the python packages
+and generic.py are made up front, and the rendered modules are the same as
+the serial ones. The workers are forked where possible: they inherit the
+IR, so they get only the indexes of its packages, since pickling the
+packages costs more than rendering them. A multithreaded process (e.g. with
+the threaded plugin_workers, or the streamed rows) isn't forked, so the
+streamed packages (and all the packages, where fork isn't safe or isn't
+available) are pickled to the workers of another start method.
+
+Only the changed modules are written (to a temporary file, which replaces
+the module), so the unchanged ones keep their mtime and bytecode caches.
+The digests of the written modules are kept in the manifest (see
+manifest_path), so the old modules aren't read; and the modules of the
+packages that no longer exist are deleted.
+
+The "compile" option precompiles the changed modules (and the ones without
+bytecode) in the "workers" processes, so the importers don't compile them
+again (e.g. in a read-only image); "invalidation_mode" is one of
+"timestamp" (the default), "checked-hash" and "unchecked-hash" (see
+py_compile). The syntax errors are reported with the FQDNs of the routines
+that produced them, and fail the plugin.
+"""
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from contextlib import suppress
+from dataclasses import replace
+from functools import partial
+from hashlib import sha1
+from importlib.util import cache_from_source
+from json import dumps, load
 from keyword import iskeyword
 from logging import getLogger
+from multiprocessing import current_process, get_all_start_methods
+from multiprocessing import get_context
+from multiprocessing.context import BaseContext
+from os import getpid
+from pathlib import Path
+from py_compile import PycInvalidationMode, PyCompileError
+from py_compile import compile as compile_bytecode
 from re import compile as re_compile
-from typing import List, Match, MutableSequence, Set
+from threading import active_count
+from typing import (
+    Deque,
+    List,
+    Mapping,
+    Match,
+    MutableMapping,
+    MutableSequence,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
 
 from dbsg.lib.configuration import Configuration
 from dbsg.lib.intermediate_representation import (
+    IR,
     Argument,
     ComplexArgument,
     Routine,
     Package,
+    StreamedPackage,
 )
 from dbsg.lib.plugin import PluginABC
 
@@ -51,10 +106,28 @@ PY_SIMPLE_TYPES = {
 WS = '    '  # python indent (whitespaces)
 LF = '\n'  # line feed (new line)
 
+# The batches in flight per worker; the rest are rendered later
+PENDING_BATCHES = 2
+
+MANIFEST_VERSION = 1
+
+# The modules per compiling task
+COMPILE_CHUNK = 50
+# The routine's FQDN in the cursor.callfunc/callproc call (see PyMethod)
+CALL_NAME = re_compile(r'^\s+"([^"]+)",$')
+
+# The Package, or its (DB, Schema, Package) indexes in the worker's IR
+Task = Union[Package, Tuple[int, int, int]]
+
+# The configuration and the IR of the worker (see render_batch)
+_RENDERING: list = []  # noqa: WPS407
+
 
 class Plugin(PluginABC):
     """Python representation plugin."""
 
+    STREAMING = True
+
     GENERIC_MODULE_TEMPLATE = '''\
 """
 The package is auto-generated. Don't edit it by hand -- changes won't persist.
@@ -80,11 +153,49 @@ class TBD:
 '''
 
     def __init__(self, configuration, introspection, ir, **kwargs):
-        """Initialize Python representation plugin."""
+        """
+        Initialize Python representation plugin.
+
+        The "workers" (processes rendering and compiling the modules; 1
+        means "in this process"), "batch" (packages per task), "compile"
+        and "invalidation_mode" options are popped.
+        """
         self.configuration = configuration
         self.introspection = introspection
         self.ir = ir
+        self.workers = kwargs.pop('workers', 1)
+        self.batch = kwargs.pop('batch', 50)
+        self.compile = kwargs.pop('compile', False)
+        mode = kwargs.pop('invalidation_mode', 'timestamp')
+        try:
+            self.invalidation_mode = PycInvalidationMode[
+                mode.upper().replace('-', '_')
+            ]
+        except KeyError as error:
+            raise ValueError(
+                f'The "{mode}" invalidation mode is unknown.',
+            ) from error
         self.kwargs = kwargs
+        # The prepared python packages (the top-level one is the path)
+        self.prepared: Set[Path] = set()
+        # The daemonic processes (e.g. the forked plugins of Python < 3.9)
+        # can't have children, so they render the modules themselves
+        self.parallel = self.workers > 1 and not current_process().daemon
+        # Only the forked workers inherit the IR (see save)
+        self.forked = 'fork' in get_all_start_methods()
+        self.inherited = False
+        self.executor: Optional[ProcessPoolExecutor] = None
+        # The batch being collected, and the submitted ones
+        self.batched: List[Tuple[Path, Task]] = []
+        self.pending: Deque[Tuple[List[Path], Future]] = deque()
+        # The digests of the previous and this run's modules (by the paths
+        # relative to the top-level package), and the written modules
+        self.previous: MutableMapping[str, str] = {}
+        self.digests: MutableMapping[str, str] = {}
+        # Whether the previous digests are invalidated on the disk (see write)
+        self.invalidated = False
+        self.changed: List[Path] = []
+        self.compiled: List[Path] = []
 
     @classmethod
     def name(cls):
@@ -93,35 +204,351 @@ class TBD:
 
     def save(self, **kwargs):
         """Save Python representation into the corresponding modules."""
+        # Forking a multithreaded process may deadlock on the locks of the
+        # other threads (e.g. logging), so it's forked only if it has none
+        self.inherited = self.forked and active_count() == 1
+        self.prepare()
+        for db in self.ir:
+            for schema in db.schemes:
+                self.schema_path(db.name, schema.name)
+
+        for db_index, db in enumerate(self.ir):  # noqa: WPS440
+            for schema_index, schema in enumerate(db.schemes):  # noqa: WPS440
+                schema_path = self.schema_path(db.name, schema.name)
+                for index, package in enumerate(schema.packages):
+                    task: Task = package
+                    if self.inherited:
+                        task = (db_index, schema_index, index)
+                    self.render(
+                        schema_path / f'{package.name}.py',
+                        package,
+                        task,
+                    )
+        self.finish()
+
+    @property
+    def manifest_path(self) -> Path:
+        """Make the path of the digests of the written modules."""
+        return self.configuration.snapshot_path / f'{REGISTRY_NAME}.json'
+
+    def prepare(self):
+        """Make the top-level python package and its helpers."""
         path = self.configuration.path.absolute()
         path.mkdir(parents=True, exist_ok=True)
-        (path / '__init__.py').touch(exist_ok=True)
+        self.previous = self.load_manifest()
+        self.invalidated = False
+        self.digests = {}
+        self.changed = []
+        self.prepared = {path}
+        self.init(path)
 
         # Top-Level: stubs python package and its helpers
-        with (path / 'generic.py').open('w', encoding='utf8') as fd:
-            fd.write(self.GENERIC_MODULE_TEMPLATE)
-
-        for db in self.ir:
-            # DB-Level: db python package -- a placeholder for schema packages
-            (path / db.name).mkdir(exist_ok=True)
-            (path / db.name / '__init__.py').touch(exist_ok=True)
+        self.write(path / 'generic.py', self.GENERIC_MODULE_TEMPLATE)
 
-            for schema in db.schemes:
-                # Schema-Level: schema python package of db package modules
-                schema_path = path / db.name / schema.name
-                schema_path.mkdir(exist_ok=True)
-                (schema_path / '__init__.py').touch(exist_ok=True)
+    def schema_path(self, database: str, schema: str) -> Path:
+        """Make the DB and Schema python packages, if they aren't made."""
+        path = self.configuration.path.absolute()
+        if path not in self.prepared:
+            self.prepare()
+
+        # DB-Level: db python package -- a placeholder for schema packages
+        # Schema-Level: schema python package of db package modules
+        schema_path = path / database / schema
+        if schema_path not in self.prepared:
+            for package_path in (schema_path.parent, schema_path):
+                package_path.mkdir(exist_ok=True)
+                self.init(package_path)
+            self.prepared.add(schema_path)
+        return schema_path
+
+    def consume(self, streamed: StreamedPackage):
+        """Save (or batch) the Package's python module."""
+        schema_path = self.schema_path(streamed.database, streamed.schema)
+        if streamed.package is None:
+            return
+
+        # Package-Level: python module with its relevant content
+        module = schema_path / f'{streamed.package.name}.py'
+        self.render(module, streamed.package, streamed.package)
+
+    def render(self, module: Path, package: Package, task: Task):
+        """Render the python module, or batch its task for the workers."""
+        if not self.parallel:
+            self.write(module, render_module(self.configuration, package))
+            return
+
+        self.batched.append((module, task))
+        if len(self.batched) >= self.batch:
+            self.submit()
+
+    def finish(self):
+        """Save the rest of the batched modules, and delete the orphans."""
+        if self.batched:
+            self.submit()
+        while self.pending:
+            self.collect()
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+        # Nothing may be consumed (e.g. every package is dropped), but the
+        # orphans are deleted anyway, as save does
+        if not self.prepared:
+            self.prepare()
+
+        deleted = self.delete_orphans()
+        self.save_manifest()
+        LOG.info(
+            f'{len(self.changed)} python modules have been written, '
+            + f'{len(self.digests) - len(self.changed)} are unchanged, '
+            + f'{deleted} are deleted.',
+        )
 
-                for package in schema.packages:
-                    # Package-Level: python module with its relevant content
-                    python_module = PyModule(self.configuration, package)
+        errors = self.precompile() if self.compile else []
+        self.inherited = False
+        for error in errors:
+            LOG.error(error)
+        if errors:
+            raise ValueError(
+                f'{len(errors)} python modules have syntax errors.',
+            )
 
-                    for routine in package.routines:
-                        python_module.add_method(routine)
+    def submit(self):
+        """Render the batch in a worker; keep the pending batches bounded."""
+        if self.executor is None:
+            # Only the naming settings are needed, not the DBs
+            rendering = replace(self.configuration, databases=[])
+            # The forked workers inherit the IR instead of unpickling it;
+            # the others (spawn, forkserver) get the packages themselves
+            if self.inherited:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=get_context('fork'),
+                    initializer=_initialize,
+                    initargs=(rendering, self.ir),
+                )
+            else:
+                self.executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=unforked_context(),
+                    initializer=_initialize,
+                    initargs=(rendering, []),
+                )
 
-                    module = schema_path / f'{package.name}.py'
-                    with module.open('w', encoding='utf8') as fd:  # noqa: WPS440,E501
-                        fd.write(str(python_module))  # noqa: WPS441
+        modules = [module for module, _ in self.batched]
+        tasks = [task for _, task in self.batched]
+        self.batched = []
+        self.pending.append(
+            (modules, self.executor.submit(render_batch, tasks)),
+        )
+        while len(self.pending) > self.workers * PENDING_BATCHES:
+            self.collect()
+
+    def collect(self):
+        """Write the modules of the first pending batch."""
+        modules, future = self.pending.popleft()
+        for module, source in zip(modules, future.result()):
+            self.write(module, source)
+
+    def key(self, module: Path) -> str:
+        """Make the manifest key of the module."""
+        return module.relative_to(
+            self.configuration.path.absolute(),
+        ).as_posix()
+
+    def init(self, package_path: Path):
+        """Make the python package's __init__.py, if it's missing."""
+        module = package_path / '__init__.py'
+        # It may be edited by hand, so it's never rewritten
+        self.digests[self.key(module)] = ''
+        if not module.exists():
+            module.touch()
+            self.changed.append(module)
+
+    def write(self, module: Path, source: str):
+        """Write the python module, unless it's unchanged."""
+        data = source.encode('utf8')
+        digest = sha1(data).hexdigest()
+        key = self.key(module)
+        self.digests[key] = digest
+        if self.previous.get(key) == digest and module.is_file():
+            return
+        # If it fails before save_manifest, the next run mustn't trust the
+        # previous digests; the modules are kept for delete_orphans
+        if self.previous and not self.invalidated:
+            self.save_manifest({key: '' for key in self.previous})
+            self.invalidated = True
+        replace_file(module, data)
+        self.changed.append(module)
+
+    def delete_orphans(self) -> int:
+        """Delete the previous run's modules that aren't written anymore."""
+        path = self.configuration.path.absolute()
+        orphans = set(self.previous).difference(self.digests)
+        # The nested modules first, so their python packages become empty
+        for key in sorted(orphans, key=lambda k: -k.count('/')):
+            module = path / key
+            for orphan in (module, Path(cache_from_source(str(module)))):
+                with suppress(FileNotFoundError):
+                    orphan.unlink()
+            if module.name == '__init__.py':
+                # The python package is kept, if anything else is there
+                package_path = module.parent
+                for directory in (package_path / '__pycache__', package_path):
+                    with suppress(OSError):
+                        directory.rmdir()
+        return len(orphans)
+
+    def precompile(self) -> List[str]:
+        """Compile the changed modules and the ones without bytecode."""
+        path = self.configuration.path.absolute()
+        changed = set(self.changed)
+        self.compiled = [
+            path / key
+            for key in self.digests
+            if path / key in changed
+            or not Path(cache_from_source(str(path / key))).is_file()
+        ]
+        target = partial(
+            compile_module,
+            invalidation_mode=self.invalidation_mode,
+        )
+        modules = [str(module) for module in self.compiled]
+        if not self.parallel or len(modules) <= COMPILE_CHUNK:
+            found = list(map(target, modules))
+        else:
+            # Forked only if it's single-threaded, see save and submit
+            context: BaseContext
+            if self.inherited:
+                context = get_context('fork')
+            else:
+                context = unforked_context()
+            with ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=context,
+            ) as executor:
+                found = list(executor.map(
+                    target,
+                    modules,
+                    chunksize=COMPILE_CHUNK,
+                ))
+        LOG.info(f'{len(modules)} python modules have been compiled.')
+        return [error for error in found if error is not None]
+
+    def load_manifest(self) -> MutableMapping[str, str]:
+        """Load the previous run's digests, unless they're of another path."""
+        if not self.manifest_path.is_file():
+            return {}
+        try:
+            with self.manifest_path.open('r', encoding='utf8') as fh:
+                manifest = load(fh)
+        except ValueError:
+            LOG.warning(f'The manifest {self.manifest_path} is broken.')
+            return {}
+        if manifest.get('version') != MANIFEST_VERSION or (
+            manifest.get('path') != str(self.configuration.path.absolute())
+        ):
+            return {}
+        return manifest['modules']
+
+    def save_manifest(self, digests: Optional[Mapping[str, str]] = None):
+        """Persist the digests of this run's modules (or the given ones)."""
+        self.manifest_path.parent.mkdir(parents=True, exist_ok=True)
+        replace_file(self.manifest_path, dumps({
+            'version': MANIFEST_VERSION,
+            'path': str(self.configuration.path.absolute()),
+            'modules': self.digests if digests is None else digests,
+        }).encode('utf8'))
+
+
+def replace_file(path: Path, data: bytes):
+    """Write the file atomically: a temporary file replaces it."""
+    temporary = path.with_name(f'.{path.name}.{getpid()}.tmp')
+    try:
+        temporary.write_bytes(data)
+        temporary.replace(path)
+    finally:
+        with suppress(FileNotFoundError):
+            temporary.unlink()
+
+
+def render_module(configuration: Configuration, package: Package) -> str:
+    """Render the Package's python module."""
+    python_module = PyModule(configuration, package)
+    for routine in package.routines:
+        python_module.add_method(routine)
+    return str(python_module)
+
+
+def compile_module(
+    module: str,
+    invalidation_mode: PycInvalidationMode,
+) -> Optional[str]:
+    """Compile the module's bytecode; describe its syntax error, if any."""
+    try:
+        compile_bytecode(
+            module,
+            doraise=True,
+            invalidation_mode=invalidation_mode,
+        )
+    except PyCompileError as error:
+        lineno = getattr(error.exc_value, 'lineno', None) or 0
+        with open(module, 'r', encoding='utf8') as fd:
+            fqdn = routine_at(fd.read(), lineno) or 'the module'
+        return f'{fqdn} ({module}:{lineno}): {error.exc_value}'
+    return None
+
+
+def routine_at(source: str, lineno: int) -> Optional[str]:
+    """Find the FQDN of the routine whose method has the (1-based) line."""
+    lines = source.splitlines()
+    method = f'{WS}def '
+    start = next(
+        (
+            index
+            for index in range(min(lineno, len(lines)) - 1, -1, -1)
+            if lines[index].startswith(method)
+        ),
+        None,
+    )
+    if start is None:
+        return None
+    for line in lines[start + 1:]:
+        if line.startswith(method):
+            break
+        match = CALL_NAME.match(line)
+        if match:
+            return match.group(1)
+    return None
+
+
+def unforked_context() -> BaseContext:
+    """
+    Make the platform default multiprocessing context, unless it's fork.
+
+    The fork default (e.g. Linux) is replaced by forkserver: the workers are
+    forked from its single-threaded server, not from this process.
+    """
+    context = get_context()
+    forks = context.get_start_method() == 'fork'
+    if forks and 'forkserver' in get_all_start_methods():
+        return get_context('forkserver')
+    return context
+
+
+def _initialize(configuration: Configuration, ir: IR):
+    _RENDERING[:] = [configuration, ir]
+
+
+def render_batch(tasks: Sequence[Task]) -> List[str]:
+    """Render the tasks' python modules in a worker."""
+    configuration, ir = _RENDERING
+    sources = []
+    for task in tasks:
+        if not isinstance(task, Package):
+            db, schema, package = task
+            task = ir[db].schemes[schema].packages[package]
+        sources.append(render_module(configuration, task))
+    return sources
 
 
 Python37Plugin = Plugin
@@ -1,20 +1,117 @@
-"""RAW Introspection module."""
+"""
+RAW Introspection module.
+
+The rows are saved as a single JSON document (<db>/<db>_raw.json) by
+default, or as NDJSON with the "format": "ndjson" option (see
+plugin_options): every line is written as soon as its row is fetched, so the
+memory stays flat. The NDJSON lines are:
+
+- the header: {"format": ..., "version": ..., "database": ...,
+  "columns": [...]}, the columns of the rows
+- {"schema": name} before the rows of every Schema
+- the rows: the arrays of the column values
+
+The NDJSON may be compressed with the "compression" option: "gzip" (the
+<db>/<db>_raw.ndjson.gz file) or "zstd" (<db>/<db>_raw.ndjson.zst; the
+zstandard package is required). Use read_ndjson to load it incrementally.
+"""
 from dataclasses import astuple
-from json import dumps
+from gzip import GzipFile
+from io import TextIOWrapper
+from json import JSONEncoder, dumps, loads
+from pathlib import Path
+from types import ModuleType
+from typing import IO, Iterator, Mapping, Optional, TextIO, Tuple
 
+from dbsg.lib.introspection import IntrospectionRow
 from dbsg.lib.plugin import PluginABC
 
+zstandard: Optional[ModuleType]
+try:
+    import zstandard  # noqa: WPS433
+except ImportError:  # pragma: no cover
+    zstandard = None  # noqa: WPS440
+
 REGISTRY_NAME = 'raw-introspection'
 
+RAW_FORMATS = ('json', 'ndjson')
+RAW_NDJSON_FORMAT = 'dbsg-raw-introspection'
+RAW_NDJSON_VERSION = 1
+RAW_COMPRESSIONS: Mapping[Optional[str], str] = {
+    None: '',
+    'gzip': '.gz',
+    'zstd': '.zst',
+}
+
+
+# *********************************NDJSON I/O**********************************
+def open_ndjson(path: Path, mode: str, compression: Optional[str]) -> TextIO:
+    """Open an NDJSON file as text ("r" or "w"), compressed or not."""
+    if compression is None:
+        return TextIOWrapper(path.open(f'{mode}b'), encoding='utf8')
+    if compression == 'gzip':
+        compressed = GzipFile(path, f'{mode}b', compresslevel=6)
+        return TextIOWrapper(compressed, encoding='utf8')
+    if zstandard is None:
+        raise RuntimeError('Install zstandard for the zstd compression.')
+    raw = path.open(f'{mode}b')
+    stream: IO[bytes]
+    if mode == 'w':
+        stream = zstandard.ZstdCompressor().stream_writer(raw)
+    else:
+        stream = zstandard.ZstdDecompressor().stream_reader(raw)
+    return TextIOWrapper(stream, encoding='utf8')
+
+
+def read_ndjson(path: Path) -> Iterator[Tuple[str, IntrospectionRow]]:
+    """Load the NDJSON rows one by one: (Schema name, IntrospectionRow)."""
+    compression = next(
+        (c for c, suffix in RAW_COMPRESSIONS.items() if suffix == path.suffix),
+        None,
+    )
+    with open_ndjson(path, 'r', compression) as fh:
+        header = loads(fh.readline() or '{}')
+        if header.get('format') != RAW_NDJSON_FORMAT:
+            raise ValueError(f'The {path} is not a raw introspection.')
+        if header.get('version') != RAW_NDJSON_VERSION:
+            raise ValueError(f'The {path} has another version.')
+        if header.get('columns') != list(IntrospectionRow.__slots__):
+            raise ValueError(f'The columns of {path} are different.')
+
+        schema = ''
+        for line in fh:
+            values = loads(line)
+            if isinstance(values, dict):
+                schema = values['schema']
+            else:
+                yield schema, IntrospectionRow.restore(values)
+# *********************************NDJSON I/O**********************************
+
 
 class Plugin(PluginABC):
     """RAW Introspection plugin."""
 
     def __init__(self, configuration, introspection, ir, **kwargs):
-        """Initialize RAW Introspection plugin."""
+        """
+        Initialize RAW Introspection plugin.
+
+        The "format" (see RAW_FORMATS) and "compression" (see
+        RAW_COMPRESSIONS) options are popped; the others are passed to the
+        JSON encoder.
+        """
         self.configuration = configuration
         self.introspection = introspection
         self.ir = ir
+        self.format = kwargs.pop('format', 'json')
+        self.compression = kwargs.pop('compression', None)
+        if self.format not in RAW_FORMATS:
+            raise ValueError(f'The "{self.format}" format is unknown.')
+        if self.compression not in RAW_COMPRESSIONS:
+            raise ValueError(
+                f'The "{self.compression}" compression is unknown.',
+            )
+        if self.compression is not None and self.format != 'ndjson':
+            raise ValueError('Only the NDJSON may be compressed.')
         self.kwargs = kwargs or {
             'ensure_ascii': False,
             'indent': 4,
@@ -31,15 +128,42 @@ class Plugin(PluginABC):
         path = self.configuration.path.absolute()
         path.mkdir(parents=True, exist_ok=True)
         for db in self.introspection:
-            json = {}
             name = db.name.lower()
+            (path / name).mkdir(exist_ok=True)
+            if self.format == 'ndjson':
+                self.save_ndjson(path / name / self.filename(name), db)
+                continue
+
+            json = {}
             for schema in db.schemes:
                 json[schema.name.lower()] = [astuple(r) for r in schema.rows]
             data = dumps(json, **kwargs)
-            (path / name).mkdir(exist_ok=True)
             file = path / name / f'{name}_raw.json'
             with file.open('w', encoding='utf8') as fh:
                 fh.write(data)
 
+    def filename(self, name: str) -> str:
+        """Make the NDJSON file name of the DB."""
+        return f'{name}_raw.ndjson{RAW_COMPRESSIONS[self.compression]}'
+
+    def save_ndjson(self, file: Path, db):
+        """Write the DB's rows line by line, as they are fetched."""
+        # A line per record, whatever the indent is
+        encoder = JSONEncoder(**{**self.kwargs, 'indent': None})
+        columns = IntrospectionRow.__slots__
+        with open_ndjson(file, 'w', self.compression) as fh:
+            fh.write(encoder.encode({
+                'format': RAW_NDJSON_FORMAT,
+                'version': RAW_NDJSON_VERSION,
+                'database': db.name.lower(),
+                'columns': list(columns),
+            }) + '\n')
+            for schema in db.schemes:
+                schema_name = schema.name.lower()
+                fh.write(encoder.encode({'schema': schema_name}) + '\n')
+                for row in schema.rows:
+                    values = [getattr(row, column) for column in columns]
+                    fh.write(encoder.encode(values) + '\n')
+
 
 RAWIntrospectionPlugin = Plugin  # for direct imports
@@ -1,3 +1,4 @@
+from collections import Counter
 from dataclasses import dataclass, field
 from itertools import chain
 from typing import Any, MutableMapping
@@ -6,8 +7,10 @@ from json import load
 from pytest import fixture
 
 from dbsg.lib import configuration
+from dbsg.lib.catalog import Catalog
 
 MAIN_FIXTURE = './tests/raw_introspection_fixture.json'
+LAST_DDL_TIME = '2020-04-01 00:00:00'
 
 
 class Cursor:
@@ -17,6 +20,8 @@ class Cursor:
         self.rowfactory = None
         self.fixture = data_fixture
         self.rows = None
+        self.arraysize = 100
+        self.offset = 0
 
     def __enter__(self):
         return self
@@ -24,11 +29,35 @@ class Cursor:
     def __exit__(self, exc_type, exc_val, exc_tb):
         return
 
-    def execute(self, statement, binds):
+    def execute(self, statement, binds=None):
         self.statement = statement
         self.binds = binds
 
+    def objects(self):
+        objects = {}
+        for row in self.fixture[self.binds['schema'].lower()]:
+            is_package = row[2]
+            name = row[1] if is_package else row[3]
+            object_type = 'PACKAGE' if is_package else row[4]
+            objects[name] = (name, object_type, LAST_DDL_TIME, row[5])
+        return list(objects.values())
+
+    def estimates(self):
+        estimates = Counter()
+        for row in self.fixture[self.binds['schema'].lower()]:
+            estimates[row[1] if row[2] else row[3]] += 1
+        return list(estimates.items())
+
     def fetchall(self):
+        if 'last_ddl_time' in self.statement:
+            return self.objects()
+
+        if 'count(*)' in self.statement:
+            return self.estimates()
+
+        if 'rownum = 1' in self.statement:
+            return [(None,)]
+
         if self.binds:
             rows = self.fixture[self.binds['schema'].lower()]
         else:
@@ -42,6 +71,26 @@ class Cursor:
 
         return rows
 
+    def fetchmany(self, size=None):
+        if self.rows is None:
+            self.fetchall()
+        size = size or self.arraysize
+        batch = self.rows[self.offset:self.offset + size]
+        self.offset += size
+        return batch
+
+
+class Collection(list):
+    pass
+
+
+class ObjectType:
+    def __init__(self, name):
+        self.name = name
+
+    def newobject(self):
+        return Collection()
+
 
 class Connection:
     def __init__(self, data_fixture, *args, **kwargs):
@@ -52,6 +101,9 @@ class Connection:
     def cursor(self):
         return Cursor(self.fixture)
 
+    def gettype(self, name):
+        return ObjectType(name)
+
 
 def session_pool_factory():
     @dataclass
@@ -81,10 +133,14 @@ def session_pool_factory():
             raise NotImplemented
 
         def release(self, *args, **kwargs):
-            raise NotImplemented
+            pass
+
+        def close(self):
+            self.closed = True
 
         def __init__(self, *args, **kwargs):
-            pass
+            self.kwargs = kwargs
+            self.closed = False
 
     with open(MAIN_FIXTURE, 'r', encoding='utf8') as fh:
         json = load(fh)
@@ -95,7 +151,7 @@ def session_pool_factory():
 
 
 @fixture(name='dbsg_config')
-def dbsg_config_fixture(monkeypatch):
+def dbsg_config_fixture(monkeypatch, tmp_path):
     import sys
     monkeypatch.setattr(
         sys,
@@ -105,11 +161,13 @@ def dbsg_config_fixture(monkeypatch):
     print(configuration.Setup)
     c = configuration.Setup()
     c.path = 'config_sample.yml'
-    return c.configuration()
+    conf = c.configuration()
+    conf.snapshot_path = tmp_path / '.dbsg'
+    return conf
 
 
 @fixture(name='dbsg_config_with_mocked_session')
-def dbsg_config_with_mocked_session_fixture(monkeypatch):
+def dbsg_config_with_mocked_session_fixture(monkeypatch, tmp_path):
     import sys
     monkeypatch.setattr(
         sys,
@@ -123,7 +181,25 @@ def dbsg_config_with_mocked_session_fixture(monkeypatch):
     )
     c = configuration.Setup()
     c.path = 'config_sample.yml'
-    return c.configuration()
+    conf = c.configuration()
+    conf.snapshot_path = tmp_path / '.dbsg'
+    return conf
+
+
+@fixture(name='dbsg_config_with_catalog')
+def dbsg_config_with_catalog_fixture(dbsg_config, raw_introspection, tmp_path):
+    # The raw fixture rows are loaded into the Schemes of the config
+    db = dbsg_config.databases[0]
+    db.catalog = tmp_path / 'catalog.sqlite'
+    catalog = Catalog(db.catalog)
+    for schema in db.schemes:
+        catalog.load([
+            [schema.name, *row[1:]] if row[2]
+            else [schema.name, schema.no_package_name, *row[2:]]
+            for row in raw_introspection[schema.name.lower()]
+        ])
+    catalog.close()
+    return dbsg_config
 
 
 @fixture(name='raw_introspection')
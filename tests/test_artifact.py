@@ -0,0 +1,80 @@
+import gzip
+import pickle
+
+from pytest import main, raises
+
+from dbsg import generator
+from dbsg.lib import artifact, configuration
+from dbsg.lib.intermediate_representation import Abstract
+
+
+def read(path):
+    return {p.relative_to(path): p.read_bytes() for p in path.rglob('*.*')}
+
+
+def test_phases(
+        dbsg_config_with_catalog: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_catalog
+    conf.path = tmp_path / 'stubs'
+    conf.artifact_path = tmp_path / 'artifacts'
+    conf.plugins = ['json', 'python3.7', 'raw-introspection']
+    conf.streaming = True
+
+    generator.introspect(conf)
+    generator.build_ir(conf)
+    assert conf.databases[0].session_pool is None
+    conf.databases = []  # No DB access anymore
+    generator.emit(conf)
+    emitted = read(conf.path)
+    assert emitted
+
+    inspected = artifact.load(
+        artifact.artifact(conf.artifact_path, 'introspection'),
+        'introspection',
+    )
+    assert all(isinstance(s.rows, list) for s in inspected[0].schemes)
+    ir = artifact.load(artifact.artifact(conf.artifact_path, 'ir'), 'ir')
+    assert ir == Abstract(inspected).intermediate_representation()
+    assert not ir[0].types  # The types aren't shared by default
+
+    # The same as the single process
+    for path in emitted:
+        (conf.path / path).unlink()
+    for plugin in generator.Handler(conf, inspected, ir):
+        plugin.save()
+    assert read(conf.path) == emitted
+
+
+def test_artifact(tmp_path):
+    path = tmp_path / 'ir.dbsg'
+    with raises(artifact.ArtifactError):
+        artifact.load(path, 'ir')
+
+    artifact.save(path, 'ir', [])
+    first = path.read_bytes()
+    artifact.save(path, 'ir', [])
+    assert path.read_bytes() == first
+    assert artifact.load(path, 'ir') == []
+    with raises(artifact.ArtifactError):
+        artifact.load(path, 'introspection')
+
+    with gzip.open(path, 'wb') as fh:
+        pickle.dump({'format': artifact.ARTIFACT_FORMAT, 'version': 0}, fh)
+    with raises(artifact.ArtifactError, match='version'):
+        artifact.load(path, 'ir')
+
+    path.write_bytes(gzip.compress(b'garbage'))
+    with raises(artifact.ArtifactError):
+        artifact.load(path, 'ir')
+
+    # The truncated payload
+    artifact.save(path, 'ir', list(range(1000)))
+    path.write_bytes(path.read_bytes()[:-20])
+    with raises(artifact.ArtifactError, match='broken'):
+        artifact.load(path, 'ir')
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
@@ -0,0 +1,61 @@
+from pytest import main
+
+from dbsg.lib import benchmark, introspection
+
+
+def test_synthetic_catalog():
+    synthetic = benchmark.SyntheticCatalog(
+        schemes=2,
+        packages=3,
+        routines=4,
+        overload_rate=0.5,
+        complex_rate=1,
+        depth=2,
+    )
+    rows = list(synthetic.rows(0))
+    assert rows == list(synthetic.rows(0))
+    assert synthetic.routine_count == 2 * (3 * 4 + 1)
+
+    normalized = introspection.IntrospectionRow.normalize(rows)
+    routines = {(r.schema, r.package, r.routine) for r in normalized}
+    assert len(routines) == synthetic.routine_count
+    assert any(r.overload == 2 for r in normalized)
+    # TABLE -> OBJECT -> OBJECT -> fields
+    assert max(r.data_level for r in normalized) == 3
+    assert {r.argument for r in normalized if r.position == 0} == {
+        '_dbsg_result',
+    }
+
+
+def test_benchmark(tmp_path):
+    synthetic = benchmark.SyntheticCatalog(packages=2, routines=3, depth=2)
+    bench = benchmark.Benchmark(
+        synthetic,
+        tmp_path,
+        plugins=['json', 'python3.7'],
+    )
+    bench.prepare()
+    stages = bench.run()
+    assert [s.name for s in stages] == [
+        'Setup.configuration',
+        'Inspect.introspection',
+        'Abstract.intermediate_representation',
+        'IR.footprint',
+        'IR.footprint (unslotted, uninterned)',
+        'json.save',
+        'python3.7.save',
+    ]
+    assert all(s.peak and s.throughput for s in stages)
+    assert all(s.retained is not None for s in stages)
+    assert (tmp_path / 'stubs' / 'db_0' / 'db_0.json').exists()
+    # The slotted and interned IR is smaller than the baseline's one
+    footprint, baseline_footprint = (s.retained for s in stages[3:5])
+    assert footprint < baseline_footprint
+
+    baseline = [{'name': s.name, 'elapsed': s.elapsed / 10} for s in stages]
+    assert len(benchmark.regressions(stages, baseline)) == len(stages)
+    assert not benchmark.regressions(stages, baseline, tolerance=100)
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
@@ -0,0 +1,86 @@
+from dataclasses import astuple
+
+from pytest import main
+
+from dbsg.lib import catalog, configuration, introspection
+
+
+def test_adapt():
+    sql = introspection.STRATEGIES['join'].filter(
+        introspection.INTROSPECTION_WITH_PACKAGE_FILTERS['excluded_routines'],
+    )
+    adapted = catalog.adapt(sql)
+    assert 'table(' not in adapted
+    assert 'json_each(:excluded_routines)' in adapted
+    assert catalog.adapt(introspection.DBA_PROBE_SQL).endswith('1 = 1')
+
+
+def test_catalog_introspection(
+        dbsg_config_with_catalog: configuration.Configuration,
+        raw_introspection,
+):
+    db = dbsg_config_with_catalog.databases[0]
+    inspect = introspection.Inspect(dbsg_config_with_catalog)
+    session_pool = db.connect()
+    assert isinstance(session_pool, catalog.CatalogSessionPool)
+
+    for schema in db.schemes:
+        rows = raw_introspection[schema.name.lower()]
+        expected = introspection.IntrospectionRow.normalize([
+            [schema.name, *row[1:]] if row[2]
+            else [schema.name, schema.no_package_name, *row[2:]]
+            for row in rows
+        ])
+        sql, binds = inspect.statement(schema)
+        fetched = inspect.fetch(
+            session_pool,
+            introspection.IntrospectionStatement(sql, binds),
+        )
+        assert sorted(map(astuple, fetched), key=repr) == sorted(
+            map(astuple, expected),
+            key=repr,
+        )
+
+    # The filters are applied for real
+    goodies = db.schemes[2]
+    goodies.exclude_routines = True
+    goodies.excluded_routines = ['GOODS_PKG.ADD_GOOD']
+    sql, binds = inspect.statement(goodies)
+    fetched = inspect.fetch(
+        session_pool,
+        introspection.IntrospectionStatement(sql, binds),
+    )
+    assert {r.routine for r in fetched} == {'list_goods'}
+
+    comparisons = inspect.compare_strategies()
+    assert all(c.equal and c.rows for c in comparisons)
+
+
+def test_catalog_sharded_introspection(
+        dbsg_config_with_catalog: configuration.Configuration,
+):
+    conf = dbsg_config_with_catalog
+    # A quoted mixed-case package is bound as is in the DB
+    db = conf.databases[0]
+    mixed = catalog.Catalog(db.catalog)
+    mixed.load([
+        (db.schemes[2].name, 'MixedPkg', 1, 'Proc', 'PROCEDURE', 300000,
+         None, 1, 'IN_X', 1, 1, 0, 'NUMBER', None, None, None, 'N', None,
+         'IN'),
+    ])
+    mixed.close()
+
+    conf.full = True
+    whole = introspection.Inspect(conf).introspection()
+    assert 'mixedpkg' in {r.package for r in whole[0].schemes[2].rows}
+
+    for schema in db.schemes:
+        schema.shard_size = 1
+    sharded = introspection.Inspect(conf).introspection()
+
+    for w, s in zip(whole[0].schemes, sharded[0].schemes):
+        assert [astuple(r) for r in w.rows] == [astuple(r) for r in s.rows]
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
@@ -22,6 +22,16 @@ def test_cli():
     assert 'python' in args.plugins
     assert 'two.txt' in args.abbreviation_files
     assert args.path == './path/to/the/stubs'
+    assert args.command is None
+
+    args = cli.parse_args(['watch', '--interval', '5', './stubs'])
+    assert args.command == 'watch'
+    assert args.watch_interval == 5
+    assert args.path == './stubs'
+
+    args = cli.parse_args(['build-ir', '--artifact-path', '/artifacts'])
+    assert args.command == 'build-ir'
+    assert args.artifact_path == '/artifacts'
 
 
 def test_abbreviations(dbsg_config: configuration.Configuration):
@@ -64,6 +74,26 @@ def test_pool(dbsg_config: configuration.Configuration):
     assert pool.encoding == 'UTF-8'
     assert pool._dsn.host == '127.0.0.1'
     assert pool._dsn.port == 1521
+    assert pool.increment == 1
+    assert pool.cx_getmode == configuration.SPOOL_ATTRVAL_WAIT
+    assert pool.timeout == 300
+    assert pool.stmtcachesize == 40
+
+
+def test_pool_getmode():
+    _, errors = configuration.PoolSchema().load({
+        'dsn': {'host': '127.0.0.1', 'port': 1521},
+        'getmode': 'sometimes',
+    })
+    assert 'getmode' in errors
+
+
+def test_database_strategy():
+    _, errors = configuration.DatabaseSchema().load({
+        'name': 'db_name',
+        'strategy': 'fastest',
+    })
+    assert 'strategy' in errors
 
 
 # noinspection SqlNoDataSourceInspection,SqlResolve
@@ -85,6 +115,28 @@ def test_database(dbsg_config_with_mocked_session: configuration.Configuration):
     assert cursor.binds == {'a': 1}
 
 
+def test_connection_lifecycle(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+):
+    conf = dbsg_config_with_mocked_session
+    db = conf.databases[0]
+    pools = conf.connect()
+    assert pools == {'DB_NAME': db.session_pool}
+    assert conf.connect()['DB_NAME'] is pools['DB_NAME']
+
+    pool = pools['DB_NAME']
+    assert pool.kwargs['increment'] == 1
+    assert pool.kwargs['getmode'] == configuration.SPOOL_ATTRVAL_WAIT
+    assert pool.timeout == 300
+    assert pool.stmtcachesize == 40
+
+    conf.disconnect()
+    assert pool.closed
+    assert db.session_pool is None
+    conf.disconnect()
+    assert db.connect() is not pool
+
+
 def test_configuration(dbsg_config: configuration.Configuration):
     assert dbsg_config.plugins[0] == 'json'
     assert dbsg_config.path.name == 'stubs'
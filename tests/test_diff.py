@@ -0,0 +1,48 @@
+from dataclasses import replace
+
+from pytest import main
+
+from dbsg.lib import configuration, diff, introspection
+from dbsg.lib.intermediate_representation import Abstract
+
+
+def test_diff(dbsg_config_with_mocked_session: configuration.Configuration):
+    conf = dbsg_config_with_mocked_session
+    inspected = introspection.Inspect(conf).introspection()
+    ir = Abstract(inspected).intermediate_representation()
+    tree = diff.Tree.of(ir)
+
+    # Stable
+    rebuilt = Abstract(inspected).intermediate_representation()
+    assert diff.Tree.of(rebuilt).digest == tree.digest
+    assert not diff.diff(tree, diff.Tree.of(rebuilt))
+
+    everything = diff.diff(None, tree)
+    assert 'db_name.bills.bill_utils_pkg' in everything.packages.added
+    assert 'db_name.bills.bill_utils_pkg.payroll' in everything.routines.added
+
+    schema = rebuilt[0].schemes[0]
+    routine = schema.packages[0].routines[0]
+    routine.arguments[0] = replace(routine.arguments[0], in_out='in/out')
+    removed = schema.packages.pop()
+    found = diff.diff(tree, diff.Tree.of(rebuilt))
+    assert found.packages.changed == ['db_name.bills.bill_utils_pkg']
+    assert found.routines.changed == ['db_name.bills.bill_utils_pkg.payroll']
+    assert found.packages.removed == [f'db_name.bills.{removed.name}']
+    assert not found.packages.added
+    assert str(found) == 'packages +0 -1 ~1, routines +0 -1 ~1'
+
+
+def test_track(dbsg_config_with_mocked_session: configuration.Configuration):
+    conf = dbsg_config_with_mocked_session
+    ir = Abstract(
+        introspection.Inspect(conf).introspection(),
+    ).intermediate_representation()
+
+    assert diff.track(conf, ir)
+    assert diff.Tree.load(conf.snapshot_path / 'ir.json') == diff.Tree.of(ir)
+    assert not diff.track(conf, ir)
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
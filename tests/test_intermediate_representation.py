@@ -1,6 +1,14 @@
-from pytest import main
+import sys
+from dataclasses import asdict, replace
 
-from dbsg.lib import configuration, introspection, intermediate_representation
+from pytest import main, raises
+
+from dbsg.lib import (
+    benchmark,
+    configuration,
+    introspection,
+    intermediate_representation,
+)
 
 
 def test_ir(dbsg_config_with_mocked_session: configuration.Configuration):
@@ -37,5 +45,243 @@ def test_database(dbsg_config_with_mocked_session: configuration.Configuration):
     assert arg.data_type == 'number'
 
 
+def test_build_schemes():
+    ir = intermediate_representation
+    synthetic = benchmark.SyntheticCatalog(
+        schemes=1,
+        packages=1,
+        routines=1,
+        standalone=1,
+        arguments=1,
+        depth=2,
+        complex_rate=1,
+    )
+    rows = introspection.IntrospectionRow.normalize(list(synthetic.rows(0)))
+
+    # The arguments by their sequences, nested by their data levels
+    def tree(argument):
+        if not getattr(argument, 'arguments', None):
+            return argument.sequence
+        return argument.sequence, [tree(a) for a in argument.arguments]
+
+    arguments = [(1, [(2, [3, 4, (5, [6, 7])])]), (8, [9, 10, (11, [12, 13])])]
+    built = ir.build_schemes(rows)
+    assert [
+        (schema.name, [
+            (package.name, package.is_package, [
+                (routine.name, [tree(a) for a in routine.arguments])
+                for routine in package.routines
+            ])
+            for package in schema.packages
+        ])
+        for schema in built
+    ] == [
+        ('schema_0', [
+            ('pkg_0', True, [('routine_0', arguments)]),
+            ('schema_0_no_pkg', False, [('standalone_0', arguments)]),
+        ]),
+    ]
+
+    orphan = rows[1]
+    orphan.data_level = 5
+    with raises(TypeError):
+        ir.build_schemes([rows[0], orphan])
+
+
+def test_shared_types():
+    ir = intermediate_representation
+    synthetic = benchmark.SyntheticCatalog(
+        schemes=2,
+        depth=2,
+        complex_rate=1,
+        routines=3,
+    )
+    rows = introspection.IntrospectionRow.normalize(list(synthetic.rows(0)))
+
+    types = {}
+    shared = ir.build_schemes(rows, types)
+    assert types
+    arguments = [
+        argument
+        for schema in shared
+        for package in schema.packages
+        for routine in package.routines
+        for argument in routine.arguments
+        if isinstance(argument, ir.ComplexArgument)
+    ]
+    keys = {a.type_key for a in arguments}
+    assert len({id(a.arguments) for a in arguments}) == len(keys) < len(
+        arguments,
+    )
+
+    # The same as the unshared ones, except the sequences of the nested
+    def structure(argument):
+        return (
+            argument.name,
+            argument.data_type,
+            argument.data_level,
+            [structure(a) for a in getattr(argument, 'arguments', [])],
+        )
+    unshared = ir.build_schemes(rows)
+    assert [
+        structure(argument)
+        for schema in unshared
+        for package in schema.packages
+        for routine in package.routines
+        for argument in routine.arguments
+        if isinstance(argument, ir.ComplexArgument)
+    ] == [structure(argument) for argument in arguments]
+
+    # The same registry of the Schemes which are built separately
+    separate = ir.build_schemes(rows)
+    registry = {}
+    ir.share_types(separate, registry)
+    assert registry.keys() == types.keys()
+
+    # The schema-level types have a TYPE_NAME, but no TYPE_SUBNAME
+    assert all(a.custom_type is None for a in arguments)
+    anonymous = replace(
+        arguments[0],
+        custom_type_schema=None,
+        custom_type_package=None,
+    )
+    assert anonymous.type_key is None
+
+
+def test_opt_in_shared_types():
+    ir = intermediate_representation
+    synthetic = benchmark.SyntheticCatalog(
+        schemes=2,
+        depth=2,
+        complex_rate=1,
+        routines=3,
+    )
+    rows = introspection.IntrospectionRow.normalize(list(synthetic.rows(0)))
+    inspected = [
+        introspection.IntrospectionDatabase(
+            name='db',
+            schemes=[introspection.IntrospectionSchema('s', 's_np', rows)],
+        ),
+    ]
+
+    # Every usage has its own nested arguments, with their own sequences
+    database = ir.Abstract(inspected).intermediate_representation()[0]
+    assert not database.types
+    assert [asdict(s) for s in database.schemes] == [
+        asdict(s) for s in ir.build_schemes(rows)
+    ]
+
+    shared = ir.Abstract(
+        inspected,
+        share_types=True,
+    ).intermediate_representation()[0]
+    assert shared.types
+    assert [asdict(s) for s in shared.schemes] == [
+        asdict(s) for s in ir.build_schemes(rows, {})
+    ]
+
+
+def test_parallel_ir(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+):
+    inspected = introspection.Inspect(
+        dbsg_config_with_mocked_session,
+    ).introspection()
+    serial = intermediate_representation.Abstract(inspected)
+    parallel = intermediate_representation.Abstract(inspected, workers=3)
+    assert [asdict(db) for db in parallel.intermediate_representation()] == [
+        asdict(db) for db in serial.intermediate_representation()
+    ]
+
+
+def test_indexes(dbsg_config_with_mocked_session: configuration.Configuration):
+    ir = intermediate_representation.Abstract(
+        introspection.Inspect(dbsg_config_with_mocked_session).introspection()
+    ).intermediate_representation()
+    db = ir[0]
+    routines = list(db.routines())
+    routine = routines[0]
+
+    assert db.find_routines('bills.bill_utils_pkg.payroll') == [routine]
+    assert db.find_routines(routine.fqdn) == [routine]
+    assert db.find_routines('bills.missing') == []
+    assert db.find_subprogram(
+        routine.object_id,
+        routine.subprogram_id,
+    ) is routine
+    assert db.find_subprogram(0, 0) is None
+
+    usages = [
+        (routine, argument)
+        for routine in routines
+        for argument in routine.arguments
+        if argument.custom_type_fqdn
+    ]
+    assert usages
+    custom_type = usages[0][1].custom_type_fqdn
+    found = db.find_usages(custom_type.upper())
+    assert found[0].argument is usages[0][1]
+    assert all(u.argument.custom_type_fqdn == custom_type for u in found)
+
+    db.schemes.clear()
+    assert db.find_subprogram(routine.object_id, routine.subprogram_id)
+    db.reindex()
+    assert db.find_subprogram(routine.object_id, routine.subprogram_id) is None
+
+
+def test_compact_ir(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+):
+    ir = intermediate_representation.Abstract(
+        introspection.Inspect(dbsg_config_with_mocked_session).introspection()
+    ).intermediate_representation()
+    package = ir[0].schemes[0].packages[0]
+    routines = package.routines
+    routine = routines[0]
+    argument = routine.arguments[0]
+    for instance in (ir[0], package, routine, routine.fqdn, argument):
+        assert not hasattr(instance, '__dict__')
+
+    # Interned
+    assert routine.fqdn.schema is routines[-1].fqdn.schema
+    assert argument.in_out is sys.intern(f'{argument.in_out}')
+
+    # Derived of the current arguments
+    has_ins = routine.has_ins
+    added = replace(argument, in_out='out', defaulted=True)
+    routine.arguments.append(added)
+    assert routine.sorted_arguments[-1] is added
+    assert routine.has_ins == has_ins
+    routine.sorted_arguments.clear()
+    assert routine.sorted_arguments[-1] is added
+    routine.arguments[:] = [
+        replace(a, in_out='out', defaulted=False) for a in routine.arguments
+    ]
+    assert routine.sorted_arguments == routine.arguments
+    assert not routine.has_ins
+
+
+def test_stream(dbsg_config_with_catalog: configuration.Configuration):
+    conf = dbsg_config_with_catalog
+    conf.streaming = True
+    conf.databases[0].schemes.append(configuration.Schema(name='empty'))
+    abstract = intermediate_representation.Abstract(
+        introspection.Inspect(conf).introspection(),
+    )
+    streamed = list(abstract.stream())
+    ir = abstract.intermediate_representation()
+    assert [
+        (s.database, s.schema, s.package and asdict(s.package))
+        for s in streamed
+    ] == [
+        (db.name, schema.name, package and asdict(package))
+        for db in ir
+        for schema in db.schemes
+        for package in schema.packages or [None]
+    ]
+    assert streamed[-1].package is None
+    conf.disconnect()
+
+
 if __name__ == '__main__':
     main(['-s', '-c', 'setup_tox.ini'])
@@ -1,6 +1,11 @@
-from pytest import main
+from dataclasses import astuple
+from threading import active_count
+from unittest.mock import Mock
+
+from pytest import main, raises
 
 from dbsg.lib import configuration, introspection
+from dbsg.lib.catalog import Catalog
 
 
 def test_probably_supported_types():
@@ -19,33 +24,35 @@ def test_probably_supported_types():
 
 
 def test_introspection_row():
-    row = introspection.IntrospectionRow(
-        schema='BILLING',
-        package='BILLING_PAC',
-        is_package=1,
-        routine='CALC_BC',
-        routine_type='FUNCTION',
-        object_id=1,
-        overload=None,
-        subprogram_id=1,
-        argument='_DBSG_RESULT',
-        position=1,
-        sequence=1,
-        data_level=0,
-        data_type='NUMBER',
-        custom_type_schema=None,
-        custom_type_package=None,
-        custom_type=None,
-        defaulted='Y',
-        default_value=None,
-        in_out='OUT',
-    )
+    row, = introspection.IntrospectionRow.normalize([(
+        'BILLING',  # schema
+        'BILLING_PAC',  # package
+        1,  # is_package
+        'CALC_BC',  # routine
+        'FUNCTION',  # routine_type
+        1,  # object_id
+        None,  # overload
+        1,  # subprogram_id
+        '_DBSG_RESULT',  # argument
+        1,  # position
+        1,  # sequence
+        0,  # data_level
+        'NUMBER',  # data_type
+        None,  # custom_type_schema
+        None,  # custom_type_package
+        None,  # custom_type
+        'Y',  # defaulted
+        None,  # default_value
+        'OUT',  # in_out
+    )])
     assert row.schema == 'billing'
     assert isinstance(row.is_package, bool)
     assert row.overload == 0
     assert row.argument == '_dbsg_result'
     assert isinstance(row.defaulted, bool)
     assert row.defaulted
+    assert not hasattr(row, '__dict__')
+    assert introspection.IntrospectionRow.normalize([]) == []
 
 
 def test_introspection(
@@ -65,5 +72,285 @@ def test_introspection(
     assert row.data_type == 'varchar2'
 
 
+def test_incremental_introspection(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        monkeypatch,
+):
+    conf = dbsg_config_with_mocked_session
+    first = introspection.Inspect(conf).introspection()
+    assert (conf.snapshot_path / 'DB_NAME.BILLING.json').is_file()
+
+    # Nothing has changed, so nothing is saved
+    saved = []
+    save = introspection.Snapshot.save
+    monkeypatch.setattr(introspection.Snapshot, 'save', saved.append)
+    second = introspection.Inspect(conf).introspection()
+    assert saved == []
+    monkeypatch.setattr(introspection.Snapshot, 'save', save)
+    conf.full = True
+    full = introspection.Inspect(conf).introspection()
+
+    def rows(i):
+        return {s.name: [astuple(r) for r in s.rows] for s in i[0].schemes}
+
+    assert rows(first) == rows(second) == rows(full)
+
+    # Nothing is outdated, so the arguments aren't estimated
+    conf.full = False
+    db = conf.databases[0]
+    pool = db.connect()
+    connection = pool.acquire()
+    cursor_type = type(connection.cursor())
+    pool.release(connection)
+    statements = []
+    execute = cursor_type.execute
+
+    def spy(cursor, sql, *args):
+        statements.append(sql)
+        return execute(cursor, sql, *args)
+
+    monkeypatch.setattr(cursor_type, 'execute', spy)
+    plan = introspection.Inspect(conf).plan(pool, db.schemes[0], db)
+    assert plan.statements == []
+    assert statements == [introspection.INTROSPECTION_OBJECTS_SQL]
+
+
+def test_incremental_mixed_case_introspection(
+        dbsg_config_with_catalog: configuration.Configuration,
+):
+    # A quoted mixed-case package is re-fetched by its name as is in the DB
+    conf = dbsg_config_with_catalog
+    db = conf.databases[0]
+    goodies = db.schemes[2]
+    catalog = Catalog(db.catalog)
+    catalog.load([
+        (goodies.name, 'MixedPkg', 1, 'Proc', 'PROCEDURE', 300000, None, 1,
+         'IN_X', 1, 1, 0, 'NUMBER', None, None, None, 'N', None, 'IN'),
+    ])
+
+    def mixed():
+        schemes = introspection.Inspect(conf).introspection()[0].schemes
+        return [r for r in schemes[2].rows if r.package == 'mixedpkg']
+
+    assert len(mixed()) == 1
+    with catalog.keeper:
+        catalog.keeper.execute(
+            'update sys.all_objects set last_ddl_time = ? '
+            + 'where object_name = ?',
+            ('2020-05-01 00:00:00', 'MixedPkg'),
+        )
+    catalog.close()
+
+    # Outdated, so re-fetched (and not dropped from the merged snapshot)
+    assert len(mixed()) == 1
+    conf.disconnect()
+
+
+def test_snapshot(dbsg_config: configuration.Configuration, tmp_path):
+    schema = dbsg_config.databases[0].schemes[0]
+    obj = introspection.IntrospectionObject
+    snapshot = introspection.Snapshot.load(tmp_path / 'snap.json', schema)
+    assert snapshot.outdated({'pkg': obj('package', 't1')}) == (None, None)
+
+    row = introspection.IntrospectionRow.restore(
+        ('s', 'pkg', True, 'r', 'procedure', 1, 0, 1, 'a', 1, 1, 0,
+         'number', None, None, None, False, None, 'in'),
+    )
+    objects = {'pkg': obj('package', 't1'), 'proc': obj('procedure', 't1')}
+    assert snapshot.merge(objects, [row]) == [row]
+    snapshot.save()
+
+    snapshot = introspection.Snapshot.load(tmp_path / 'snap.json', schema)
+    assert snapshot.objects['pkg'].rows == [row]
+
+    changed = {'pkg': obj('package', 't1'), 'proc': obj('procedure', 't2')}
+    assert snapshot.outdated(changed) == (set(), {'proc'})
+    assert snapshot.merge({'proc': obj('procedure', 't2')}, [], {'proc'}) == []
+    assert 'pkg' not in snapshot.objects
+
+    # The rows are in the order of the objects (the DB order), not sorted
+    def package_row(package):
+        return introspection.IntrospectionRow.restore(
+            ('s', package, True, 'r', 'procedure', 1, 0, 1, 'a', 1, 1, 0,
+             'number', None, None, None, False, None, 'in'),
+        )
+    billing, utils = package_row('billing_pkg'), package_row('bill_utils_pkg')
+    objects = {
+        'billing_pkg': obj('package', 't1'),
+        'bill_utils_pkg': obj('package', 't1'),
+    }
+    assert snapshot.merge(objects, [utils, billing]) == [billing, utils]
+
+
+def test_statement(dbsg_config: configuration.Configuration):
+    billing, tickets, _ = dbsg_config.databases[0].schemes
+    sql, binds = introspection.Inspect.statement(billing)
+    assert 'union all' in sql
+    assert 'table(:excluded_packages)' in sql
+    assert binds['excluded_packages'] == ['NASTY_BILLS']
+    assert binds['excluded_routines'] == ['HORRIBLE_PKG.OH_NO']
+    assert binds['excluded_routines_no_pkg'] == ['ESPESIALLY_NASTY_ROUTINE']
+    assert binds['no_package_name'] == 'BILLING_NO_PKG'
+
+    # The SQL text doesn't depend on the filter values
+    billing.excluded_packages = [f'PKG_{i}' for i in range(1000)]
+    assert introspection.Inspect.statement(billing)[0] == sql
+
+    sql, binds = introspection.Inspect.statement(billing, {'PKG'}, set())
+    assert 'union all' not in sql
+    assert binds['packages'] == ['PKG']
+    assert 'no_package_name' not in binds
+    assert 'excluded_routines_no_pkg' not in binds
+
+    sql, binds = introspection.Inspect.statement(tickets)
+    assert 'union all' not in sql
+    assert binds['included_routines_no_pkg'] == [
+        'AND_THAT_ONE',
+        'ONLY_THIS_ONE',
+    ]
+
+    sql, _ = introspection.Inspect.statement(tickets, set(), set())
+    assert sql is None
+
+
+def test_shards(dbsg_config: configuration.Configuration):
+    schema = dbsg_config.databases[0].schemes[0]
+    obj = introspection.IntrospectionObject
+    objects = {
+        'a_pkg': obj('package', 't', 3, 'A_PKG'),
+        'b_pkg': obj('package', 't', 2, 'B_PKG'),
+        'c_pkg': obj('package', 't', 1, 'C_PKG'),
+        'proc': obj('procedure', 't', 4, 'PROC'),
+    }
+    shards = introspection.Inspect.shards
+    assert shards(schema, objects, None, None) == [(None, None)]
+
+    schema.shards = [['A_PKG']]
+    schema.shard_size = 1
+    assert shards(schema, objects, None, None) == [
+        ({'a_pkg'}, set()),
+        ({'c_pkg'}, set()),
+        ({'b_pkg'}, set()),
+        (set(), None),
+    ]
+    assert shards(schema, objects, {'b_pkg'}, set()) == [({'b_pkg'}, set())]
+
+    # The listed names are matched as is (quoted), or as unquoted
+    objects['mixedpkg'] = obj('package', 't', 5, 'MixedPkg')
+    schema.shards = [['MixedPkg', 'c_pkg']]
+    schema.shard_size = None
+    assert shards(schema, objects, None, set()) == [
+        ({'mixedpkg', 'c_pkg'}, set()),
+        ({'b_pkg', 'a_pkg'}, set()),
+    ]
+
+
+def test_sharded_plan(
+        dbsg_config_with_catalog: configuration.Configuration
+):
+    conf = dbsg_config_with_catalog
+    conf.full = True
+    db = conf.databases[0]
+    goodies = db.schemes[2]
+    inspect = introspection.Inspect(conf)
+    pool = db.connect()
+
+    def rows(plan):
+        merged = inspect.finish(plan, [
+            inspect.fetch(pool, statement) for statement in plan.statements
+        ]).rows
+        return [astuple(row) for row in merged]
+
+    plan = inspect.plan(pool, goodies, db)
+    assert len(plan.statements) == 1
+    assert plan.statements[0].cost == 8
+    unsharded = rows(plan)
+
+    goodies.shard_size = 1
+    plan = inspect.plan(pool, goodies, db)
+    assert len(plan.statements) == 2
+    assert plan.statements[0].binds['packages'] == ['GOODS_PKG']
+    assert [s.cost for s in plan.statements] == [8, 0]
+
+    # Merged in the order of a single statement
+    assert rows(plan) == unsharded
+    for schema in db.schemes:
+        schema.shard_size = None
+        unsharded = rows(inspect.plan(pool, schema, db))
+        schema.shard_size = 1
+        assert rows(inspect.plan(pool, schema, db)) == unsharded
+    conf.disconnect()
+
+
+def test_strategies(dbsg_config: configuration.Configuration):
+    billing = dbsg_config.databases[0].schemes[0]
+    strategies = introspection.STRATEGIES
+    sql, binds = introspection.Inspect.statement(billing)
+    assert 'all_procedures' in sql
+    assert '{package}' not in sql
+
+    arguments = introspection.Inspect.statement(
+        billing,
+        strategy=strategies['arguments'],
+    )
+    assert 'all_procedures' not in arguments[0]
+    assert 'aa.package_name not in' in arguments[0]
+    assert arguments[1] == binds
+
+    dba = introspection.Inspect.statement(billing, strategy=strategies['dba'])
+    assert 'all_' not in dba[0]
+    assert dba[1] == binds
+
+    # The configured ones are validated by their names
+    assert set(strategies) == set(configuration.INTROSPECTION_STRATEGIES)
+    db = dbsg_config.databases[0]
+    db.strategy = 'unknown'
+    with raises(ValueError):
+        introspection.Inspect.strategy(db)
+
+
+def test_compare_strategies(
+        dbsg_config_with_mocked_session: configuration.Configuration
+):
+    comparisons = introspection.Inspect(
+        dbsg_config_with_mocked_session,
+    ).compare_strategies()
+    assert len(comparisons) == 3 * len(introspection.STRATEGIES)
+    assert all(c.equal and c.rows for c in comparisons)
+    assert 'BILLING [arguments]' in str(comparisons[1])
+
+
+def test_streaming_introspection(
+        dbsg_config_with_mocked_session: configuration.Configuration
+):
+    conf = dbsg_config_with_mocked_session
+    conf.full = True
+    whole = introspection.Inspect(conf).introspection()
+    conf.streaming = True
+    conf.arraysize = 1
+    streaming = introspection.Inspect(conf).introspection()
+
+    for w, s in zip(whole[0].schemes, streaming[0].schemes):
+        assert isinstance(s.rows, introspection.RowStream)
+        assert [astuple(r) for r in w.rows] == [astuple(r) for r in s.rows]
+
+    # The consumer may stop early, the producer won't hang
+    threads = active_count()
+    for _ in streaming[0].schemes[0].rows:
+        break
+    assert active_count() == threads
+
+    # The failed acquire is raised, instead of hanging the consumer
+    rows = streaming[0].schemes[0].rows
+    released = []
+    rows.session_pool = Mock(
+        acquire=Mock(side_effect=RuntimeError('Timed out.')),
+        release=released.append,
+    )
+    with raises(RuntimeError):
+        list(rows)
+    assert released == []
+
+
 if __name__ == '__main__':
     main(['-s', '-c', 'setup_tox.ini'])
@@ -0,0 +1,537 @@
+import sys
+from dataclasses import asdict
+from importlib.util import cache_from_source
+from json import dumps, loads
+from pathlib import Path
+from threading import Thread
+
+from pytest import main, raises
+
+from dbsg.lib import configuration, introspection, intermediate_representation
+from dbsg.lib.plugin import Handler, PluginABC
+from dbsg.plugins import python3_7_plugin, raw_introspection_plugin
+from dbsg.plugins.json_plugin import JSONPlugin, JSONRecords
+
+
+def read(path):
+    return {p.relative_to(path): p.read_bytes() for p in path.rglob('*.*')}
+
+
+def test_stream(
+        dbsg_config_with_catalog: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_catalog
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['python3.7', 'json']
+    conf.plugin_options = {'json': {'shard': 'records'}}
+    conf.streaming = True
+    # A Schema without packages
+    conf.databases[0].schemes.append(configuration.Schema(name='empty'))
+
+    # Phased
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+    for plugin in Handler(conf, inspected, ir):
+        plugin.save()
+    phased = read(conf.path)
+    for path in phased:
+        (conf.path / path).unlink()
+
+    # Streamed
+    inspected = introspection.Inspect(conf).introspection()
+    handler = Handler(conf, inspected, [])
+    streamed = handler.stream(
+        intermediate_representation.Abstract(inspected).stream(),
+    )
+    conf.disconnect()
+    assert streamed == ir
+    assert phased
+    assert Path('db_name', 'empty', '__init__.py') in phased
+    assert read(conf.path) == phased
+
+
+def test_stream_fetched_once(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        monkeypatch,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['python3.7', 'raw-introspection']
+    conf.streaming = True
+    pool = conf.databases[0].connect()
+    connection = pool.acquire()
+    cursor_type = type(connection.cursor())
+    pool.release(connection)
+    statements = []
+    execute = cursor_type.execute
+    planning = (
+        introspection.INTROSPECTION_OBJECTS_SQL,
+        introspection.INTROSPECTION_ESTIMATE_SQL,
+    )
+
+    def spy(cursor, sql, *args):
+        if sql not in planning:
+            statements.append(sql)
+        return execute(cursor, sql, *args)
+
+    monkeypatch.setattr(cursor_type, 'execute', spy)
+    inspected = introspection.Inspect(conf).introspection()
+    handler = Handler(conf, inspected, [])
+    handler.stream(intermediate_representation.Abstract(inspected).stream())
+    assert not handler.failed
+    assert len(statements) == len(conf.databases[0].schemes)
+    raw = conf.path / 'db_name' / 'db_name_raw.json'
+    assert loads(raw.read_text())
+
+
+def test_json(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['json']
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+    db = ir[0]
+
+    # The lazy encoding is the same as the asdict one
+    next(iter(Handler(conf, inspected, ir))).save()
+    path = conf.path.absolute() / db.name
+    assert (path / f'{db.name}.json').read_text(encoding='utf8') == dumps(
+        {db.name: asdict(db)},
+        ensure_ascii=False,
+        indent=4,
+    )
+    assert not (path / 'manifest.json').exists()
+
+    conf.plugin_options = {'json': {'shard': 'schema', 'indent': None}}
+    next(iter(Handler(conf, inspected, ir))).save()
+    manifest = loads((path / 'manifest.json').read_text(encoding='utf8'))
+    assert manifest['shard'] == 'schema'
+    assert [s['schema'] for s in manifest['shards']] == [
+        s.name for s in db.schemes
+    ]
+    schema = db.schemes[0]
+    assert loads((path / f'{schema.name}.json').read_text()) == {
+        schema.name: asdict(schema),
+    }
+
+    conf.plugin_options = {'json': {'shard': 'package'}}
+    next(iter(Handler(conf, inspected, ir))).save()
+    manifest = loads((path / 'manifest.json').read_text(encoding='utf8'))
+    package = schema.packages[0]
+    assert manifest['shards'][0] == {
+        'path': f'{schema.name}/{package.name}.json',
+        'schema': schema.name,
+        'package': package.name,
+    }
+    assert loads((path / manifest['shards'][0]['path']).read_text()) == {
+        package.name: asdict(package),
+    }
+    # The schema shards of the previous run are stale
+    assert not (path / f'{schema.name}.json').exists()
+
+    # The options of save are used by the streaming (consume) too
+    JSONPlugin(conf, inspected, ir).save(shard='records')
+    manifest = loads((path / 'manifest.json').read_text(encoding='utf8'))
+    assert manifest['shard'] == 'records'
+    assert manifest['shards'] == [
+        {'path': f'{db.name}.jsonl'},
+        {'path': f'{db.name}.index.json'},
+    ]
+    assert not (path / schema.name).exists()
+
+    # The dropped DBs are deleted with their shards
+    dropped = conf.path.absolute() / 'dropped'
+    dropped.mkdir()
+    (dropped / 'dropped.json').write_text('{}')
+    (dropped / 'manifest.json').write_text(dumps({
+        'shards': [{'path': 'dropped.json'}],
+    }))
+    JSONPlugin(conf, inspected, ir).save()
+    assert {p.name for p in path.iterdir()} == {f'{db.name}.json'}
+    assert not dropped.exists()
+
+    with raises(ValueError):
+        JSONPlugin(conf, inspected, ir, shard='routine')
+
+
+def test_json_records(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['json']
+    conf.plugin_options = {'json': {'shard': 'records'}}
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+    db = ir[0]
+    next(iter(Handler(conf, inspected, ir))).save()
+
+    path = conf.path / db.name / f'{db.name}.jsonl'
+    packages = [p for s in db.schemes for p in s.packages]
+    assert len(path.read_bytes().splitlines()) == len(packages)
+
+    with JSONRecords(path) as records:
+        for schema in db.schemes:
+            for package in schema.packages:
+                for routine in package.routines:
+                    assert routine.fqdn in records
+                    found = records.routines(str(routine.fqdn).lower())
+                    assert asdict(routine) in found
+                    assert records.record(routine.fqdn) == {
+                        'schema': schema.name,
+                        'package': asdict(package),
+                    }
+        assert 'BILLS.BILL_UTILS_PKG' in records
+        assert records.record('BILLS.MISSING') is None
+        assert records.routines('BILLS.MISSING') == []
+
+
+def test_raw_ndjson(
+        dbsg_config_with_catalog: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_catalog
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['raw-introspection']
+    conf.streaming = True
+    inspected = introspection.Inspect(conf).introspection()
+    expected = [
+        (schema.name.lower(), row)
+        for schema in inspected[0].schemes
+        for row in schema.rows
+    ]
+    assert expected
+
+    for compression, suffix in (
+        (None, ''),
+        ('gzip', '.gz'),
+    ):
+        conf.plugin_options = {
+            'raw-introspection': {
+                'format': 'ndjson',
+                'compression': compression,
+            },
+        }
+        next(iter(Handler(conf, inspected, []))).save()
+        path = conf.path / 'db_name' / f'db_name_raw.ndjson{suffix}'
+        assert list(raw_introspection_plugin.read_ndjson(path)) == expected
+    conf.disconnect()
+
+    with raises(ValueError):
+        raw_introspection_plugin.Plugin(
+            conf,
+            inspected,
+            [],
+            compression='gzip',
+        )
+
+
+def test_python_workers(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        monkeypatch,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    # The unforked workers import the CLI again
+    monkeypatch.setattr(sys, 'argv', ['dbsg'])
+    methods = []
+    get_context = python3_7_plugin.get_context
+
+    def spy(method=None):
+        context = get_context(method)
+        methods.append(context.get_start_method())
+        return context
+
+    monkeypatch.setattr(python3_7_plugin, 'get_context', spy)
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['python3.7']
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+
+    outputs = []
+    for options, forked, threaded in (
+        ({}, True, False),
+        ({'workers': 2, 'batch': 1}, True, False),
+        # E.g. spawn: the packages are pickled to the workers
+        ({'workers': 2, 'batch': 1}, False, False),
+        # E.g. the threaded plugin_workers: the process isn't forked
+        ({'workers': 2, 'batch': 1}, True, True),
+    ):
+        conf.plugin_options = {'python3.7': options}
+        plugin = next(iter(Handler(conf, inspected, ir)))
+        plugin.forked = forked
+        methods.clear()
+        if threaded:
+            thread = Thread(target=plugin.save)
+            thread.start()
+            thread.join()
+        else:
+            plugin.save()
+        # The context of the workers is the last one
+        inherited = bool(options) and forked and not threaded
+        assert ('fork' in methods[-1:]) == inherited
+        outputs.append(read(conf.path))
+        for path in outputs[-1]:
+            (conf.path / path).unlink()
+
+    # The streamed packages are pickled to the workers
+    Handler(conf, inspected, []).stream(
+        intermediate_representation.Abstract(inspected).stream(),
+    )
+    outputs.append(read(conf.path))
+    assert len(outputs[0]) > 3
+    assert all(output == outputs[0] for output in outputs)
+
+
+def test_python_unchanged(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        monkeypatch,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['python3.7']
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+
+    plugin = next(iter(Handler(conf, inspected, ir)))
+    plugin.save()
+    first = read(conf.path)
+    assert len(plugin.changed) == len(first)
+    mtimes = {path: (conf.path / path).stat().st_mtime_ns for path in first}
+
+    # Nothing is written, and the missing modules are written again
+    plugin.save()
+    assert plugin.changed == []
+    module = conf.path / 'generic.py'
+    module.unlink()
+    plugin.save()
+    assert plugin.changed == [module]
+    assert read(conf.path) == first
+    mtimes.pop(Path('generic.py'))
+    assert mtimes == {
+        path: (conf.path / path).stat().st_mtime_ns for path in mtimes
+    }
+
+    # A module is replaced, and the run fails before the manifest is saved:
+    # the module is written again by the next run, though it's the same
+    schema = ir[0].schemes[0]
+    package = next(p for p in schema.packages if p.routines)
+    routine = package.routines.pop()
+
+    def crash(*args):
+        raise RuntimeError('Crashed.')
+
+    with monkeypatch.context() as patched:
+        patched.setattr(python3_7_plugin.Plugin, 'delete_orphans', crash)
+        with raises(RuntimeError):
+            plugin.save()
+    assert read(conf.path) != first
+    package.routines.append(routine)
+    plugin.save()
+    assert read(conf.path) == first
+
+    # The modules of the removed packages are deleted
+    removed = schema.packages.pop()
+    plugin.save()
+    assert plugin.changed == []
+    orphan = Path('db_name', schema.name, f'{removed.name}.py')
+    assert orphan in first
+    assert read(conf.path) == {
+        path: data for path, data in first.items() if path != orphan
+    }
+    assert not list(conf.path.rglob('*.tmp'))
+
+    # Nothing is streamed, and all the previous modules are orphans
+    plugin = next(iter(Handler(conf, inspected, ir)))
+    plugin.finish()
+    assert set(read(conf.path)) == {Path('__init__.py'), Path('generic.py')}
+
+
+def test_python_compile(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        tmp_path,
+        monkeypatch,
+):
+    conf = dbsg_config_with_mocked_session
+    # The modules import the path (e.g. "import stubs.generic")
+    monkeypatch.chdir(tmp_path)
+    conf.path = Path('stubs')
+    conf.plugins = ['python3.7']
+    conf.plugin_options = {
+        'python3.7': {'compile': True, 'invalidation_mode': 'checked-hash'},
+    }
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+
+    plugin = next(iter(Handler(conf, inspected, ir)))
+    plugin.save()
+    modules = list(conf.path.absolute().rglob('*.py'))
+    assert sorted(plugin.compiled) == sorted(modules)
+    for module in modules:
+        assert Path(cache_from_source(str(module))).is_file()
+    plugin.save()
+    assert plugin.compiled == []
+
+    # A threaded process isn't forked to compile the modules either
+    monkeypatch.setattr(sys, 'argv', ['dbsg'])
+    monkeypatch.setattr(python3_7_plugin, 'COMPILE_CHUNK', 1)
+    methods = []
+    get_context = python3_7_plugin.get_context
+
+    def spy(method=None):
+        context = get_context(method)
+        methods.append(context.get_start_method())
+        return context
+
+    monkeypatch.setattr(python3_7_plugin, 'get_context', spy)
+    conf.plugin_options['python3.7']['workers'] = 2
+    for module in modules:
+        Path(cache_from_source(str(module))).unlink()
+    plugin = next(iter(Handler(conf, inspected, ir)))
+    thread = Thread(target=plugin.save)
+    thread.start()
+    thread.join()
+    assert sorted(plugin.compiled) == sorted(modules)
+    assert methods[-1] != 'fork'
+
+    # The syntax errors are reported with the routines' FQDNs
+    schema = ir[0].schemes[0]
+    package = next(p for p in schema.packages if p.routines)
+    module = conf.path.absolute() / 'db_name' / schema.name
+    module /= f'{package.name}.py'
+    lines = module.read_text(encoding='utf8').splitlines()
+    call = next(
+        index
+        for index, line in enumerate(lines)
+        if python3_7_plugin.CALL_NAME.match(line)
+    )
+    lines.insert(call + 1, '        ]')
+    module.write_text('\n'.join(lines), encoding='utf8')
+    fqdn = python3_7_plugin.routine_at('\n'.join(lines), call + 2)
+    assert fqdn.startswith(f'{schema.name}.{package.name}.'.upper())
+
+    error = python3_7_plugin.compile_module(
+        str(module),
+        plugin.invalidation_mode,
+    )
+    assert error.startswith(f'{fqdn} ({module}:')
+
+    # The module without bytecode is compiled, and the plugin fails
+    Path(cache_from_source(str(module))).unlink()
+    failed, = Handler(conf, inspected, ir).save()
+    assert isinstance(failed.error, ValueError)
+
+
+class FailingPlugin(PluginABC):
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @classmethod
+    def name(cls):
+        return 'test-failing'
+
+    def save(self, **kwargs):
+        raise ValueError('Failed.')
+
+
+class FailingStreamingPlugin(FailingPlugin):
+    STREAMING = True
+
+    @classmethod
+    def name(cls):
+        return 'test-failing-streaming'
+
+    def consume(self, streamed):
+        raise ValueError('Failed.')
+
+    def finish(self):
+        raise AssertionError('A failed plugin is never finished.')
+
+
+def test_parallel(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.plugins = ['json', 'python3.7', 'raw-introspection']
+    inspected = introspection.Inspect(conf).introspection()
+    ir = intermediate_representation.Abstract(
+        inspected,
+    ).intermediate_representation()
+
+    outputs = []
+    for workers, fork in ((1, False), (3, False), (3, True)):
+        conf.path = tmp_path / 'stubs'
+        conf.plugin_workers = workers
+        conf.plugin_fork = fork
+        handler = Handler(conf, inspected, ir)
+        runs = handler.save()
+        assert [r.name for r in runs] == conf.plugins
+        assert not handler.failed
+        outputs.append(read(conf.path))
+        for path in outputs[-1]:
+            (conf.path / path).unlink()
+    assert outputs[0]
+    assert outputs[0] == outputs[1] == outputs[2]
+
+    # A multithreaded process isn't forked
+    handler = Handler(conf, inspected, ir)
+    forkable = []
+    thread = Thread(target=lambda: forkable.append(handler.forkable()))
+    thread.start()
+    thread.join()
+    assert forkable == [False]
+
+    # The errors are collected, and the other plugins are saved anyway
+    conf.plugins = ['test-failing', 'json']
+    handler = Handler(conf, inspected, ir)
+    failing, saved = handler.save()
+    assert handler.failed
+    assert isinstance(failing.error, ValueError)
+    assert saved.error is None
+    assert (conf.path / 'db_name' / 'db_name.json').exists()
+
+
+def test_stream_failed(
+        dbsg_config_with_mocked_session: configuration.Configuration,
+        tmp_path,
+):
+    conf = dbsg_config_with_mocked_session
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['test-failing-streaming', 'python3.7', 'json']
+    conf.streaming = True
+    inspected = introspection.Inspect(conf).introspection()
+    handler = Handler(conf, inspected, [])
+    handler.stream(intermediate_representation.Abstract(inspected).stream())
+
+    # The other plugins are fed and saved anyway
+    failing, streamed, saved = handler.runs
+    assert handler.failed
+    assert isinstance(failing.error, ValueError)
+    assert streamed.name == 'python3.7' and streamed.error is None
+    assert saved.name == 'json' and saved.error is None
+    assert (conf.path / 'generic.py').exists()
+    assert (conf.path / 'db_name' / 'db_name.json').exists()
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
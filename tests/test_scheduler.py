@@ -0,0 +1,37 @@
+from pytest import main, raises
+
+from dbsg.lib import scheduler
+
+
+def test_scheduler():
+    started = []
+
+    def work(name):
+        started.append(name)
+        return name.upper()
+
+    s = scheduler.Scheduler()
+    s.add('db', 1, scheduler.Unit(target=work, args=('small',), cost=1))
+    s.add('db', 1, scheduler.Unit(target=work, args=('huge',), cost=100))
+    s.add('db', 1, scheduler.Unit(target=work, args=('medium',), cost=10))
+
+    # The results are in order of addition
+    assert s.run() == ['SMALL', 'HUGE', 'MEDIUM']
+    # The most expensive units go first
+    assert started == ['huge', 'medium', 'small']
+
+
+def test_scheduler_error():
+    def fail():
+        raise ValueError('oops')
+
+    s = scheduler.Scheduler()
+    s.add('db', 4, scheduler.Unit(target=fail))
+    s.add('another_db', 4, scheduler.Unit(target=int, args=('1',)))
+
+    with raises(ValueError):
+        s.run()
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])
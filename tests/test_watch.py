@@ -0,0 +1,43 @@
+from sqlite3 import connect
+
+from pytest import main
+
+from dbsg.lib import configuration, watch
+from dbsg.lib.intermediate_representation import Abstract
+
+
+def test_watch(dbsg_config_with_catalog: configuration.Configuration, tmp_path):
+    conf = dbsg_config_with_catalog
+    conf.path = tmp_path / 'stubs'
+    conf.plugins = ['json']
+    db = conf.databases[0]
+    keys = {(db.name, s.name) for s in db.schemes}
+
+    watcher = watch.Watch(conf, interval=0.01)
+    assert watcher.iterate() == keys
+    assert (conf.path / 'db_name' / 'db_name.json').exists()
+    assert watcher.iterate() == set()
+    billing = watcher.schemes[db.name, 'BILLING']
+
+    with connect(str(db.catalog)) as catalog:
+        catalog.execute(
+            "update all_objects set last_ddl_time = '2020-05-01 00:00:00' "
+            + "where object_name = 'GOODS_PKG'",
+        )
+    billing_ir = watcher.ir[db.name, 'billing']
+    assert watcher.iterate() == {(db.name, 'GOODIES')}
+    assert watcher.schemes[db.name, 'BILLING'] is billing
+    assert watcher.schemes[db.name, 'GOODIES'].rows
+    # Only the changed Schemes are built again; the IR is the same anyway
+    assert watcher.ir[db.name, 'billing'] is billing_ir
+    introspection = watcher.introspection(set())
+    assert watcher.intermediate_representation(introspection, set()) == (
+        Abstract(introspection).intermediate_representation()
+    )
+
+    watcher.run(iterations=2)
+    assert db.session_pool is None
+
+
+if __name__ == '__main__':
+    main(['-s', '-c', 'setup_tox.ini'])